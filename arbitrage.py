@@ -0,0 +1,130 @@
+import numpy as np
+import onchain_data
+
+#-------------------------------------------- ARBITRAGE REBALANCING ----------------------------------------------------#
+# After a large GNS buy in one pool, arbitrageurs buy GNS in the other pools and sell it in the shocked one until the prices
+# line up again (within the pool fees). This is what spreads a trade over the liquidity of Arbitrum and Polygon.
+# Every pool is x*y=k with GNS as token 0 and its quote token valued in USD, so pools quoted in WETH, USDC or DAI compare.
+# The arbitrage between two pools is solved in closed form and vectorized across the trade sizes
+
+# Optimal USD input of the arbitrage buying GNS in pool a and selling it in pool b, and the USD profit
+# Chaining the two constant product swaps gives a virtual pool (e_in, e_out), whose optimal input is
+# (sqrt(g_a * e_in * e_out) - e_in) / g_a, and it is 0 when prices are already within the fees
+def pair_arbitrage(gns_a, usd_a, fee_a, gns_b, usd_b, fee_b):
+    g_a, g_b = 1 - fee_a, 1 - fee_b
+    e_in = usd_a * gns_b / (gns_b + g_b * gns_a)
+    e_out = g_b * gns_a * usd_b / (gns_b + g_b * gns_a)
+    amount_in = np.maximum((np.sqrt(g_a * e_in * e_out) - e_in) / g_a, 0)
+    amount_out = e_out * g_a * amount_in / (e_in + g_a * amount_in)
+    return amount_in, amount_out - amount_in
+
+# Zero fee equilibrium: every pool ends at the same price p and arbitrageurs end flat in GNS, so
+# sum(sqrt(k_i / p)) = sum(gns_i), which gives p = (sum(sqrt(k_i)) / sum(gns_i)) ** 2
+def equilibrium_price(gns, usd):
+    gns, usd = np.asarray(gns, dtype = float), np.asarray(usd, dtype = float)
+    return (np.sqrt(gns * usd).sum(axis = -1) / gns.sum(axis = -1)) ** 2
+
+
+class ArbitrageSimulator:
+    """Cross pool arbitrage after a GNS buy
+
+    Parameters
+    reserves: {pool_name: (reserve0, reserve1)} in token units, GNS being token 0
+    token_prices: USD price of the quote tokens, as returned by onchain_data.get_token_prices
+    extra_pools: {pool_name: {'token1': ..., 'fee': ...}} for pools not described in onchain_data.pools (e.g. Polygon)
+    """
+    def __init__(self, reserves, token_prices, extra_pools = None):
+        pool_info = {info['pool_name']: info for info in onchain_data.pools.values() if info['pool_name'] is not None}
+        pool_info.update(extra_pools or {})
+        self.pool_names = list(reserves)
+        self.gns = np.array([reserves[name][0] for name in self.pool_names], dtype = float)
+        self.usd = np.array([reserves[name][1] * token_prices[pool_info[name]['token1']] for name in self.pool_names], dtype = float)
+        self.fees = np.array([pool_info[name]['fee'] for name in self.pool_names], dtype = float)
+
+    def simulate(self, pool, trade_sizes_usd, tol = 1e-6, max_passes = 1000):
+        """Buy GNS with each trade size in `pool`, then arbitrage it against every other pool
+
+        Every pass runs the closed form pair arbitrage over each ordered pair of pools, starting from the shocked pool.
+        Passes are repeated until no pair has an arbitrage larger than `tol` USD left, for any trade size, so every
+        pair of prices ends within its fee band. The bands are reached in a few passes (4 for the GNS pools, up to a
+        1e7 USD trade), so max_passes is only a safety bound on the passes run, the last one finding nothing left
+        included: RuntimeError is raised when it is reached. Without any fee there is no band, the prices only get
+        closer at every pass, so that case is solved in closed form with equilibrium_price instead (0 passes).
+        Returns a dict of (trade sizes x pools) arrays: gns and usd reserves, GNS price in USD and the arbitrage USD
+        flow through each pool, plus the GNS bought by the trade, the price impact before and after arbitrage and the
+        number of passes that moved reserves
+        """
+        shocked = self.pool_names.index(pool)
+        trade_sizes_usd = np.asarray(trade_sizes_usd, dtype = float)
+        gns = np.tile(self.gns, (len(trade_sizes_usd), 1))
+        usd = np.tile(self.usd, (len(trade_sizes_usd), 1))
+        price_before = self.usd[shocked] / self.gns[shocked]
+
+        effective = trade_sizes_usd * (1 - self.fees[shocked])
+        gns_bought = gns[:, shocked] * effective / (usd[:, shocked] + effective)
+        usd[:, shocked] += effective
+        gns[:, shocked] -= gns_bought
+        impact_before_arbitrage = (usd[:, shocked] / gns[:, shocked] / price_before - 1) * 100
+
+        if self.fees.any():
+            arbitrage_flow, profit, passes = self._arbitrage_passes(gns, usd, shocked, tol, max_passes)
+        else:
+            arbitrage_flow, profit, passes = self._zero_fee_arbitrage(gns, usd)
+
+        price = usd / gns
+        return {
+            'pool_names': self.pool_names,
+            'gns': gns,
+            'usd': usd,
+            'price': price,
+            'arbitrage_flow_usd': arbitrage_flow,
+            'arbitrage_profit_usd': profit,
+            'gns_bought': gns_bought,
+            'impact_before_arbitrage': impact_before_arbitrage,
+            'impact_after_arbitrage': (price[:, shocked] / price_before - 1) * 100,
+            'passes': passes
+        }
+
+    # Arbitrage passes over every ordered pair of pools, updating gns and usd in place. Returns the USD flow through each
+    # pool, the arbitrage profit of each trade size and the number of passes that moved reserves
+    def _arbitrage_passes(self, gns, usd, shocked, tol, max_passes):
+        arbitrage_flow = np.zeros_like(usd)
+        profit = np.zeros(len(usd))
+        pairs = [(i, j) for i in range(len(self.pool_names)) for j in range(len(self.pool_names)) if i != j]
+        pairs.sort(key = lambda pair: shocked not in pair)
+        passes = 0
+        while True:
+            largest = 0.0
+            for buy_pool, sell_pool in pairs:
+                amount_in, pair_profit = pair_arbitrage(gns[:, buy_pool], usd[:, buy_pool], self.fees[buy_pool],
+                                                        gns[:, sell_pool], usd[:, sell_pool], self.fees[sell_pool])
+                largest = max(largest, amount_in.max(initial = 0.0))
+                effective_in = amount_in * (1 - self.fees[buy_pool])
+                gns_moved = gns[:, buy_pool] * effective_in / (usd[:, buy_pool] + effective_in)
+                effective_gns = gns_moved * (1 - self.fees[sell_pool])
+                usd_out = usd[:, sell_pool] * effective_gns / (gns[:, sell_pool] + effective_gns)
+
+                usd[:, buy_pool] += effective_in
+                gns[:, buy_pool] -= gns_moved
+                gns[:, sell_pool] += effective_gns
+                usd[:, sell_pool] -= usd_out
+                arbitrage_flow[:, buy_pool] += amount_in
+                arbitrage_flow[:, sell_pool] -= usd_out
+                profit += pair_profit
+            # A pass without arbitrage above tol leaves the reserves as they were: every pair is within its fee band
+            if largest <= tol:
+                break
+            passes += 1
+            if passes >= max_passes:
+                raise RuntimeError(f'Arbitrage not converged after {max_passes} passes, {largest:.6g} USD left between two pools')
+        return arbitrage_flow, profit, passes
+
+    # Every pool moved along its curve to the equilibrium price, updating gns and usd in place. The USD flow through a pool
+    # is the change of its USD reserve, and the arbitrageurs keep what leaves the pools
+    def _zero_fee_arbitrage(self, gns, usd):
+        price = equilibrium_price(gns, usd)[:, None]
+        k = gns * usd
+        arbitrage_flow = np.sqrt(k * price) - usd
+        gns[:] = np.sqrt(k / price)
+        usd += arbitrage_flow
+        return arbitrage_flow, -arbitrage_flow.sum(axis = 1), 0
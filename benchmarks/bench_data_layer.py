@@ -0,0 +1,93 @@
+"""Benchmarks of the data layer against the local mock server (mock_server.py), no API key or network needed
+
+Measures Flipside query throughput through the real SDK at several concurrency levels, the share of queries surviving
+injected failures, and CoinGecko price reads direct vs through the in-memory price service.
+
+Usage (from the repository root)
+    python benchmarks/bench_data_layer.py --latency 0.2 --failure-rate 0.1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mock_server
+import onchain_data
+import price_service
+import query_data
+
+CONCURRENCY = [1, 4, 8]
+# Distinct queries of one dashboard refresh: every category of the Arbitrum pools template since several start dates
+START_DATES = ['2023-01-01', '2023-02-01', '2023-03-01', '2023-04-01']
+
+def dashboard_queries(recordings):
+    queries = {}
+    for start_date in START_DATES:
+        for category in onchain_data.ARB_CATEGORIES[:4]:
+            recordings.synthesize('swap_arb_pools', category, 'day', start_date)
+            queries[f'{category}-{start_date}'] = (onchain_data.swap_arb_pools, category, 'day', start_date)
+    return queries
+
+def bench_queries(queries):
+    results = {}
+    for concurrency in CONCURRENCY:
+        query_data._clients.clear()
+        start = time.perf_counter()
+        frames = query_data.query_many(queries, max_concurrency = concurrency)
+        elapsed = time.perf_counter() - start
+        ok = sum(frame is not None for frame in frames.values())
+        results[f'query_many[concurrency={concurrency}]'] = {
+            'time_ms': elapsed * 1000,
+            'queries_per_sec': len(queries) / elapsed,
+            'success_rate': ok / len(queries)
+        }
+    return results
+
+def bench_prices(repeat = 20):
+    ok = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            onchain_data.get_token_prices()
+            ok += 1
+        except Exception:
+            pass
+    direct = (time.perf_counter() - start) / repeat
+
+    service = price_service.PriceService(snapshot_path = None)
+    service.refresh()
+    start = time.perf_counter()
+    for _ in range(repeat * 1000):
+        service.get()
+    cached = (time.perf_counter() - start) / (repeat * 1000)
+    return {'get_token_prices': {'time_ms': direct * 1000, 'success_rate': ok / repeat},
+            'PriceService.get': {'time_ms': cached * 1000}}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type = float, default = 0.2, help = 'seconds added to every mock API call')
+    parser.add_argument('--jitter', type = float, default = 0.0)
+    parser.add_argument('--failure-rate', type = float, default = 0.0)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', help = 'also write the results to this JSON file')
+    args = parser.parse_args()
+
+    recordings = mock_server.Recordings()
+    queries = dashboard_queries(recordings)
+    faults = mock_server.Faults(args.latency, args.jitter, args.failure_rate, args.seed)
+    with mock_server.MockServer(recordings, faults) as server:
+        query_data.flipside_url = server.url
+        onchain_data.COINGECKO_URL = f'{server.url}/api/v3'
+        results = {**bench_queries(queries), **bench_prices()}
+
+    print(f"{'benchmark':<40} {'metric':<16} {'value':>12}")
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            print(f'{name:<40} {metric:<16} {value:>12.3f}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'latency': args.latency, 'failure_rate': args.failure_rate, 'results': results}, f, indent = 2)
@@ -0,0 +1,207 @@
+"""Benchmarks for the slippage simulator and the Dash chart callback
+
+Measures throughput and peak memory of query_data.AMM_contract (and its vectorized engine) across step counts and
+reserve sizes, and the full app.generate_charts work (simulation, figure build and serialization) with stubbed token
+prices, so no network call is made, cold and served from the per scenario chart cache.
+The figure build of figures.simulator_figures is also measured next to px_figures, the Plotly Express build the app used
+before, kept as a reference for the time and payload the figure dicts save.
+
+The baseline is recorded with the versions pinned in requirements.txt. A run fails (exit code 1) when a time is more
+than --tolerance above the baseline (plus TIME_SLACK_MS of timer noise), or a peak memory or payload more than
+--memory-tolerance above it.
+
+Usage (from the repository root)
+    python benchmarks/bench_simulator.py                   compare against benchmarks/baseline.json
+    python benchmarks/bench_simulator.py --save-baseline   store the current results as the new baseline
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+import figures
+import price_service
+import query_data
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# Prices of the simulated scenarios, also served by the app's price service during the benchmark
+STUB_PRICES = {'DAI': 1.0, 'WETH': 1800.0, 'GNS': 5.0, 'MATIC': 1.1, 'USDC': 1.0}
+
+STEP_COUNTS = [20, 200, 2000, 20000]
+RESERVE_SIZES = [1e3, 1e6]
+# Animation frames of the bar charts in the callback (20 in the app)
+CHART_STEP_COUNTS = [20, 100]
+
+# Relative increase over the baseline counted as a regression, for times and for memory (peak_kb, payload_kb)
+TIME_TOLERANCE = 1.0
+MEMORY_TOLERANCE = 0.1
+# Absolute slack on times, sub millisecond runs being dominated by timer and scheduler noise
+TIME_SLACK_MS = 1.0
+
+def measure(f, repeat = 5):
+    """Best wall time in ms over `repeat` runs, and peak traced memory in KB of one extra run.
+    The garbage collector is off during the timed runs, as in timeit"""
+    timings = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            f()
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        gc.enable()
+    tracemalloc.start()
+    f()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'time_ms': min(timings), 'peak_kb': peak / 1024}
+
+def bench_amm():
+    results = {}
+    for reserve in RESERVE_SIZES:
+        for step in STEP_COUNTS:
+            args = dict(in_amount = 4 * reserve, in_price_usd = 1.0, out_amount = reserve, out_price_usd = 5.0,
+                        deposit_limit = reserve / 5, token_from = 'USDC', step = step)
+            for name, f in (('AMM_contract', query_data.AMM_contract), ('AMM_contract_vectorized', query_data.AMM_contract_vectorized)):
+                result = measure(lambda: f(**args))
+                result['steps_per_sec'] = step / result['time_ms'] * 1000
+                results[f'{name}[reserve={reserve:g},step={step}]'] = result
+    return results
+
+# Reference: the four simulator figures as the app built them with Plotly Express, from the simulation table
+def px_figures(df, token1):
+    margin = dict(l = 10, r = 10, b = 10, t = 10, pad = 0)
+    df_melt = df.melt(id_vars = ['token_deposit'], value_vars = [token1, 'GNS'], var_name = 'Token', value_name = 'Reserve')
+    fig_reserve = px.bar(df_melt, x = 'Token', y = 'Reserve', color = 'Token', animation_frame = 'token_deposit',
+                         range_y = [0, df[[token1, 'GNS']].max().max() + 5], height = 500)
+    fig_reserve.update_layout(autosize = True, margin = margin, showlegend = False)
+
+    flows = ['Amount_IN_USD', 'Amount_OUT_USD', 'Slippage_USD']
+    df_melt_flow = df.melt(id_vars = ['token_deposit'], value_vars = flows, var_name = 'Token Flow', value_name = 'Volume [USD]')
+    fig_flow = px.bar(df_melt_flow, x = 'Token Flow', y = 'Volume [USD]', color = 'Token Flow', animation_frame = 'token_deposit',
+                      range_y = [0, df[flows].max().max() + 5], height = 500)
+    fig_flow.update_layout(autosize = True, margin = margin, showlegend = False)
+
+    df_line = df.rename(columns = {'token_deposit': f'{token1} Deposit'})
+    fig_slippage = px.line(df_line, x = f'{token1} Deposit', y = 'GNS Slippage percent', height = 450)
+    fig_slippage.update_layout(autosize = True, margin = margin, showlegend = False)
+
+    fig_price = make_subplots(rows = 1, cols = 1, specs = [[{'secondary_y': True}]])
+    fig_price.add_trace(go.Scatter(x = df_line[f'{token1} Deposit'], y = df_line[f'Price of GNS in {token1}'], mode = 'lines', name = 'GNS'),
+                        secondary_y = False)
+    fig_price.add_trace(go.Scatter(x = df_line[f'{token1} Deposit'], y = df_line[f'Price of {token1} in GNSD'], mode = 'lines', name = token1),
+                        secondary_y = True)
+    fig_price.update_xaxes(title_text = f'{token1} Deposit')
+    fig_price.update_yaxes(title_text = f'Price of GNS in {token1}', secondary_y = False)
+    fig_price.update_yaxes(title_text = f'Price of {token1} in GNS', secondary_y = True)
+    fig_price.update_layout(autosize = True, margin = margin)
+    return fig_reserve, fig_flow, fig_slippage, fig_price
+
+def bench_figures():
+    """Figure build and serialization of one simulation, with figures.simulator_figures and with the px reference"""
+    simulation = query_data.AMMSimulation(4000, STUB_PRICES['USDC'], 1000, STUB_PRICES['GNS'], 'USDC')
+    results = {}
+    for step in CHART_STEP_COUNTS:
+        arrays = simulation.table_arrays(200, step = step)
+        df = simulation.table(200, step = step)
+        for name, build in (('simulator_figures', lambda: figures.simulator_figures(arrays, 'USDC')),
+                            ('px_figures', lambda: px_figures(df, 'USDC'))):
+            run = lambda: json.dumps(build(), cls = plotly.utils.PlotlyJSONEncoder)
+            result = measure(run, repeat = 3)
+            result['payload_kb'] = len(run()) / 1024
+            results[f'{name}[step={step}]'] = result
+    return results
+
+def bench_charts():
+    import app
+    # No CoinGecko call and no snapshot file, so a benchmark run never overwrites the prices the app falls back on
+    app.prices = price_service.PriceService(snapshot_path = None, fetch = lambda: dict(STUB_PRICES))
+
+    results = {}
+    for step in CHART_STEP_COUNTS:
+        def run():
+            # Fresh simulation each run, so the whole callback is measured and not the caches
+            app.simulations.clear()
+            charts = app.build_charts('USDC', 1000, 4000, 200, STUB_PRICES['USDC'], STUB_PRICES['GNS'], step = step)
+            return json.dumps(charts, cls = plotly.utils.PlotlyJSONEncoder)
+        result = measure(run, repeat = 3)
+        result['payload_kb'] = len(run()) / 1024
+        results[f'generate_charts[step={step}]'] = result
+
+    # Repeated scenario: charts served from app.chart_cache, only the serialization is left
+    data = {'USDC': STUB_PRICES['USDC'], 'GNS': STUB_PRICES['GNS']}
+    app.chart_cache.clear()
+    app.generate_charts(1, 'USDC', data, 1000, 4000, 200)
+    results['generate_charts[cached]'] = measure(
+        lambda: json.dumps(app.generate_charts(1, 'USDC', data, 1000, 4000, 200), cls = plotly.utils.PlotlyJSONEncoder))
+    return results
+
+def regressed(metric, value, base, time_tolerance, memory_tolerance):
+    if metric == 'time_ms':
+        return value > base * (1 + time_tolerance) + TIME_SLACK_MS
+    if metric in ('peak_kb', 'payload_kb'):
+        return value > base * (1 + memory_tolerance)
+    return False # steps_per_sec follows time_ms
+
+def compare(results, baseline, time_tolerance = TIME_TOLERANCE, memory_tolerance = MEMORY_TOLERANCE):
+    """Print the results next to the baseline. Returns the (benchmark, metric) pairs that regressed"""
+    regressions = []
+    print(f"{'benchmark':<60} {'metric':<14} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(name, {}).get(metric)
+            change = f'{(value / base - 1) * 100:+.1f}%' if base else 'new'
+            flag = ''
+            if base is not None and regressed(metric, value, base, time_tolerance, memory_tolerance):
+                regressions.append((name, metric))
+                flag = '  REGRESSION'
+            base = f'{base:.3f}' if base is not None else '-'
+            print(f'{name:<60} {metric:<14} {base:>12} {value:>12.3f} {change:>9}{flag}')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'write the results to benchmarks/baseline.json')
+    parser.add_argument('--output', help = 'also write the results to this JSON file')
+    parser.add_argument('--tolerance', type = float, default = TIME_TOLERANCE, help = 'allowed relative increase of the times')
+    parser.add_argument('--memory-tolerance', type = float, default = MEMORY_TOLERANCE,
+                        help = 'allowed relative increase of peak memory and payload sizes')
+    args = parser.parse_args()
+
+    np.seterr(all = 'ignore')
+    versions = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__, 'plotly': plotly.__version__}
+    results = {**bench_amm(), **bench_figures(), **bench_charts()}
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        mismatch = {name: (baseline.get(name), version) for name, version in versions.items() if baseline.get(name) != version}
+        if mismatch:
+            print('Baseline recorded with other versions, the comparison is not meaningful: ' +
+                  ', '.join(f'{name} {base} (now {version})' for name, (base, version) in mismatch.items()))
+    regressions = compare(results, baseline.get('results', {}), args.tolerance, args.memory_tolerance)
+
+    report = {**versions, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2)
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(report, f, indent = 2)
+    elif regressions:
+        print(f'{len(regressions)} regression(s) against {BASELINE_PATH}')
+        sys.exit(1)
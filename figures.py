@@ -0,0 +1,99 @@
+import plotly.io as pio
+
+#--------------------------------------------------- SIMULATOR FIGURES -------------------------------------------------#
+# Figures of the simulator built straight from the AMM_arrays of query_data.AMMSimulation, as plain figure dicts.
+# Plotly Express animations (melt + px.bar(animation_frame=...)) repeat every trace attribute in each frame; here a frame
+# only carries the new bar heights, and nothing goes through DataFrames or the go.Figure validators. The dicts only hold
+# lists and numbers, so they are cached as they are and serialized by Dash with a plain JSON dump
+
+COLORS = ['#636efa', '#EF553B', '#00cc96']
+MARGIN = dict(l=10, r=10, b=10, t=10, pad=0)
+# Default template of Plotly Express, so the figures look the same as the px ones, reduced to the entries used by bar
+# and line charts. plotly.js only applies a template given as an object (template names are resolved by plotly.py, not in
+# the browser), so the whole template (about 7.5 KB) would otherwise be sent with every figure
+_px_template = pio.templates[pio.templates.default].to_plotly_json()
+TEMPLATE = {
+    'data': {trace: _px_template['data'][trace] for trace in ('bar', 'scatter') if trace in _px_template['data']},
+    'layout': {key: _px_template['layout'][key] for key in ('autotypenumbers', 'colorway', 'font', 'hovermode', 'hoverlabel',
+                                                             'paper_bgcolor', 'plot_bgcolor', 'title', 'xaxis', 'yaxis')
+               if key in _px_template['layout']}
+}
+
+def _animation_args(frame, duration, fromcurrent = True):
+    return [frame, {'frame': {'duration': duration, 'redraw': True}, 'mode': 'immediate', 'fromcurrent': fromcurrent,
+                    'transition': {'duration': duration, 'easing': 'linear'}}]
+
+def animated_bars(categories, values, frame_values, x_title, y_title, frame_title, y_max, height = 500):
+    """Bar chart of `categories` animated over frame_values: values holds one list of bar heights per category"""
+    labels = [f'{value:g}' for value in frame_values]
+    heights = [list(map(float, column)) for column in values]
+    bars = lambda i: [column[i] for column in heights]
+    trace = {
+        'type': 'bar',
+        'x': list(categories),
+        'y': bars(0),
+        'marker': {'color': COLORS[:len(categories)]},
+        'hovertemplate': f'{x_title}=%{{x}}<br>{y_title}=%{{y}}<extra></extra>'
+    }
+    return {
+        'data': [trace],
+        'frames': [{'name': label, 'data': [{'y': bars(i)}], 'traces': [0]} for i, label in enumerate(labels)],
+        'layout': {
+            'template': TEMPLATE,
+            'height': height,
+            'autosize': True,
+            'margin': MARGIN,
+            'showlegend': False,
+            'xaxis': {'title': {'text': x_title}},
+            'yaxis': {'title': {'text': y_title}, 'range': [0, y_max]},
+            'updatemenus': [{
+                'type': 'buttons', 'direction': 'left', 'showactive': False, 'pad': {'r': 10, 't': 70},
+                'x': 0.1, 'xanchor': 'right', 'y': 0, 'yanchor': 'top',
+                'buttons': [{'label': '&#9654;', 'method': 'animate', 'args': _animation_args(None, 500)},
+                            {'label': '&#9724;', 'method': 'animate', 'args': _animation_args([None], 0)}]
+            }],
+            'sliders': [{
+                'active': 0, 'currentvalue': {'prefix': f'{frame_title}='}, 'len': 0.9, 'pad': {'b': 10, 't': 60},
+                'x': 0.1, 'xanchor': 'left', 'y': 0, 'yanchor': 'top',
+                'steps': [{'label': label, 'method': 'animate', 'args': _animation_args([label], 0)} for label in labels]
+            }]
+        }
+    }
+
+def line(x, y, x_title, y_title, height = 450):
+    return {
+        'data': [{'type': 'scatter', 'mode': 'lines', 'x': list(map(float, x)), 'y': list(map(float, y)),
+                  'line': {'color': COLORS[0]}, 'hovertemplate': f'{x_title}=%{{x}}<br>{y_title}=%{{y}}<extra></extra>'}],
+        'layout': {'template': TEMPLATE, 'height': height, 'autosize': True, 'margin': MARGIN, 'showlegend': False,
+                   'xaxis': {'title': {'text': x_title}}, 'yaxis': {'title': {'text': y_title}}}
+    }
+
+# Two lines sharing the x axis, the second one on a right hand side axis (make_subplots(secondary_y=True) layout)
+def dual_axis_lines(x, y1, y2, name1, name2, x_title, y1_title, y2_title):
+    x = list(map(float, x))
+    return {
+        'data': [{'type': 'scatter', 'mode': 'lines', 'x': x, 'y': list(map(float, y1)), 'name': name1, 'xaxis': 'x', 'yaxis': 'y'},
+                 {'type': 'scatter', 'mode': 'lines', 'x': x, 'y': list(map(float, y2)), 'name': name2, 'xaxis': 'x', 'yaxis': 'y2'}],
+        'layout': {
+            'template': TEMPLATE, 'autosize': True, 'margin': MARGIN,
+            'xaxis': {'anchor': 'y', 'domain': [0.0, 0.94], 'title': {'text': x_title}},
+            'yaxis': {'anchor': 'x', 'domain': [0.0, 1.0], 'title': {'text': y1_title}},
+            'yaxis2': {'anchor': 'x', 'overlaying': 'y', 'side': 'right', 'title': {'text': y2_title}}
+        }
+    }
+
+def simulator_figures(arrays, token1):
+    """Reserve, token flow, slippage and price figures of one simulation (AMMSimulation.table_arrays)"""
+    deposits = arrays['token_deposit']
+    reserves = [arrays['in_amount'], arrays['out_amount']]
+    flows = [arrays['amount_in_usd'], arrays['amount_out_usd'], arrays['slippage_usd']]
+    deposit_title = f'{token1} Deposit'
+    return (
+        animated_bars([token1, 'GNS'], reserves, deposits, 'Token', 'Reserve', 'token_deposit',
+                      max(max(values) for values in reserves) + 5),
+        animated_bars(['Amount_IN_USD', 'Amount_OUT_USD', 'Slippage_USD'], flows, deposits, 'Token Flow', 'Volume [USD]',
+                      'token_deposit', max(max(values) for values in flows) + 5),
+        line(deposits, arrays['slippage_percent'], deposit_title, 'GNS Slippage percent'),
+        dual_axis_lines(deposits, arrays['out_price'], arrays['in_price'], 'GNS', token1, deposit_title,
+                        f'Price of GNS in {token1}', f'Price of {token1} in GNS')
+    )
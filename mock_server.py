@@ -0,0 +1,367 @@
+"""Local stand-in for the Flipside and CoinGecko APIs, to run and load test the data layer offline
+
+Flipside results are replayed from recordings keyed by the query fingerprint (onchain_data.fingerprint), recorded from the
+real API with Recordings.record_query or synthesized from the template schemas with Recordings.synthesize. CoinGecko
+answers come from recordings too, or from the seed prices of token_prices.json. Latency and failures can be injected.
+
+Two ways to use it
+    In process: mock_server.install(MockFlipside(recordings)) makes query_data use the SDK compatible shim
+    HTTP: python mock_server.py --port 8765 --latency 0.2 --failure-rate 0.05, then point the real clients to it with
+          FLIPSIDE_API_URL=http://127.0.0.1:8765 COINGECKO_API_URL=http://127.0.0.1:8765/api/v3
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from flipside.models import QueryResultSet
+from flipside.models.compass.core.page_stats import PageStats
+import onchain_data
+import price_service
+import query_data
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'recordings.json')
+PERIODS = {'hour': 'h', 'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+
+
+class Recordings:
+    """Flipside results keyed by query fingerprint, and CoinGecko responses keyed by path
+
+    Parameters
+    path: JSON file the recordings are loaded from and saved to, None to keep them in memory
+    """
+    def __init__(self, path = None):
+        self.path = path
+        self.queries = {}
+        self.coingecko = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.queries = data['queries']
+            self.coingecko = data['coingecko']
+
+    def save(self, path = None):
+        with open(path or self.path, 'w') as f:
+            json.dump({'queries': self.queries, 'coingecko': self.coingecko}, f)
+
+    def add_query(self, sql, columns, rows, column_types = None):
+        self.queries[onchain_data.fingerprint(sql)] = {'columns': list(columns), 'column_types': column_types, 'rows': rows}
+
+    def find_query(self, sql):
+        return self.queries.get(onchain_data.fingerprint(sql))
+
+    def record_query(self, sql, api_key = query_data.sdk_api_key, page_size = 100000):
+        """Run `sql` on the real Flipside API and keep every page of the result"""
+        from flipside import Flipside
+        sdk = Flipside(api_key)
+        result = sdk.query(sql, page_size = page_size)
+        rows = list(result.rows or [])
+        for page_number in range(2, (result.page.totalPages if result.page else 1) + 1):
+            rows += sdk.get_query_results(result.query_id, page_number = page_number, page_size = page_size).rows or []
+        self.add_query(sql, result.columns or [], rows, result.column_types)
+        return len(rows)
+
+    def record_coingecko(self, path, params = None):
+        """Call the real CoinGecko API and keep the answer of `path` (simple/price, coins/<id>/market_chart/range)"""
+        response = onchain_data.re.get(f'https://api.coingecko.com/api/v3/{path}', params = params, timeout = 30)
+        response.raise_for_status()
+        self.coingecko[path] = response.json()
+
+    def synthesize(self, name, category = None, groupby = 'day', start_date = '2023-01-01', periods = 90, seed = 0):
+        """Random rows with the columns and types of a template of onchain_data.templates, stored for its rendered SQL.
+        One row per date (and per pool when the template has a category). Returns the number of rows"""
+        template = onchain_data.templates[name]
+        sql = template.render(category, groupby, start_date)
+        rng = np.random.default_rng(seed)
+        groups = [info['pool_name'] for info in onchain_data.pools.values() if info['pool_name']] if category else [None]
+        if template.dates is not None:
+            dates = [(period, date) for period in groupby
+                     for date in pd.date_range(start_date, periods = periods, freq = PERIODS[period])]
+        else:
+            dates = [(None, date) for date in pd.date_range(start_date, periods = periods, freq = PERIODS.get(groupby, 'h'))]
+        keys = [(period, date, group) for period, date in dates for group in groups]
+
+        columns, values = [], []
+        for col, dtype in template.schema.items():
+            col = category if col == '{category}' else col
+            columns.append(col)
+            if col == 'granularity':
+                values.append([period for period, _, _ in keys])
+            elif dtype.startswith('datetime'):
+                values.append([date.strftime('%Y-%m-%dT%H:%M:%S.000Z') for _, date, _ in keys])
+            elif dtype == 'category':
+                known = sorted({str(info[col]) for info in onchain_data.pools.values() if info.get(col)}) or [f'{col}-{i}' for i in range(3)]
+                values.append([group if col == category else known[i % len(known)] for i, (_, _, group) in enumerate(keys)])
+            elif 'slippage' in col or col == 'fee':
+                values.append(rng.uniform(0, 0.02, len(keys)).tolist())
+            elif col == 'swaps':
+                values.append(rng.integers(1, 500, len(keys)).tolist())
+            elif col == 'vol_cumulative':
+                values.append(np.cumsum(rng.lognormal(10, 1, len(keys))).tolist())
+            else:
+                values.append(rng.lognormal(10, 1, len(keys)).tolist())
+        self.add_query(sql, columns, [list(row) for row in zip(*values)])
+        return len(keys)
+
+    # CoinGecko answer for a path, recorded or built from the seed prices
+    def coingecko_response(self, path, params):
+        if path in self.coingecko:
+            return self.coingecko[path]
+        with open(price_service.SEED_PATH) as f:
+            seed = json.load(f)['prices']
+        prices = {coin: seed[symbol] for coin, symbol in onchain_data.coingecko_ids.items() if symbol in seed}
+        if path == 'simple/price':
+            coins = params.get('ids', ','.join(prices)).split(',')
+            currencies = params.get('vs_currencies', 'usd').split(',')
+            return {coin: {currency: prices[coin] for currency in currencies} for coin in coins if coin in prices}
+        if path.startswith('coins/') and path.endswith('/market_chart/range'):
+            coin = path.split('/')[1]
+            if coin not in prices:
+                return None
+            hours = range(int(params['from']) // 3600 * 3600, int(params['to']) + 1, 3600)
+            return {'prices': [[hour * 1000, prices[coin]] for hour in hours]}
+        return None
+
+
+class Faults:
+    """Latency and failure injection
+
+    Parameters
+    latency: seconds added to every call
+    jitter: random extra seconds, uniform between 0 and jitter
+    failure_rate: share of calls failing
+    seed: seed of the random draws, for reproducible runs
+    """
+    def __init__(self, latency = 0.0, jitter = 0.0, failure_rate = 0.0, seed = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+
+    # Wait for the injected latency, then tell if the call fails
+    def __call__(self):
+        with self.lock:
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            fail = self.rng.random() < self.failure_rate
+        if delay:
+            time.sleep(delay)
+        return fail
+
+
+class MockFlipside:
+    """Flipside SDK compatible client replaying recordings: query() and get_query_results() return the same
+    QueryResultSet objects as flipside.Flipside
+
+    Parameters
+    recordings: Recordings to replay
+    faults: Faults applied to every query() call (not to the following pages)
+    """
+    def __init__(self, recordings, faults = None):
+        self.recordings = recordings
+        self.faults = faults or Faults()
+        self.runs = {}
+        self.calls = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def create_run(self, sql):
+        with self.lock:
+            self.calls += 1
+        if self.faults():
+            with self.lock:
+                self.failures += 1
+            raise RuntimeError('Injected Flipside failure')
+        entry = self.recordings.find_query(sql)
+        if entry is None:
+            raise KeyError(f'No recording for query {onchain_data.fingerprint(sql)}')
+        run_id = uuid.uuid4().hex
+        with self.lock:
+            self.runs[run_id] = (sql, entry)
+        return run_id
+
+    def page(self, run_id, page_number = 1, page_size = 100000):
+        sql, entry = self.runs[run_id]
+        rows = entry['rows']
+        page_rows = rows[(page_number - 1) * page_size:page_number * page_size]
+        stats = {'currentPageNumber': page_number, 'currentPageSize': len(page_rows), 'totalRows': len(rows),
+                 'totalPages': max(1, -(-len(rows) // page_size))}
+        return entry, page_rows, stats
+
+    def query(self, sql, page_size = 100000, page_number = 1, **kwargs):
+        return self.get_query_results(self.create_run(sql), page_number = page_number, page_size = page_size)
+
+    def get_query_results(self, query_run_id, page_number = 1, page_size = 100000, **kwargs):
+        entry, rows, stats = self.page(query_run_id, page_number, page_size)
+        columns = entry['columns']
+        return QueryResultSet(
+            query_id = query_run_id,
+            status = 'QUERY_STATE_SUCCESS',
+            columns = columns,
+            column_types = entry['column_types'],
+            rows = rows,
+            records = [{col.lower(): value for col, value in zip(columns, row)} for row in rows] or None,
+            page = PageStats(**stats)
+        )
+
+    def stats(self):
+        with self.lock:
+            return {'calls': self.calls, 'failures': self.failures, 'runs': len(self.runs)}
+
+# Make query_data run every query on `client` (a MockFlipside), None to go back to the real SDK
+def install(client):
+    with query_data._clients_lock:
+        query_data._clients.clear()
+        query_data.client_factory = None if client is None else (lambda api_key: client)
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+# Payloads of the Flipside JSON-RPC API (the fields the SDK validates)
+def _query_run(run_id, sql, rows):
+    now = _now()
+    return {'id': run_id, 'sqlStatementId': onchain_data.fingerprint(sql)[:32], 'state': 'QUERY_STATE_SUCCESS',
+            'path': f'mock/{run_id}', 'rowCount': rows, 'totalSize': 0, 'tags': {}, 'dataSourceId': 'mock',
+            'userId': 'mock', 'createdAt': now, 'startedAt': now, 'queryRunningEndedAt': now,
+            'queryStreamingEndedAt': now, 'endedAt': now, 'updatedAt': now}
+
+
+class MockServer:
+    """HTTP server answering the Flipside JSON-RPC API (/json-rpc) and the CoinGecko API (/api/v3/...)
+
+    Parameters
+    recordings: Recordings to replay
+    faults: Faults of every request. Failed Flipside calls answer a JSON-RPC error, failed CoinGecko calls a 500
+    host, port: address of the server, port 0 picks a free port
+    """
+    def __init__(self, recordings, faults = None, host = '127.0.0.1', port = 0):
+        self.recordings = recordings
+        self.faults = faults or Faults()
+        self.flipside = MockFlipside(recordings)
+        self.coingecko_calls = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target = self.httpd.serve_forever, name = 'mock-server', daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def rpc(self, request):
+        method, params = request['method'], request['params'][0]
+        response = {'jsonrpc': '2.0', 'id': request.get('id', 1)}
+        try:
+            if method == 'createQueryRun':
+                if self.faults():
+                    raise RuntimeError('Injected Flipside failure')
+                run_id = self.flipside.create_run(params['sql'])
+                sql, entry = self.flipside.runs[run_id]
+                run, now = _query_run(run_id, sql, len(entry['rows'])), _now()
+                statement = {'id': run['sqlStatementId'], 'statementHash': run['sqlStatementId'], 'sql': sql, 'userId': 'mock',
+                             'tags': {}, 'createdAt': now, 'updatedAt': now}
+                query_request = {'id': run_id, 'sqlStatementId': run['sqlStatementId'], 'userId': 'mock', 'tags': {},
+                                 'maxAgeMinutes': params.get('maxAgeMinutes', 0), 'resultTTLHours': params.get('resultTTLHours', 1),
+                                 'userSkipCache': False, 'triggeredQueryRun': True, 'queryRunId': run_id,
+                                 'createdAt': now, 'updatedAt': now}
+                response['result'] = {'queryRequest': query_request, 'queryRun': run, 'sqlStatement': statement}
+            elif method == 'getQueryRun':
+                sql, entry = self.flipside.runs[params['queryRunId']]
+                response['result'] = {'queryRun': _query_run(params['queryRunId'], sql, len(entry['rows']))}
+            elif method == 'getQueryRunResults':
+                run_id = params['queryRunId']
+                entry, rows, stats = self.flipside.page(run_id, params['page']['number'], params['page']['size'])
+                response['result'] = {'columnNames': entry['columns'], 'columnTypes': entry['column_types'], 'rows': rows,
+                                      'page': stats, 'format': 'csv', 'originalQueryRun': _query_run(run_id, self.flipside.runs[run_id][0], stats['totalRows'])}
+            else:
+                response['error'] = {'code': -32601, 'message': f'Method not found: {method}'}
+        except (KeyError, RuntimeError) as e:
+            response['error'] = {'code': -32000, 'message': str(e)}
+        return response
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if urlparse(self.path).path != '/json-rpc':
+                    return self._send(404, {'error': 'not found'})
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                self._send(200, server.rpc(request))
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/stats':
+                    return self._send(200, {**server.flipside.stats(), 'coingecko_calls': server.coingecko_calls})
+                if not url.path.startswith('/api/v3/'):
+                    return self._send(404, {'error': 'not found'})
+                with server.flipside.lock:
+                    server.coingecko_calls += 1
+                if server.faults():
+                    return self._send(500, {'error': 'Injected CoinGecko failure'})
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                payload = server.recordings.coingecko_response(url.path[len('/api/v3/'):], params)
+                self._send(200 if payload is not None else 404, payload if payload is not None else {'error': 'not found'})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--recordings', default = RECORDINGS_PATH, help = 'JSON file of recorded responses')
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds added to every call')
+    parser.add_argument('--jitter', type = float, default = 0.0, help = 'random extra seconds, up to this value')
+    parser.add_argument('--failure-rate', type = float, default = 0.0, help = 'share of calls failing')
+    parser.add_argument('--seed', type = int, default = None)
+    parser.add_argument('--synthesize', action = 'store_true', help = 'add synthetic results for every template (last 90 days)')
+    args = parser.parse_args()
+
+    recordings = Recordings(args.recordings)
+    if args.synthesize:
+        start_date = (pd.Timestamp.today().normalize() - pd.Timedelta(days = 90)).strftime('%Y-%m-%d')
+        for name, template in onchain_data.templates.items():
+            category = template.categories[0] if template.categories else None
+            groupby = ['day', 'week', 'month'] if template.dates is not None else 'day'
+            recordings.synthesize(name, category, groupby, start_date)
+    server = MockServer(recordings, Faults(args.latency, args.jitter, args.failure_rate, args.seed), args.host, args.port)
+    print(f'Mock Flipside / CoinGecko server on {server.url} ({len(recordings.queries)} recorded queries)')
+    print(f'FLIPSIDE_API_URL={server.url} COINGECKO_API_URL={server.url}/api/v3')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+#-------------------------------------------- MONTE CARLO ORDER FLOW ---------------------------------------------------#
+# Random order flow against a constant product pool, instead of the single deterministic deposit ramp of AMM_contract.
+# Trade sizes (USD) are lognormal, optionally fitted to the historical volume returned by query_data.Query.query_data, and
+# every trade is a GNS buy or sell, sized at the starting prices. Reserves of all the paths are propagated together, one
+# step at a time, as (paths x steps) arrays. Large runs can be split across a process pool
+
+# Lognormal fit of the trade size in USD from a Query.query_data frame (one row per date bucket and pool)
+# The volume of a bucket is spread over trades_per_bucket trades of equal size
+def fit_trade_sizes(df, trades_per_bucket = 1, vol_col = 'vol'):
+    vol = pd.to_numeric(df[vol_col], errors = 'coerce')
+    log_sizes = np.log(vol[vol > 0] / trades_per_bucket)
+    return {'mu': log_sizes.mean(), 'sigma': log_sizes.std(ddof = 1) if len(log_sizes) > 1 else 0.0}
+
+def _simulate_chunk(n_paths, in_amount, in_price_usd, out_amount, n_steps, mu, sigma, buy_probability, fee, seed):
+    rng = np.random.default_rng(seed)
+    sizes_usd = rng.lognormal(mu, sigma, size = (n_paths, n_steps))
+    buys = rng.random((n_paths, n_steps)) < buy_probability
+
+    reserve_in = np.full(n_paths, float(in_amount))
+    reserve_out = np.full(n_paths, float(out_amount))
+    paths = {name: np.empty((n_paths, n_steps)) for name in ('reserve_in', 'reserve_out', 'reserve_drift', 'price', 'slippage')}
+    # Sells are sized in GNS at the starting pool price, as buys are in Token IN at in_price_usd. Sized at the simulated
+    # price, a run of sells would need ever more GNS and drain the Token IN reserve down to 0
+    initial_price = in_amount / out_amount
+
+    for step in range(n_steps):
+        spot = reserve_in / reserve_out # Price of GNS in Token IN
+        k = reserve_in * reserve_out
+        buy, sell = buys[:, step], ~buys[:, step]
+        slippage = np.empty(n_paths)
+        # Buys pay Token IN for GNS, sells pay GNS for Token IN. Each leg is computed on its own paths only.
+        # The drained reserve is k / (new reserve) as in query_data.AMM_arrays, so it never rounds down to 0
+        amount_in = sizes_usd[buy, step] / in_price_usd
+        new_in = reserve_in[buy] + amount_in * (1 - fee)
+        new_out = k[buy] / new_in
+        slippage[buy] = (amount_in / (reserve_out[buy] - new_out) / spot[buy] - 1) * 100
+        reserve_in[buy], reserve_out[buy] = new_in, new_out
+
+        amount_in = sizes_usd[sell, step] / (initial_price * in_price_usd)
+        new_out = reserve_out[sell] + amount_in * (1 - fee)
+        new_in = k[sell] / new_out
+        slippage[sell] = (1 - (reserve_in[sell] - new_in) / amount_in / spot[sell]) * 100
+        reserve_in[sell], reserve_out[sell] = new_in, new_out
+
+        paths['slippage'][:, step] = slippage
+        paths['reserve_in'][:, step] = reserve_in
+        paths['reserve_out'][:, step] = reserve_out
+        paths['reserve_drift'][:, step] = (reserve_out / out_amount - 1) * 100
+        paths['price'][:, step] = reserve_in / reserve_out * in_price_usd
+    return paths
+
+def simulate(in_amount, in_price_usd, out_amount, n_paths = 1000, n_steps = 100, mu = 7.0, sigma = 1.0,
+             buy_probability = 0.5, fee = 0.0, seed = None, n_jobs = 1):
+    """Simulate n_paths of n_steps random trades against the pool
+
+    Parameters
+    in_amount, out_amount: pool reserves of Token IN and GNS
+    in_price_usd: USD price of Token IN, used to size the trades
+    mu, sigma: lognormal parameters of the trade size in USD (see fit_trade_sizes)
+    buy_probability: probability that a trade buys GNS
+    n_jobs: number of processes to split the paths across
+
+    Returns a dict of (paths x steps) arrays: reserve_in, reserve_out, reserve_drift (percent change of the GNS reserve),
+    price (GNS in USD) and slippage (percent)
+    """
+    seeds = np.random.SeedSequence(seed).spawn(n_jobs)
+    chunks = [len(chunk) for chunk in np.array_split(np.arange(n_paths), n_jobs)]
+    args = [(n, in_amount, in_price_usd, out_amount, n_steps, mu, sigma, buy_probability, fee, s) for n, s in zip(chunks, seeds)]
+
+    if n_jobs == 1:
+        results = [_simulate_chunk(*args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*args)))
+    return {name: np.concatenate([r[name] for r in results]) for name in results[0]}
+
+# Percentile bands per step of every simulated metric, in long format for plotting (one row per step and metric)
+def percentile_bands(paths, percentiles = (5, 25, 50, 75, 95)):
+    frames = []
+    for metric, values in paths.items():
+        bands = np.percentile(values, percentiles, axis = 0)
+        frame = pd.DataFrame(bands.T, columns = [f'p{p}' for p in percentiles])
+        frame.insert(0, 'metric', metric)
+        frame.insert(0, 'step', np.arange(1, values.shape[1] + 1))
+        frames.append(frame)
+    return pd.concat(frames, ignore_index = True)
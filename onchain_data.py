@@ -1,57 +1,93 @@
+import datetime
+import hashlib
+import os
 import pandas as pd
 import requests as re
+#--------------------------------------- GNS POOLS ------------------------------------------------------------------------#
+# Liquidity pools covered by the Flipside queries below, with the fee tier applied in the slippage metrics
+# Token 0 is GNS in every pool. Polygon pool names and tokens come from polygon.core.ez_dex_swaps, so only the fee is kept here
+pools = {
+  '0xC91B7b39BBB2c733f0e7459348FD0c80259c8471': {'pool_name': 'GNS-ETH 0.3% ARB', 'blockchain': 'Arbitrum', 'platform': 'uniswap-v3', 'token0': 'GNS', 'token1': 'WETH', 'fee': 0.003},
+  '0xfB30135d5bDe908b88E5422baa6093065304D98b': {'pool_name': 'GNS-ETH 1% ARB', 'blockchain': 'Arbitrum', 'platform': 'uniswap-v3', 'token0': 'GNS', 'token1': 'WETH', 'fee': 0.01},
+  '0x4d2fE06Fd1c4368042B926D082484D2E3cC8F3F5': {'pool_name': 'GNS-DAI 1% ARB', 'blockchain': 'Arbitrum', 'platform': 'uniswap-v3', 'token0': 'GNS', 'token1': 'DAI', 'fee': 0.01},
+  '0x8D76e9c2bD1aDDE00A3DcDC315Fcb2774Cb3D1D6': {'pool_name': 'GNS-USDC 1% ARB', 'blockchain': 'Arbitrum', 'platform': 'uniswap-v3', 'token0': 'GNS', 'token1': 'USDC', 'fee': 0.01},
+  '0x6E53cB6942e518376E9e763554dB1A45DDCd25c4': {'pool_name': None, 'blockchain': 'Polygon', 'platform': None, 'token0': 'GNS', 'token1': None, 'fee': 0.003},
+  '0x384d2094D0Df788192043a1CBd200308DD60b068': {'pool_name': None, 'blockchain': 'Polygon', 'platform': None, 'token0': 'GNS', 'token1': None, 'fee': 0.00238},
+  '0xa56796f13566c515471A2fBBAB731F88cE5DE428': {'pool_name': None, 'blockchain': 'Polygon', 'platform': None, 'token0': 'GNS', 'token1': None, 'fee': 0.00222},
+  '0xEFa98Fdf168f372E5e9e9b910FcDfd65856f3986': {'pool_name': None, 'blockchain': 'Polygon', 'platform': None, 'token0': 'GNS', 'token1': None, 'fee': 0.003},
+  '0xBa0216254163B57aF68B7161cf824dBadcAD61Df': {'pool_name': None, 'blockchain': 'Polygon', 'platform': None, 'token0': 'GNS', 'token1': None, 'fee': 0.01},
+  '0x32A222f69d00e717845a3D857D0392D6A25a2ACd': {'pool_name': None, 'blockchain': 'Polygon', 'platform': None, 'token0': 'GNS', 'token1': None, 'fee': 0.003},
+  '0xFC469d13542E70f1512569EBf60C1E8fA01B6931': {'pool_name': None, 'blockchain': 'Polygon', 'platform': None, 'token0': 'GNS', 'token1': None, 'fee': 0.01},
+  '0xCe0BbB1E51ee21cde86257593f29cBD9A60CA97A': {'pool_name': None, 'blockchain': 'Polygon', 'platform': None, 'token0': 'GNS', 'token1': None, 'fee': 0.003},
+}
+
+# Fee of a pool given its address or its pool_name
+def get_pool_fee(pool):
+  for address, info in pools.items():
+    if pool is not None and pool.lower() in (address.lower(), (info['pool_name'] or '').lower()):
+      return info['fee']
+  raise KeyError(f'Unknown GNS pool: {pool}')
+
+# Fee tiers of all the pools above
+def get_fee_tiers():
+  return sorted({info['fee'] for info in pools.values()})
+
 #--------------------------------------- FLIPSIDE QUERIES ------------------------------------------------------------------#
 # Queries used to extract the desired on-chain information from Flipside app
-# There are variables in some scripts below like the start date of the query and the period for aggregating (day,week,month)
+# Every query is a template of the registry below: shared CTEs plus a final SELECT, with the pool lists, names and fees
+# generated from the pools table above. Templates are filled with named parameters, which are validated:
+# category (the groupby column), groupby (the period for aggregating: hour, day, week, month) and start_date.
+# The module level strings (swap_arb_pools, swap_matic, ...) are the same templates with the positional {0}/{1}/{2}
+# placeholders used by query_data.Query
+
+GROUPBY_PERIODS = ('hour', 'day', 'week', 'month')
+
+def _pool_list(blockchain, column, indent):
+  items = [f"LOWER('{address}') -- " + (info['pool_name'] or f"GNS {info['fee']:.2%}")
+           for address, info in pools.items() if info['blockchain'] == blockchain]
+  # The SQL comment has to come after the comma separating the items
+  lines = [item.replace(' --', ', --', 1) if i < len(items) - 1 else item for i, item in enumerate(items)]
+  return f'{column} IN (\n' + '\n'.join(' ' * (indent + 2) + line for line in lines) + '\n' + ' ' * indent + ')'
+
+def _pool_case(blockchain, column, field, indent, default = None):
+  whens = [f"WHEN {column} = LOWER('{address}') THEN " + (f"'{info[field]}'" if isinstance(info[field], str) else f"{info[field]}")
+           for address, info in pools.items() if info['blockchain'] == blockchain and info[field] is not None and info[field] != default]
+  if default is not None:
+    whens.append(f'ELSE {default}')
+  return '(CASE\n' + '\n'.join(' ' * (indent + 2) + when for when in whens) + '\n' + ' ' * indent + 'END)'
+
+# Fragments generated from the pools table
+_pool_fragments = {
+  'arb_pool_filter': _pool_list('Arbitrum', 'DECODED_LOG:pool::STRING', 6),
+  'arb_contract_filter': _pool_list('Arbitrum', 'event.contract_address', 6),
+  'arb_pool_names': _pool_case('Arbitrum', 'DECODED_LOG:pool::STRING', 'pool_name', 6),
+  'arb_token1_symbols': _pool_case('Arbitrum', 'DECODED_LOG:pool::STRING', 'token1', 6),
+  'arb_fees': _pool_case('Arbitrum', 'DECODED_LOG:pool::STRING', 'fee', 6),
+  'matic_contract_filter': _pool_list('Polygon', 'contract_address', 6),
+  'matic_fees': _pool_case('Polygon', 'contract_address', 'fee', 6, default = 0.003),
+}
 
-# Swap on Arbitrum by Liquidity Pools. Considering only relevant pools for GNS (Uniswap
-swap_arb_pools = """
-WITH
-  pool_created AS (
+# Shared CTEs
+ctes = {
+  # GNS pools on Arbitrum (Uniswap v3)
+  'pool_created': """
     SELECT
-      *,
-      (
-        CASE
-          WHEN pool_address = LOWER('0xC91B7b39BBB2c733f0e7459348FD0c80259c8471') THEN 'GNS-ETH 0.3% ARB'
-          WHEN pool_address = LOWER('0xfB30135d5bDe908b88E5422baa6093065304D98b') THEN 'GNS-ETH 1% ARB'
-          ELSE token0_symbol || '-' || token1_symbol || ' 1% ARB'
-        END
-      ) AS pool_name
+      'Arbitrum' AS blockchain,
+      'uniswap-v3' AS platform,
+      decoded_log:pool::STRING AS pool_address,
+      decoded_log:token0::STRING as token0_address,
+      decoded_log:token1::STRING as token1_address,
+      'GNS' AS token0_symbol,
+      {arb_token1_symbols} AS token1_symbol,
+      {arb_fees} AS fee,
+      {arb_pool_names} AS pool_name
     FROM
-      (
-        SELECT
-          'Arbitrum' AS blockchain,
-          'uniswap-v3' AS platform,
-          decoded_log:pool::STRING AS pool_address,
-          decoded_log:token0::STRING as token0_address,
-          decoded_log:token1::STRING as token1_address,
-          'GNS' AS token0_symbol,
-          (
-            CASE
-              WHEN decoded_log:token1::STRING = LOWER('0x82aF49447D8a07e3bd95BD0d56f35241523fBab1') THEN 'WETH'
-              WHEN decoded_log:token1::STRING = LOWER('0xFF970A61A04b1cA14834A43f5dE4533eBDDB5CC8') THEN 'USDC'
-              WHEN decoded_log:token1::STRING = LOWER('0xDA10009cBd5D07dd0CeCc66161FC93D7c9000da1') THEN 'DAI'
-            END
-          ) AS token1_symbol,
-          (
-            CASE
-              WHEN decoded_log:token1::STRING = LOWER('0xC91B7b39BBB2c733f0e7459348FD0c80259c8471') THEN 0.003 -- GNS/ETH 0.3%
-              ELSE 0.01 -- GNS/DAI 1% , GNS/USDC 1% , GNS/ETH 1%
-            END
-          ) AS fee
-        FROM
-          arbitrum.core.fact_decoded_event_logs
-        WHERE
-          EVENT_NAME = 'PoolCreated'
-          AND DECODED_LOG:pool::STRING IN (
-            LOWER('0xC91B7b39BBB2c733f0e7459348FD0c80259c8471'), -- GNS/ETH 0.3%
-            LOWER('0x4d2fE06Fd1c4368042B926D082484D2E3cC8F3F5'), -- GNS/DAI 1%
-            LOWER('0x8D76e9c2bD1aDDE00A3DcDC315Fcb2774Cb3D1D6'), -- GNS/USDC 1%
-            LOWER('0xfB30135d5bDe908b88E5422baa6093065304D98b') -- GNS/ETH 1%
-          )
-      ) AS x
-  ),
-  swap_raw_table AS (
+      arbitrum.core.fact_decoded_event_logs
+    WHERE
+      EVENT_NAME = 'PoolCreated'
+      AND {arb_pool_filter}
+  """,
+  'swap_raw_table': """
     SELECT
       tx_hash,
       date_trunc('hour', block_timestamp) as hour,
@@ -61,7 +97,9 @@ WITH
       token1_address,
       token0_symbol,
       token1_symbol,
-      {0},
+      blockchain,
+      platform,
+      pool_name,
       fee,
       decoded_log:amount0::INTEGER as amount0,
       decoded_log:amount1::INTEGER as amount1
@@ -72,15 +110,10 @@ WITH
       EVENT_NAME LIKE '%Swap%'
       -- Uniswap V3 Swap Router
       --AND DECODED_LOG: sender:: STRING = LOWER('0xE592427A0AEce92De3Edee1F18E0157C05861564')
-      AND event.contract_address IN (
-        LOWER('0xC91B7b39BBB2c733f0e7459348FD0c80259c8471'), -- GNS/ETH 0.3%
-        LOWER('0x4d2fE06Fd1c4368042B926D082484D2E3cC8F3F5'), -- GNS/DAI
-        LOWER('0x8D76e9c2bD1aDDE00A3DcDC315Fcb2774Cb3D1D6'), -- GNS/USDC 1%
-        LOWER('0xfB30135d5bDe908b88E5422baa6093065304D98b') -- GNS/ETH 1%
-      )
-  ),
-  -- PRICES
-  swap_adj AS (
+      AND {arb_contract_filter}
+  """,
+  # PRICES
+  'swap_adj': """
     SELECT
       tx_hash,
       swap.hour,
@@ -88,7 +121,9 @@ WITH
       recipient,
       token0_symbol,
       token1_symbol,
-      {0},
+      blockchain,
+      platform,
+      pool_name,
       fee,
       (amount0 / POW(10, price0.decimals)) * price0.price as amount0_usd,
       (amount1 / POW(10, price1.decimals)) * price1.price as amount1_usd
@@ -98,8 +133,8 @@ WITH
       AND swap.hour = price0.hour
       JOIN arbitrum.core.fact_hourly_token_prices price1 ON token1_address = price1.token_address
       AND swap.hour = price1.hour
-  ),
-  swap_final AS (
+  """,
+  'swap_final': """
     SELECT
       tx_hash,
       hour,
@@ -113,6 +148,8 @@ WITH
         WHEN amount0_usd < 0 THEN token0_symbol
         ELSE token1_symbol
       END AS toke_out,
+      blockchain,
+      platform,
       pool_name,
       fee,
       CASE
@@ -125,10 +162,160 @@ WITH
       END AS amount_out_usd
     FROM
       swap_adj
-  )
+  """,
+  # GNS pools on Polygon (Uniswap and Quickswap)
+  'swap_table': """
+    SELECT
+      DATE_TRUNC('{groupby}', block_timestamp) AS date,
+      platform,
+      pool_name,
+      symbol_in,
+      symbol_out,
+      amount_in_usd,
+      amount_out_usd,
+      {matic_fees} AS fee
+    FROM
+      polygon.core.ez_dex_swaps
+    WHERE
+      DATE(block_timestamp) >= DATE('{start_date}')
+      AND {matic_contract_filter}
+  """,
+  # Same swaps as swap_table, with the timestamp left untruncated so several granularities can be derived from one scan
+  'matic_swaps': """
+    SELECT
+      block_timestamp,
+      platform,
+      pool_name,
+      symbol_in,
+      symbol_out,
+      amount_in_usd,
+      amount_out_usd,
+      {matic_fees} AS fee
+    FROM
+      polygon.core.ez_dex_swaps
+    WHERE
+      DATE(block_timestamp) >= DATE('{start_date}')
+      AND {matic_contract_filter}
+  """,
+}
+
+# Columns of swap_final and swap_table that can be used as category
+ARB_CATEGORIES = ('pool_name', 'pool_address', 'blockchain', 'platform', 'token_in', 'toke_out', 'fee')
+MATIC_CATEGORIES = ('platform', 'pool_name', 'symbol_in', 'symbol_out')
+
+# Split a query into its code and its quoted parts ('string literals' and "identifiers", with doubled quotes as escapes).
+# Yields (quoted, text) pairs, with the -- comments removed from the code
+def _sql_parts(sql):
+  i = 0
+  code = []
+  while i < len(sql):
+    found = [j for j in (sql.find("'", i), sql.find('"', i), sql.find('--', i)) if j != -1]
+    j = min(found) if found else len(sql)
+    code.append(sql[i:j])
+    if j == len(sql):
+      break
+    if sql.startswith('--', j):
+      end = sql.find('\n', j)
+      i = len(sql) if end == -1 else end
+      continue
+    quote, end = sql[j], j + 1
+    while True:
+      end = sql.find(quote, end)
+      if end == -1:
+        end = len(sql)
+        break
+      if not sql.startswith(quote * 2, end):
+        end += 1
+        break
+      end += 2
+    yield False, ''.join(code)
+    yield True, sql[j:end]
+    code = []
+    i = end
+  yield False, ''.join(code)
+
+# Canonical form of a query: comments removed, whitespace collapsed and keywords lowercased outside the quoted parts,
+# which are kept as they are. Identical requests share the same fingerprint
+def fingerprint(sql):
+  parts = [text if quoted else ' '.join(text.split()).lower() for quoted, text in _sql_parts(sql)]
+  normalized = ' '.join(part for part in parts if part)
+  return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class SQLTemplate:
+  """Flipside query built from shared CTEs and a final SELECT
+
+  Parameters
+  name: name of the template in the registry
+  ctes: CTE names taken from `ctes`, or (name, sql) tuples for CTEs only used by this template
+  body: final SELECT
+  params: parameters the template uses, among category, groupby and start_date
+  categories: allowed values of category
+  schema: column types of the result, see query_data.decode_records. '{category}' stands for the category column
+  dates: (cte, timestamp column) for multi granularity templates. groupby is then a list of periods and a `swap_dates` CTE
+         stacks the rows of `cte` once per period (UNION ALL), with granularity and date columns, so a single scan feeds
+         every period
+  """
+  def __init__(self, name, ctes, body, params, categories = (), schema = None, dates = None):
+    self.name = name
+    self.ctes = ctes
+    self.body = body
+    self.params = params
+    self.categories = categories
+    self.schema = schema
+    self.dates = dates
+
+  def validate(self, category = None, groupby = None, start_date = None):
+    if 'category' in self.params and category not in self.categories:
+      raise ValueError(f'{self.name}: category must be one of {self.categories}, got {category!r}')
+    if 'groupby' in self.params and self.dates is not None:
+      if isinstance(groupby, str) or not groupby or len(set(groupby)) < len(groupby) or not set(groupby) <= set(GROUPBY_PERIODS):
+        raise ValueError(f'{self.name}: groupby must be a list of distinct periods among {GROUPBY_PERIODS}, got {groupby!r}')
+    elif 'groupby' in self.params and groupby not in GROUPBY_PERIODS:
+      raise ValueError(f'{self.name}: groupby must be one of {GROUPBY_PERIODS}, got {groupby!r}')
+    if 'start_date' in self.params:
+      try:
+        datetime.date.fromisoformat(start_date)
+      except (TypeError, ValueError):
+        raise ValueError(f'{self.name}: start_date must be a YYYY-MM-DD date, got {start_date!r}') from None
+
+  def render(self, category = None, groupby = None, start_date = None, validate = True):
+    if validate:
+      self.validate(category, groupby, start_date)
+    parts = [(cte, ctes[cte]) if isinstance(cte, str) else cte for cte in self.ctes]
+    if self.dates is not None:
+      source, column = self.dates
+      parts.insert(len(parts) - sum(not isinstance(cte, str) for cte in self.ctes), ('swap_dates', '\n    UNION ALL'.join(
+        f"\n    SELECT '{period}' AS granularity, DATE_TRUNC('{period}', {column}) AS date, * FROM {source}" for period in groupby)))
+      groupby = None
+    sql = ''
+    if parts:
+      sql = 'WITH\n' + ',\n'.join(f'  {cte} AS ({text.rstrip()}\n  )' for cte, text in parts) + '\n'
+    sql += self.body
+    return sql.format(category = category, groupby = groupby, start_date = start_date, **_pool_fragments)
+
+  def fingerprint(self, category = None, groupby = None, start_date = None):
+    return fingerprint(self.render(category, groupby, start_date))
+
+  # Template with the positional placeholders of query_data.Query: {0} category, {1} groupby, {2} start date
+  # Not available for multi granularity templates, whose CTEs depend on the list of periods
+  def positional(self):
+    if self.dates is not None:
+      raise ValueError(f'{self.name}: multi granularity templates have no positional form, use render()')
+    return self.render('{0}', '{1}', '{2}', validate = False)
+
+
+_arb_ctes = ['pool_created', 'swap_raw_table', 'swap_adj', 'swap_final']
+_swap_raw_schema = {'hour': 'datetime64[ns]', 'blockchain': 'category', 'platform': 'category', 'pool_name': 'category',
+                    'token_in': 'category', 'token_out': 'category', 'fee': 'float32', 'amount_in_usd': 'float64',
+                    'amount_out_usd': 'float64'}
+
+templates = {
+  # Swap on Arbitrum by Liquidity Pools. Considering only relevant pools for GNS (Uniswap)
+  'swap_arb_pools': SQLTemplate('swap_arb_pools', _arb_ctes, """
 SELECT
-  DATE_TRUNC('{1}', hour) AS date,
-  {0},
+  DATE_TRUNC('{groupby}', hour) AS date,
+  {category},
   SUM(amount_in_usd) AS vol,
   SUM(amount_out_usd),
   AVG(
@@ -138,263 +325,296 @@ SELECT
 FROM
   swap_final
 WHERE
-  date >= DATE('{2}')
+  date >= DATE('{start_date}')
 GROUP BY
   date,
-  {0}
+  {category}
 ORDER BY
   date ASC, vol DESC
 
-"""
-# Swap on Arbitrum. Considering only relevant pools for GNS (Uniswap)
-swap_arb = """
-WITH pool_created AS (
-  SELECT
-  *,
-  (CASE
-    WHEN pool_address = LOWER('0xC91B7b39BBB2c733f0e7459348FD0c80259c8471') THEN 'GNS-ETH 0.3% ARB'
-    WHEN pool_address = LOWER('0xfB30135d5bDe908b88E5422baa6093065304D98b') THEN 'GNS-ETH 1% ARB'
-    ELSE token0_symbol || '-' || token1_symbol || ' ARB'
-  END) AS pool_name
-FROM
-  (
-  SELECT
-      'Arbitrum' AS blockchain,
-      'uniswap-v3' AS platform,
-      decoded_log:pool::STRING AS pool_address,
-      decoded_log:token0::STRING as token0_address,
-      decoded_log:token1::STRING as token1_address,
-      'GNS' AS  token0_symbol,
-      (CASE
-        WHEN decoded_log:token1::STRING = LOWER('0x82aF49447D8a07e3bd95BD0d56f35241523fBab1') THEN 'WETH'
-        WHEN decoded_log:token1::STRING = LOWER('0xFF970A61A04b1cA14834A43f5dE4533eBDDB5CC8') THEN 'USDC'
-        WHEN decoded_log:token1::STRING = LOWER('0xDA10009cBd5D07dd0CeCc66161FC93D7c9000da1') THEN 'DAI'
-      END) AS token1_symbol,
-      (CASE
-        WHEN decoded_log:token1::STRING = LOWER('0xC91B7b39BBB2c733f0e7459348FD0c80259c8471') THEN 0.003 -- GNS/ETH 0.3%
-        ELSE 0.01 -- GNS/DAI 1% , GNS/USDC 1% , GNS/ETH 1%
-      END) AS fee
-      
-  FROM
-    arbitrum.core.fact_decoded_event_logs
-  WHERE
-    EVENT_NAME = 'PoolCreated'
-    AND DECODED_LOG: pool:: STRING IN (LOWER('0xC91B7b39BBB2c733f0e7459348FD0c80259c8471'), -- GNS/ETH 0.3%
-                              LOWER('0x4d2fE06Fd1c4368042B926D082484D2E3cC8F3F5'), -- GNS/DAI 1%
-                              LOWER('0x8D76e9c2bD1aDDE00A3DcDC315Fcb2774Cb3D1D6'), -- GNS/USDC 1%
-                              LOWER('0xfB30135d5bDe908b88E5422baa6093065304D98b') -- GNS/ETH 1%
-                              )
-  ) AS x
-),
-
-swap_raw_table AS (
-  SELECT
-    tx_hash,
-    date_trunc('hour', block_timestamp) as hour ,
-    pool.pool_address,
-    decoded_log:recipient::STRING as recipient,
-    token0_address,
-    token1_address,
-    token0_symbol,
-    token1_symbol,
-    {0},
-    fee,
-    decoded_log:amount0::INTEGER as amount0,
-    decoded_log:amount1::INTEGER as amount1
-  FROM
-   arbitrum.core.fact_decoded_event_logs event
-    LEFT JOIN pool_created pool ON event.contract_address = pool.pool_address
-  WHERE
-    EVENT_NAME LIKE '%Swap%'
-    -- Uniswap V3 Swap Router
-    --AND DECODED_LOG: sender:: STRING = LOWER('0xE592427A0AEce92De3Edee1F18E0157C05861564')
-    AND  event.contract_address IN (LOWER('0xC91B7b39BBB2c733f0e7459348FD0c80259c8471'), -- GNS/ETH 0.3%
-                              LOWER('0x4d2fE06Fd1c4368042B926D082484D2E3cC8F3F5'), -- GNS/DAI
-                              LOWER('0x8D76e9c2bD1aDDE00A3DcDC315Fcb2774Cb3D1D6'), -- GNS/USDC 1%
-                              LOWER('0xfB30135d5bDe908b88E5422baa6093065304D98b') -- GNS/ETH 1%
-                              )
-),
-
--- PRICES
-swap_adj AS (
-  SELECT
-    tx_hash,
-    swap.hour,
-    pool_address,
-    recipient,
-    token0_symbol,
-    token1_symbol,
-    {0},
-    fee,
-    (amount0/POW(10,price0.decimals)) * price0.price as amount0_usd,
-    (amount1/POW(10,price1.decimals)) * price1.price as amount1_usd
-  
-  FROM
-    swap_raw_table swap
-    JOIN arbitrum.core.fact_hourly_token_prices price0
-      ON token0_address = price0.token_address AND swap.hour = price0.hour
-    JOIN arbitrum.core.fact_hourly_token_prices price1
-      ON token1_address = price1.token_address AND swap.hour = price1.hour
-),
-
-swap_final AS (
-SELECT
-  tx_hash,
-  hour,
-  pool_address,
-  recipient,
-  CASE WHEN amount0_usd > 0 THEN token0_symbol  ELSE token1_symbol END AS token_in,
-  CASE WHEN amount0_usd < 0 THEN token0_symbol  ELSE  token1_symbol END AS toke_out,
-  {0},
-  fee,
-  CASE WHEN amount0_usd > 0 THEN amount0_usd  ELSE amount1_usd END AS amount_in_usd,
-  CASE WHEN amount0_usd < 0 THEN ABS(amount0_usd)  ELSE ABS(amount1_usd) END AS amount_out_usd
-
-FROM
-  swap_adj
-)
+""", ('category', 'groupby', 'start_date'), ARB_CATEGORIES,
+    {'date': 'datetime64[ns]', '{category}': 'category', 'vol': 'float64', 'sum(amount_out_usd)': 'float64',
+     'avg_slippage': 'float32', 'slippage_overall': 'float32'}),
 
+  # Swap on Arbitrum. Considering only relevant pools for GNS (Uniswap)
+  'swap_arb': SQLTemplate('swap_arb', _arb_ctes, """
 SELECT
-  DATE_TRUNC('{1}',hour) AS date,
+  DATE_TRUNC('{groupby}',hour) AS date,
   SUM(amount_in_usd) AS vol,
   AVG((amount_in_usd * (1-fee) - amount_out_usd)/amount_in_usd) AS slippage
-  
+
 FROM
   swap_final
 WHERE
-   date >= DATE('{2}')
+   date >= DATE('{start_date}')
 GROUP BY date
 ORDER BY date ASC, vol DESC
 
-"""
-
- # Swap on Polygon by Liquidity Pools. Considering only relevant pools for GNS (Uniswap and Quickswap)
-
-swap_matic_pool = """
-
-WITH swap_table AS
-    (
-      SELECT
-          DATE_TRUNC('{1}', block_timestamp) AS date,
-          platform,
-          {0},
-          amount_in_usd,
-          amount_out_usd,
-          (CASE
-            WHEN contract_address = LOWER('0x6E53cB6942e518376E9e763554dB1A45DDCd25c4') THEN 0.003
-            WHEN contract_address = LOWER('0x384d2094D0Df788192043a1CBd200308DD60b068') THEN 0.00238
-            WHEN contract_address = LOWER('0xa56796f13566c515471A2fBBAB731F88cE5DE428') THEN 0.00222
-            WHEN contract_address = LOWER('0xBa0216254163B57aF68B7161cf824dBadcAD61Df') THEN 0.01
-            WHEN contract_address = LOWER('0xFC469d13542E70f1512569EBf60C1E8fA01B6931') THEN 0.01
-            ELSE 0.003
-          END) AS fee
-          
-      FROM
-        polygon.core.ez_dex_swaps
-      WHERE
-        DATE(block_timestamp) >= DATE('{2}')
-        AND contract_address IN (
-                                  LOWER('0x6E53cB6942e518376E9e763554dB1A45DDCd25c4'),
-                                  LOWER('0x384d2094D0Df788192043a1CBd200308DD60b068'),
-                                  LOWER('0xa56796f13566c515471A2fBBAB731F88cE5DE428'),
-                                  LOWER('0xEFa98Fdf168f372E5e9e9b910FcDfd65856f3986'),
-                                  LOWER('0xBa0216254163B57aF68B7161cf824dBadcAD61Df'),
-                                  LOWER('0x32A222f69d00e717845a3D857D0392D6A25a2ACd'),
-                                  LOWER('0xFC469d13542E70f1512569EBf60C1E8fA01B6931'),
-                                  LOWER('0xCe0BbB1E51ee21cde86257593f29cBD9A60CA97A')
-                                )
-  ),
-
-vol_table AS (
-  SELECT
-    date,
-    {0},
-    SUM(amount_in_usd) as vol,
-    AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0) * (1 - fee)) AS slippage
-  FROM
-    swap_table
-  GROUP BY
-    date,
-    {0}
-  ORDER BY
-    date,
-    vol DESC
-)
+""", ('groupby', 'start_date'), schema = {'date': 'datetime64[ns]', 'vol': 'float64', 'slippage': 'float32'}),
 
+  # Swap level rows on Arbitrum, before any aggregation (see swap_store.py)
+  'swap_arb_raw': SQLTemplate('swap_arb_raw', _arb_ctes, """
+SELECT
+  tx_hash,
+  hour,
+  blockchain,
+  platform,
+  pool_name,
+  token_in,
+  toke_out AS token_out,
+  fee,
+  amount_in_usd,
+  amount_out_usd
+FROM
+  swap_final
+WHERE
+  hour >= DATE('{start_date}')
+ORDER BY
+  hour ASC
+
+""", ('start_date',), schema = _swap_raw_schema),
+
+  # Swap on Polygon by Liquidity Pools. Considering only relevant pools for GNS (Uniswap and Quickswap)
+  'swap_matic_pool': SQLTemplate('swap_matic_pool', ['swap_table', ('vol_table', """
+    SELECT
+      date,
+      {category},
+      SUM(amount_in_usd) as vol,
+      AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0) * (1 - fee)) AS slippage,
+      SUM((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) AS slippage_sum,
+      COUNT((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) AS swaps
+    FROM
+      swap_table
+    GROUP BY
+      date,
+      {category}
+    ORDER BY
+      date,
+      vol DESC
+  """)], """
 SELECT
   *,
   (SELECT AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) FROM swap_table) as slippage_overall,
-  SUM(vol) OVER (PARTITION BY {0} ORDER BY date) as vol_cumulative
+  SUM(vol) OVER (PARTITION BY {category} ORDER BY date) as vol_cumulative
 FROM
-  vol_table 
- """
-
- # Swap on Polygon. Considering only relevant pools for GNS (Uniswap and Quickswap)
-
-swap_matic = """
-
-WITH swap_table AS
-    (
-      SELECT
-          DATE_TRUNC('{1}', block_timestamp) AS date,
-          amount_in_usd,
-          amount_out_usd,
-          (CASE
-            WHEN contract_address = LOWER('0x6E53cB6942e518376E9e763554dB1A45DDCd25c4') THEN 0.003
-            WHEN contract_address = LOWER('0x384d2094D0Df788192043a1CBd200308DD60b068') THEN 0.00238
-            WHEN contract_address = LOWER('0xa56796f13566c515471A2fBBAB731F88cE5DE428') THEN 0.00222
-            WHEN contract_address = LOWER('0xBa0216254163B57aF68B7161cf824dBadcAD61Df') THEN 0.01
-            WHEN contract_address = LOWER('0xFC469d13542E70f1512569EBf60C1E8fA01B6931') THEN 0.01
-            ELSE 0.003
-          END) AS fee
-          
-      FROM
-        polygon.core.ez_dex_swaps
-      WHERE
-        DATE(block_timestamp) >= DATE('{2}')
-        AND contract_address IN (
-                                  LOWER('0x6E53cB6942e518376E9e763554dB1A45DDCd25c4'),
-                                  LOWER('0x384d2094D0Df788192043a1CBd200308DD60b068'),
-                                  LOWER('0xa56796f13566c515471A2fBBAB731F88cE5DE428'),
-                                  LOWER('0xEFa98Fdf168f372E5e9e9b910FcDfd65856f3986'),
-                                  LOWER('0xBa0216254163B57aF68B7161cf824dBadcAD61Df'),
-                                  LOWER('0x32A222f69d00e717845a3D857D0392D6A25a2ACd'),
-                                  LOWER('0xFC469d13542E70f1512569EBf60C1E8fA01B6931'),
-                                  LOWER('0xCe0BbB1E51ee21cde86257593f29cBD9A60CA97A')
-                                )
-  ),
-
-vol_table AS (
-  SELECT
-    date,
-    SUM(amount_in_usd) as vol,
-    AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) AS slippage
-  FROM
-    swap_table
-  GROUP BY
-    date
-  ORDER BY
-    date,
-    vol DESC
-)
+  vol_table
+ """, ('category', 'groupby', 'start_date'), MATIC_CATEGORIES,
+    {'date': 'datetime64[ns]', '{category}': 'category', 'vol': 'float64', 'slippage': 'float32', 'slippage_sum': 'float64',
+     'swaps': 'Int64', 'slippage_overall': 'float32', 'vol_cumulative': 'float64'}),
 
+  # Swap on Polygon. Considering only relevant pools for GNS (Uniswap and Quickswap)
+  'swap_matic': SQLTemplate('swap_matic', ['swap_table', ('vol_table', """
+    SELECT
+      date,
+      SUM(amount_in_usd) as vol,
+      AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) AS slippage,
+      SUM((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) AS slippage_sum,
+      COUNT((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) AS swaps
+    FROM
+      swap_table
+    GROUP BY
+      date
+    ORDER BY
+      date,
+      vol DESC
+  """)], """
 SELECT
   *,
   (SELECT AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) FROM swap_table) as slippage_overall,
   SUM(vol) OVER ( ORDER BY date) as vol_cumulative
 FROM
-  vol_table 
- """
+  vol_table
+ """, ('groupby', 'start_date'), schema = {'date': 'datetime64[ns]', 'vol': 'float64', 'slippage': 'float32',
+                                            'slippage_sum': 'float64', 'swaps': 'Int64',
+                                            'slippage_overall': 'float32', 'vol_cumulative': 'float64'}),
+
+  # swap_arb_pools for several periods at once (groupby is a list such as ['day', 'week', 'month']), one row per
+  # granularity, date and category. Split the result with query_data.split_granularities
+  'swap_arb_pools_multi': SQLTemplate('swap_arb_pools_multi', _arb_ctes, """
+SELECT
+  granularity,
+  date,
+  {category},
+  SUM(amount_in_usd) AS vol,
+  SUM(amount_out_usd),
+  AVG(
+    (amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)
+  ) AS avg_slippage,
+  (SELECT AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) FROM swap_final) as slippage_overall
+FROM
+  swap_dates
+WHERE
+  date >= DATE('{start_date}')
+GROUP BY
+  granularity,
+  date,
+  {category}
+ORDER BY
+  granularity, date ASC, vol DESC
+
+""", ('category', 'groupby', 'start_date'), ARB_CATEGORIES,
+    {'granularity': 'category', 'date': 'datetime64[ns]', '{category}': 'category', 'vol': 'float64',
+     'sum(amount_out_usd)': 'float64', 'avg_slippage': 'float32', 'slippage_overall': 'float32'},
+    dates = ('swap_final', 'hour')),
+
+  # swap_matic_pool for several periods at once, see swap_arb_pools_multi
+  'swap_matic_pool_multi': SQLTemplate('swap_matic_pool_multi', ['matic_swaps', ('vol_table', """
+    SELECT
+      granularity,
+      date,
+      {category},
+      SUM(amount_in_usd) as vol,
+      AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0) * (1 - fee)) AS slippage
+    FROM
+      swap_dates
+    GROUP BY
+      granularity,
+      date,
+      {category}
+    ORDER BY
+      granularity,
+      date,
+      vol DESC
+  """)], """
+SELECT
+  *,
+  (SELECT AVG((amount_in_usd * (1 - fee) - amount_out_usd) / NULLIF(amount_in_usd,0)) FROM matic_swaps) as slippage_overall,
+  SUM(vol) OVER (PARTITION BY granularity, {category} ORDER BY date) as vol_cumulative
+FROM
+  vol_table
+ """, ('category', 'groupby', 'start_date'), MATIC_CATEGORIES,
+    {'granularity': 'category', 'date': 'datetime64[ns]', '{category}': 'category', 'vol': 'float64', 'slippage': 'float32',
+     'slippage_overall': 'float32', 'vol_cumulative': 'float64'},
+    dates = ('matic_swaps', 'block_timestamp')),
+
+  # Swap level rows on Polygon, before any aggregation (see swap_store.py)
+  'swap_matic_raw': SQLTemplate('swap_matic_raw', [], """
+SELECT
+  tx_hash,
+  DATE_TRUNC('hour', block_timestamp) AS hour,
+  'Polygon' AS blockchain,
+  platform,
+  pool_name,
+  symbol_in AS token_in,
+  symbol_out AS token_out,
+  {matic_fees} AS fee,
+  amount_in_usd,
+  amount_out_usd
+FROM
+  polygon.core.ez_dex_swaps
+WHERE
+  DATE(block_timestamp) >= DATE('{start_date}')
+  AND {matic_contract_filter}
+ORDER BY
+  hour ASC
+ """, ('start_date',), schema = _swap_raw_schema),
+
+  # Hourly USD prices of the tokens of the Arbitrum pools, from the same price table the swap queries join on
+  # (see price_history.py)
+  'hourly_token_prices': SQLTemplate('hourly_token_prices', ['pool_created'], """
+SELECT
+  hour,
+  symbol,
+  price
+FROM
+  arbitrum.core.fact_hourly_token_prices
+WHERE
+  token_address IN (
+    SELECT token0_address FROM pool_created
+    UNION
+    SELECT token1_address FROM pool_created
+  )
+  AND hour >= DATE('{start_date}')
+ORDER BY
+  hour ASC, symbol
+
+""", ('start_date',), schema = {'hour': 'datetime64[ns]', 'symbol': 'category', 'price': 'float64'}),
+}
+
+# Render a template of the registry with validated parameters
+def render(name, category = None, groupby = None, start_date = None):
+  return templates[name].render(category, groupby, start_date)
+
+swap_arb_pools = templates['swap_arb_pools'].positional()
+swap_arb = templates['swap_arb'].positional()
+swap_arb_raw = templates['swap_arb_raw'].positional()
+swap_matic_pool = templates['swap_matic_pool'].positional()
+swap_matic = templates['swap_matic'].positional()
+swap_matic_raw = templates['swap_matic_raw'].positional()
+hourly_token_prices = templates['hourly_token_prices'].positional()
+
+#--------------------------------------- RESULT SCHEMAS -------------------------------------------------------------------#
+# Column types of each query result, used by query_data to build typed columns straight from the records
+# '{category}' stands for the groupby column passed as {0}. Metrics that only need a few digits are kept as float32, and
+# counts use the nullable Int64 so a NULL stays missing
+schemas = {name: template.schema for name, template in templates.items()}
+# Shared by both raw templates
+schemas['swap_raw'] = _swap_raw_schema
+
+# Positional script of every template and its schema, rendered once so query_data.Query looks schemas up without
+# rendering the templates again
+_schemas_by_script = {template.positional(): template.schema for template in templates.values() if template.dates is None}
+
+# Schema of a query script, None when the script is not one of the templates above
+def get_schema(script):
+  return _schemas_by_script.get(script)
 
  #----------------------------------------------------- TOKEN PRICES ----------------------------------------------------#
 # Token prices related to the  main GNS liquidity pools available in the market. Data from Coingeko API
 # Token 0: GNS | Token1:  WETH, DAI, USDC, MATIC
 
+# CoinGecko id of every token, the symbol being the one used in the pools above. Adding a token here adds it to the same
+# request, whatever the number of tokens
+COINGECKO_URL = os.environ.get('COINGECKO_API_URL', 'https://api.coingecko.com/api/v3')
+coingecko_ids = {
+  'dai': 'DAI',
+  'ethereum': 'WETH',
+  'gains-network': 'GNS',
+  'matic-network': 'MATIC',
+  'usd-coin': 'USDC',
+}
+
+def _coingecko_get(path, params, timeout):
+  response = re.get(f'{COINGECKO_URL}/{path}', params = params, timeout = timeout)
+  response.raise_for_status()
+  return response.json()
+
+# Current prices of every token in each currency of `currencies` (usd, eth, eur, ...), in one request
+# Returns {currency: {symbol: price}}
+def get_token_prices_multi(currencies = ('usd',), timeout = 10):
+  data = _coingecko_get('simple/price', {'ids': ','.join(coingecko_ids), 'vs_currencies': ','.join(currencies)}, timeout)
+  missing = [coin for coin in coingecko_ids if coin not in data]
+  if missing:
+    raise ValueError(f'CoinGecko returned no price for {missing}')
+  return {currency: {symbol: float(data[coin][currency]) for coin, symbol in coingecko_ids.items()} for currency in currencies}
+
 #Getting current prices
-def get_token_prices():
-  url = "https://api.coingecko.com/api/v3/simple/price?ids=ethereum%2Cdai%2Cusd-coin%2Cmatic-network%2Cgains-network&vs_currencies=usd&include_market_cap=false&include_24hr_vol=false&include_24hr_change=false&include_last_updated_at=false"
-  respon = re.get(url)
-  df_prices = pd.DataFrame.from_records(respon.json())
-  df_prices.columns = ['DAI', 'WETH', 'GNS', 'MATIC', 'USDC']
-  token_prices = {token: df_prices[token].values[0] for token in list(df_prices.columns)}
-  return token_prices
\ No newline at end of file
+def get_token_prices(currency = 'usd', timeout = 10):
+  return get_token_prices_multi((currency,), timeout)[currency]
+
+# Prices of every token at many timestamps, as a DataFrame with one row per timestamp and one column per token.
+# With a price_history.PriceHistory as `history` (USD only), the prices are as-of lookups in that local store, so no request
+# is made whatever the number of tokens or timestamps: the store is filled for every token at once by one Flipside pull
+# (PriceHistory.pull). Tokens missing from the store give NaN.
+# Otherwise CoinGecko is called: its historical endpoint (market_chart/range) only takes one coin per request, so this
+# costs one request per token of coingecko_ids, each covering all the timestamps. Every timestamp then gets the last
+# price at or before it (NaN before the first one). CoinGecko returns 5 minute points for ranges up to a day, hourly
+# points up to 90 days and daily points beyond
+def get_historical_prices(timestamps, currency = 'usd', timeout = 10, history = None):
+  if history is not None:
+    if currency != 'usd':
+      raise ValueError(f'The price history only holds USD prices, got {currency!r}')
+    return history.asof_frame(timestamps, tokens = list(coingecko_ids.values()))
+  timestamps = pd.DatetimeIndex(pd.to_datetime(timestamps), name = 'timestamp')
+  seconds = timestamps.values.astype('datetime64[s]').astype('int64')
+  # One hour of margin so the first timestamps have a price before them
+  params = {'vs_currency': currency, 'from': int(seconds.min()) - 3600, 'to': int(seconds.max()) + 1}
+  prices = {}
+  for coin, symbol in coingecko_ids.items():
+    points = sorted(_coingecko_get(f'coins/{coin}/market_chart/range', params, timeout)['prices'])
+    point_times = pd.Series([point[0] for point in points], dtype = 'int64') // 1000
+    point_prices = pd.Series([point[1] for point in points], dtype = 'float64')
+    position = point_times.searchsorted(seconds, side = 'right') - 1
+    # Position -1 (no point before the timestamp) is not in the index and gives NaN
+    prices[symbol] = point_prices.reindex(position).values
+  return pd.DataFrame(prices, index = timestamps)
@@ -0,0 +1,128 @@
+import os
+import numpy as np
+import pandas as pd
+import onchain_data
+import query_data
+
+#------------------------------------------------- HOURLY PRICE HISTORY ------------------------------------------------#
+# get_token_prices only gives today's prices, so the simulator can't be replayed at past prices. Hourly USD prices are
+# kept here in append-only binary files (one int64 file of hours and one float64 file of prices per token), read back as
+# memory maps, so as-of lookups of thousands of timestamps are one searchsorted and no network call.
+# The store is seeded from Flipside with onchain_data.hourly_token_prices
+
+HISTORY_DIR = 'price_history'
+HOUR = np.timedelta64(1, 'h')
+
+# Timestamps as naive UTC, like query_data.decode_records. pandas >= 2 infers one format from the first string, so strings
+# of different formats (dates, Flipside ISO timestamps, ...) are then parsed one by one
+def to_timestamps(timestamps):
+    values = np.atleast_1d(np.asarray(timestamps))
+    try:
+        timestamps = pd.to_datetime(values, utc = True)
+    except ValueError:
+        timestamps = pd.to_datetime([pd.Timestamp(value) for value in values.tolist()], utc = True)
+    return pd.DatetimeIndex(timestamps).tz_localize(None)
+
+# Hours since the epoch, the unit stored on disk
+def to_hours(timestamps):
+    return to_timestamps(timestamps).values.astype('datetime64[h]').astype(np.int64)
+
+
+class PriceHistory:
+    """Append-only hourly token prices on disk, with vectorized as-of lookups
+
+    Parameters
+    path: folder of the store
+    api_key: Flipside API key used by pull
+    """
+    def __init__(self, path = HISTORY_DIR, api_key = query_data.sdk_api_key):
+        self.path = path
+        self.api_key = api_key
+        self._maps = {}
+        os.makedirs(path, exist_ok = True)
+
+    def _files(self, token):
+        return os.path.join(self.path, f'{token}.hours'), os.path.join(self.path, f'{token}.prices')
+
+    def tokens(self):
+        return sorted(file[:-len('.hours')] for file in os.listdir(self.path) if file.endswith('.hours'))
+
+    # Rows stored for a token. An append interrupted between the two files (or within one) leaves them with different
+    # lengths, so only the rows present in both are counted
+    def _rows(self, token):
+        sizes = [os.path.getsize(file) if os.path.exists(file) else 0 for file in self._files(token)]
+        return min(sizes) // 8
+
+    def series(self, token):
+        """(hours, prices) of a token as read-only memory maps, hours being sorted hours since the epoch.
+        A map is reused while the files keep the same number of rows, so rows appended by another PriceHistory or
+        process are seen on the next call"""
+        rows = self._rows(token)
+        if rows == 0:
+            return np.array([], dtype = np.int64), np.array([], dtype = np.float64)
+        if token not in self._maps or len(self._maps[token][0]) != rows:
+            hours_file, prices_file = self._files(token)
+            self._maps[token] = (np.memmap(hours_file, dtype = np.int64, mode = 'r', shape = (rows,)),
+                                 np.memmap(prices_file, dtype = np.float64, mode = 'r', shape = (rows,)))
+        return self._maps[token]
+
+    def append(self, token, hours, prices):
+        """Append hourly prices of a token. Only hours after the last one stored are written, so the files stay sorted
+        and overlapping pulls can be appended as they are. Returns the number of rows written"""
+        hours = to_hours(hours)
+        prices = np.asarray(prices, dtype = np.float64)
+        order = np.argsort(hours, kind = 'stable')
+        hours, prices = hours[order], prices[order]
+        # Keep the last price of each hour
+        last_of_hour = np.append(hours[1:] != hours[:-1], True)
+        hours, prices = hours[last_of_hour], prices[last_of_hour]
+
+        stored = self.series(token)[0]
+        if len(stored):
+            new = hours > stored[-1]
+            hours, prices = hours[new], prices[new]
+        if len(hours) == 0:
+            return 0
+        self._maps.pop(token, None)
+        # Drop the rows of an interrupted append before writing, so both files stay aligned row by row
+        for file, values in zip(self._files(token), (hours.astype(np.int64), prices)):
+            with open(file, 'ab') as f:
+                f.truncate(len(stored) * 8)
+                f.write(values.tobytes())
+        return len(hours)
+
+    def append_frame(self, df, hour_col = 'hour', token_col = 'symbol', price_col = 'price'):
+        """Append long format prices (one row per hour and token), as returned by onchain_data.hourly_token_prices"""
+        written = {}
+        for token, rows in df.groupby(token_col, observed = True):
+            written[str(token)] = self.append(str(token), rows[hour_col], rows[price_col])
+        return written
+
+    def pull(self, start_date, page_size = 100000):
+        """Stream the hourly prices since start_date from Flipside into the store. Returns the rows written per token"""
+        written = {}
+        query = query_data.Query(onchain_data.hourly_token_prices, self.api_key)
+        for page in query.stream_data(start_date = start_date, page_size = page_size):
+            for token, rows in self.append_frame(page).items():
+                written[token] = written.get(token, 0) + rows
+        return written
+
+    def asof(self, token, timestamps, tolerance = '1D'):
+        """Price of a token at each timestamp: last hourly price at or before it, NaN when there is none within
+        `tolerance` (None for no limit). Vectorized over any number of timestamps"""
+        hours, prices = self.series(token)
+        wanted = to_hours(timestamps)
+        position = np.searchsorted(hours, wanted, side = 'right') - 1
+        result = np.full(len(wanted), np.nan)
+        found = position >= 0
+        if tolerance is not None and len(hours):
+            max_gap = pd.Timedelta(tolerance) // pd.Timedelta(HOUR)
+            found &= wanted - hours[np.maximum(position, 0)] <= max_gap
+        result[found] = prices[position[found]]
+        return result
+
+    def asof_frame(self, timestamps, tokens = None, tolerance = '1D'):
+        """As-of prices of several tokens, one column per token and one row per timestamp"""
+        tokens = self.tokens() if tokens is None else tokens
+        index = to_timestamps(timestamps).rename('timestamp')
+        return pd.DataFrame({token: self.asof(token, index, tolerance) for token in tokens}, index = index)
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+import onchain_data
+
+#------------------------------------------------- TOKEN PRICE SERVICE -------------------------------------------------#
+# Token prices kept in memory and refreshed from CoinGecko by a background thread, so the app never waits on the network.
+# The last prices fetched are written to a snapshot file, which is what the app serves until the first refresh succeeds
+# (offline start, CoinGecko down or rate limited). Without any snapshot yet, the placeholder prices shipped in
+# token_prices.json are used, with source 'seed' so the app can flag them
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATH = os.path.join(ROOT, '.token_prices.json')
+SEED_PATH = os.path.join(ROOT, 'token_prices.json')
+
+
+class PriceService:
+    """Thread safe token price cache with a time to live, a background refresher and a snapshot fallback
+
+    Parameters
+    ttl: seconds the prices are considered fresh. Stale prices are still served while a refresh runs in the background
+    refresh_interval: seconds between two refreshes of the background thread started by start()
+    snapshot_path: JSON file of the last prices fetched, None to disable it
+    seed_path: JSON file read when there is no snapshot yet
+    fetch: function returning {token: USD price}, onchain_data.get_token_prices by default
+    """
+    def __init__(self, ttl = 60, refresh_interval = 30, snapshot_path = SNAPSHOT_PATH, seed_path = SEED_PATH, fetch = None):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.snapshot_path = snapshot_path
+        self.seed_path = seed_path
+        self.fetch = fetch
+        self.prices = {}
+        self.updated_at = 0.0
+        # Where the prices in memory come from: 'seed', 'snapshot' or 'coingecko' (None before any is loaded)
+        self.source = None
+        self.errors = 0
+        self.lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.load_snapshot()
+
+    def load_snapshot(self):
+        paths = [(path, source) for path, source in ((self.snapshot_path, 'snapshot'), (self.seed_path, 'seed'))
+                 if path is not None and os.path.exists(path)]
+        if not paths:
+            return
+        path, source = paths[0]
+        with open(path) as f:
+            snapshot = json.load(f)
+        with self.lock:
+            self.prices = snapshot['prices']
+            self.updated_at = snapshot['updated_at']
+            self.source = source
+
+    def _save_snapshot(self, prices, updated_at):
+        tmp = f'{self.snapshot_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'updated_at': updated_at, 'prices': prices}, f, indent = 2)
+        os.replace(tmp, self.snapshot_path)
+
+    def refresh(self):
+        """Fetch the prices now. On failure the prices in memory are kept. Returns True if the prices were updated"""
+        # Only one refresh at a time, concurrent callers keep serving the current prices
+        if not self._refreshing.acquire(blocking = False):
+            return False
+        try:
+            fetch = self.fetch or onchain_data.get_token_prices
+            prices = {token: float(price) for token, price in fetch().items()}
+            updated_at = time.time()
+            with self.lock:
+                self.prices = prices
+                self.updated_at = updated_at
+                self.source = 'coingecko'
+            if self.snapshot_path is not None:
+                self._save_snapshot(prices, updated_at)
+            return True
+        except Exception as e:
+            with self.lock:
+                self.errors += 1
+            print(f'Token price refresh failed: {e}')
+            return False
+        finally:
+            self._refreshing.release()
+
+    def is_stale(self):
+        return time.time() - self.updated_at > self.ttl
+
+    # Only the placeholder prices of the seed file are available, no price was ever fetched
+    def is_placeholder(self):
+        return self.source == 'seed'
+
+    def get(self):
+        """Current {token: USD price} from memory. Stale prices start the background refresher if it is not running, and
+        are served meanwhile"""
+        if self.is_stale():
+            self.start()
+        with self.lock:
+            return dict(self.prices)
+
+    def start(self):
+        """Start the background refresher (daemon thread), refreshing right away and then every refresh_interval seconds.
+        Does nothing if it is already running, so it can be called on every request"""
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self
+            self._stop.clear()
+
+            def run():
+                while not self._stop.is_set():
+                    self.refresh()
+                    self._stop.wait(self.refresh_interval)
+
+            self._thread = threading.Thread(target = run, name = 'price-service', daemon = True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tokens': sorted(self.prices),
+                'source': self.source,
+                'updated_at': self.updated_at,
+                'age_seconds': time.time() - self.updated_at if self.updated_at else None,
+                'stale': self.is_stale(),
+                'errors': self.errors,
+                'refresher_running': self._thread is not None and self._thread.is_alive()
+            }
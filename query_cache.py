@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import pandas as pd
+import query_data
+
+#------------------------------------------ LOCAL FLIPSIDE RESULT CACHE -------------------------------------------------#
+# Past days of swap data never change, so query results are kept on disk (Parquet) and only the window since the last
+# cached date is fetched again from Flipside. Results are keyed by a hash of (script, category, groupby)
+
+CACHE_DIR = '.flipside_cache'
+
+def cache_key(script, category, groupby):
+    return hashlib.sha256(json.dumps([script, category, groupby]).encode()).hexdigest()[:32]
+
+# Flipside returns dates as ISO strings in UTC
+def parse_dates(df, date_col = 'date'):
+    df = df.copy()
+    df[date_col] = pd.to_datetime(df[date_col], utc = True).dt.tz_localize(None)
+    return df
+
+
+class QueryCache:
+    """On disk cache of Flipside query results with incremental refresh
+
+    Parameters
+    cache_dir: folder of the Parquet files
+    api_key: Flipside API key used for the queries
+    """
+    def __init__(self, cache_dir = CACHE_DIR, api_key = query_data.sdk_api_key):
+        self.cache_dir = cache_dir
+        self.api_key = api_key
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+
+    def load(self, script, category = None, groupby = 'day'):
+        path = self.path(cache_key(script, category, groupby))
+        return pd.read_parquet(path) if os.path.exists(path) else None
+
+    # First date covered by the cached rows, kept beside the Parquet file since the first buckets may be empty
+    def _covered_from(self, key):
+        path = os.path.join(self.cache_dir, f'{key}.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return pd.Timestamp(json.load(f)['start_date'])
+
+    # Both files are written to temporary files and moved in place, the Parquet file first. A crash in between leaves the
+    # new rows with the previous (never earlier) covered date, which only makes the next call refetch more
+    def _save(self, key, df, start):
+        path, meta_path = self.path(key), os.path.join(self.cache_dir, f'{key}.json')
+        df.to_parquet(f'{path}.tmp', index = False)
+        with open(f'{meta_path}.tmp', 'w') as f:
+            json.dump({'start_date': start.strftime('%Y-%m-%d')}, f)
+        os.replace(f'{path}.tmp', path)
+        os.replace(f'{meta_path}.tmp', meta_path)
+
+    def _fetch(self, script, category, groupby, start_date):
+        query = query_data.Query(script, self.api_key).query_data(category, groupby, start_date)
+        if query is None or query.data is None or 'date' not in query.data:
+            return None
+        return parse_dates(query.data)
+
+    def query_data(self, script, category = None, groupby = 'day', start_date = None):
+        """Same result as query_data.Query(script).query_data(category, groupby, start_date), served from the cache
+
+        Only buckets from the last cached date on are fetched (the last bucket may have been incomplete), then merged
+        with the cached ones. Columns computed over the whole window are kept consistent: vol_cumulative is recomputed from
+        start_date, and so is slippage_overall from the per bucket slippage_sum and swaps when the template has them
+        (Polygon templates, whose overall slippage only covers the fetched window). Otherwise slippage_overall is taken
+        from the latest fetch (Arbitrum templates, where it covers every swap). If the fetch fails, the cached rows are
+        returned. start_date is required: the window of the cached rows is known from it
+        """
+        if start_date is None:
+            raise ValueError('QueryCache.query_data: start_date is required')
+        key = cache_key(script, category, groupby)
+        start = pd.Timestamp(start_date)
+        cached = self.load(script, category, groupby)
+        covered_from = self._covered_from(key)
+
+        if cached is None or len(cached) == 0 or covered_from is None or start < covered_from:
+            merged = self._fetch(script, category, groupby, start_date)
+            if merged is None:
+                return None
+            covered_from = start
+        else:
+            last_date = cached['date'].max()
+            fresh = self._fetch(script, category, groupby, last_date.strftime('%Y-%m-%d'))
+            if fresh is None:
+                print(f'Flipside refresh failed, serving cached results up to {last_date}')
+                fresh = cached[cached['date'] >= last_date]
+            merged = pd.concat([cached[cached['date'] < last_date], fresh], ignore_index = True)
+            if 'slippage_overall' in merged and len(fresh):
+                merged['slippage_overall'] = fresh['slippage_overall'].iloc[0]
+
+        merged = merged.sort_values('date', kind = 'stable').reset_index(drop = True)
+        self._save(key, merged, covered_from)
+
+        result = merged[merged['date'] >= start].reset_index(drop = True)
+        if 'vol_cumulative' in result:
+            vol = pd.to_numeric(result['vol'])
+            result['vol_cumulative'] = vol.groupby(result[category]).cumsum() if category in result else vol.cumsum()
+        if {'slippage_overall', 'slippage_sum', 'swaps'} <= set(result):
+            overall = result['slippage_sum'].sum() / result['swaps'].sum() if result['swaps'].sum() else float('nan')
+            result['slippage_overall'] = pd.Series(overall, index = result.index, dtype = result['slippage_overall'].dtype)
+        return result
+
+    def clear(self):
+        for file in os.listdir(self.cache_dir):
+            if file.endswith(('.parquet', '.json', '.tmp')):
+                os.remove(os.path.join(self.cache_dir, file))
@@ -1,37 +1,161 @@
 import pandas as pd
+import numpy as np
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from flipside import Flipside
+import onchain_data
 
 # Manual Input
 sdk_api_key= 'API_KEY'
 
+# Flipside API, overridden to point the queries to another server (e.g. mock_server.py)
+flipside_url = os.environ.get('FLIPSIDE_API_URL')
+# Function building a client from an API key. Replaced by mock_server.install to run the queries offline
+client_factory = None
+
+# Flipside clients are reused by every query, one per API key
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_key = sdk_api_key):
+    with _clients_lock:
+        if api_key not in _clients:
+            if client_factory is not None:
+                _clients[api_key] = client_factory(api_key)
+            else:
+                _clients[api_key] = Flipside(api_key, flipside_url) if flipside_url else Flipside(api_key)
+        return _clients[api_key]
+
+# Build a DataFrame from Flipside records with one typed column at a time (see onchain_data.schemas), instead of
+# object columns converted afterwards. Columns missing from the schema are left for pandas to infer
+def decode_records(records, schema = None, category = None):
+    if schema is None or not records:
+        return pd.DataFrame.from_records(records or [])
+    columns = {}
+    for col in records[0]:
+        values = [record.get(col) for record in records]
+        dtype = schema.get('{category}') if category is not None and col == category.lower() else schema.get(col)
+        if dtype is None:
+            columns[col] = values
+        elif dtype.startswith('datetime'):
+            columns[col] = pd.to_datetime(values, utc = True).tz_localize(None)
+        elif dtype == 'category':
+            columns[col] = pd.Categorical(values)
+        else:
+            # None goes through float as NaN: <NA> in nullable columns (Int64), and a plain integer column with NULLs is
+            # left as float instead of being cast to a garbage integer
+            array = np.array(values, dtype = float)
+            if pd.api.types.is_extension_array_dtype(dtype):
+                columns[col] = pd.array(array, dtype = dtype)
+            elif pd.api.types.is_integer_dtype(dtype) and np.isnan(array).any():
+                columns[col] = array
+            else:
+                columns[col] = array.astype(dtype)
+    return pd.DataFrame(columns)
+
 #Creating a class to query Flipside Data
 class Query:
 
-    def __init__(self, script, api_key = sdk_api_key, data = None):
+    def __init__(self, script, api_key = sdk_api_key, data = None, schema = None):
         self.api_key = api_key
         self.script = script
         self.data = data
+        self.schema = schema if schema is not None else onchain_data.get_schema(script)
+
+    def format_script(self, category = None, groupby = 'day', start_date = None):
+        if groupby is None and start_date is None:
+            return self.script
+        return self.script.format(category,groupby,start_date)
 
     def query_data(self, category= None, groupby = 'day', start_date = None):
         try:
-            if groupby is None and start_date  is None:
-                sdk =  Flipside(self.api_key)
-                sql = self.script
-
-                query_result =  sdk.query(sql)
-                self.data = pd.DataFrame.from_records(query_result.records)
-                return self
-            
-            else : 
-                sdk =  Flipside(self.api_key)
-                sql = self.script.format(category,groupby,start_date)
-                query_result =  sdk.query(sql)
-                self.data = pd.DataFrame.from_records(query_result.records)
-                return self
-        
+            sdk = get_client(self.api_key)
+            sql = self.format_script(category, groupby, start_date)
+            query_result =  sdk.query(sql)
+            self.data = decode_records(query_result.records, self.schema, category)
+            return self
+
         except BaseException as e:
             print(e)
 
+    # Page through the result set and yield one DataFrame per page, so memory stays bounded by page_size rows.
+    # The next page is fetched in the background while the caller works on the current one
+    def stream_data(self, category = None, groupby = 'day', start_date = None, page_size = 100000):
+        sdk = get_client(self.api_key)
+        sql = self.format_script(category, groupby, start_date)
+        query_result = sdk.query(sql, page_size = page_size, page_number = 1)
+        total_pages = query_result.page.totalPages if query_result.page is not None else 1
+
+        def fetch(page_number):
+            return sdk.get_query_results(query_result.query_id, page_number = page_number, page_size = page_size).records
+
+        with ThreadPoolExecutor(max_workers = 1) as executor:
+            next_page = executor.submit(fetch, 2) if total_pages > 1 else None
+            yield decode_records(query_result.records, self.schema, category)
+            for page_number in range(2, total_pages + 1):
+                records = next_page.result()
+                next_page = executor.submit(fetch, page_number + 1) if page_number < total_pages else None
+                yield decode_records(records, self.schema, category)
+
+    # Write every page straight to a Parquet part file in `path`. The folder reads back with pd.read_parquet(path)
+    # The parts go to a temporary folder that replaces `path` once the last page is written, so no part of an earlier,
+    # longer pull is left behind and an interrupted pull keeps the previous folder
+    def stream_to_parquet(self, path, category = None, groupby = 'day', start_date = None, page_size = 100000):
+        path = os.path.normpath(path)
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors = True)
+        os.makedirs(tmp)
+        rows = 0
+        for page_number, chunk in enumerate(self.stream_data(category, groupby, start_date, page_size), start = 1):
+            if len(chunk):
+                chunk.to_parquet(os.path.join(tmp, f'part-{page_number:05d}.parquet'), index = False)
+                rows += len(chunk)
+        shutil.rmtree(path, ignore_errors = True)
+        os.replace(tmp, path)
+        return rows
+
+# Run many queries concurrently with the shared client, at most max_concurrency at a time. The total time is close to
+# the slowest query instead of the sum of all of them
+# queries: {name: (script, category, groupby, start_date)}. Returns {name: DataFrame}, None for the queries that failed
+def query_many(queries, api_key = sdk_api_key, max_concurrency = 4):
+    jobs = {name: Query(params[0], api_key) for name, params in queries.items()}
+    # Identical SQL (same fingerprint, whatever the comments and whitespace) is only sent once
+    sql_by_name = {name: onchain_data.fingerprint(jobs[name].format_script(*queries[name][1:])) for name in jobs}
+    unique = {}
+    for name, sql in sql_by_name.items():
+        unique.setdefault(sql, name)
+
+    def run(name):
+        result = jobs[name].query_data(*queries[name][1:])
+        return None if result is None else result.data
+
+    with ThreadPoolExecutor(max_workers = max_concurrency) as executor:
+        results = dict(zip(unique.values(), executor.map(run, unique.values())))
+    return {name: results[unique[sql]] for name, sql in sql_by_name.items()}
+
+# Run a template of onchain_data.templates by name. Parameters are validated before anything is sent to Flipside
+def query_template(name, category = None, groupby = 'day', start_date = None, api_key = sdk_api_key):
+    template = onchain_data.templates[name]
+    template.validate(category, groupby, start_date)
+    return Query(template.positional(), api_key, schema = template.schema).query_data(category, groupby, start_date)
+
+# Split the result of a multi granularity template into one DataFrame per period, in the shape of the single period query
+def split_granularities(df):
+    return {str(period): part.drop(columns = 'granularity').reset_index(drop = True)
+            for period, part in df.groupby('granularity', observed = True, sort = False)}
+
+# Day, week and month views (or any list of periods) of swap_arb_pools / swap_matic_pool from one warehouse scan, using the
+# *_multi templates of onchain_data. Returns {period: DataFrame}, or None if the query failed
+def query_granularities(name, category = None, granularities = ('day', 'week', 'month'), start_date = None, api_key = sdk_api_key):
+    template = onchain_data.templates[name]
+    sql = template.render(category, list(granularities), start_date)
+    result = Query(sql, api_key, schema = template.schema).query_data(category, None, None)
+    if result is None:
+        return None
+    return split_granularities(result.data)
+
 # Function to build simulation table for Pool liquidity
 def AMM_contract(in_amount, in_price_usd, out_amount, out_price_usd, deposit_limit, token_from, step = 20):
     k = in_amount * out_amount
@@ -61,4 +185,201 @@ def AMM_contract(in_amount, in_price_usd, out_amount, out_price_usd, deposit_lim
     df_amm['Amount_IN_USD'] = df_amm.token_deposit * in_price_usd
     df_amm = df_amm.assign(Amount_OUT_USD = lambda x: (out_amount - x['GNS']) * out_price_usd)
     df_amm['Slippage_USD'] = df_amm.Amount_IN_USD	- df_amm.Amount_OUT_USD
-    return df_amm
\ No newline at end of file
+    return df_amm
+
+# Uniform deposit grid used by AMM_contract: step points from deposit_limit/step up to deposit_limit
+def deposit_grid(deposit_limit, step = 20):
+    return np.arange(1, step + 1) * (deposit_limit / step)
+
+# Array-backed engine for the constant product simulation. Every deposit is evaluated in one pass from k = x*y,
+# so the cost does not depend on a Python loop over the steps.
+# reference: 'first' measures slippage against the first deposit (AMM_contract), 'spot' against the pool price before the swap
+# fee: pool fee taken from each deposit before it reaches the curve, as in the Uniswap v3 GNS pools
+def AMM_arrays(in_amount, in_price_usd, out_amount, out_price_usd, deposits, reference = 'first', fee = 0.0):
+    deposits = np.asarray(deposits, dtype = float)
+    k = in_amount * out_amount
+    in_amount_new = in_amount + deposits * (1 - np.asarray(fee))
+    out_amount_new = k / in_amount_new
+    delta_out = out_amount - out_amount_new
+    out_price_new = deposits / delta_out # Execution price of GNS in Token IN
+    if reference == 'spot':
+        first_price = np.divide(in_amount, out_amount)
+    else:
+        first_price = out_price_new[..., :1]
+    amount_in_usd = deposits * in_price_usd
+    amount_out_usd = delta_out * out_price_usd
+    return {
+        'token_deposit': deposits,
+        'in_amount': in_amount_new,
+        'out_amount': out_amount_new,
+        'K': np.broadcast_to(k, deposits.shape),
+        'out_price': out_price_new,
+        'in_price': out_price_new**-1,
+        'out_price_usd': out_price_new * in_price_usd,
+        'slippage_percent': (out_price_new - first_price) / first_price * 100,
+        'amount_in_usd': amount_in_usd,
+        'amount_out_usd': amount_out_usd,
+        'slippage_usd': amount_in_usd - amount_out_usd,
+        # Same definition as avg_slippage in the Flipside queries
+        'slippage': (amount_in_usd * (1 - np.asarray(fee)) - amount_out_usd) / amount_in_usd
+    }
+
+# Build the AMM_contract table from the arrays returned by AMM_arrays
+def AMM_frame(arrays, token_from):
+    return pd.DataFrame({
+        'token_deposit': arrays['token_deposit'],
+        token_from: arrays['in_amount'],
+        'GNS': arrays['out_amount'],
+        'K': arrays['K'],
+        f'Price of GNS in {token_from}': arrays['out_price'],
+        f'Price of {token_from} in GNSD': arrays['in_price'],
+        'Price of GNS in USD': arrays['out_price_usd'],
+        'GNS Slippage percent': arrays['slippage_percent'],
+        'Amount_IN_USD': arrays['amount_in_usd'],
+        'Amount_OUT_USD': arrays['amount_out_usd'],
+        'Slippage_USD': arrays['slippage_usd']
+    })
+
+# Vectorized version of AMM_contract. Same columns, computed without the row by row loop
+# The grid is built as multiples of deposit_limit/step, so it always has exactly `step` rows
+def AMM_contract_vectorized(in_amount, in_price_usd, out_amount, out_price_usd, deposit_limit, token_from, step = 20, fee = 0.0):
+    arrays = AMM_arrays(in_amount, in_price_usd, out_amount, out_price_usd, deposit_grid(deposit_limit, step), fee = fee)
+    return AMM_frame(arrays, token_from)
+
+# Batch entry point: one row of inputs per scenario (reserves, prices, deposit_limit), all evaluated in a single
+# broadcasted (scenarios x step) computation. Returns one long format table with a row per scenario and step
+# When fee is None, the fee of each scenario is taken from its pool in onchain_data.pools (0 without pools)
+def AMM_batch(in_amount, in_price_usd, out_amount, out_price_usd, deposit_limit, step = 20, pool = None, fee = None):
+    if fee is None and pool is not None:
+        unique_pools, pool_index = np.unique(pool, return_inverse = True)
+        fee = np.array([onchain_data.get_pool_fee(p) for p in unique_pools])[pool_index]
+    elif fee is None:
+        fee = 0.0
+    in_amount, in_price_usd, out_amount, out_price_usd, deposit_limit, fee = np.broadcast_arrays(
+        *[np.asarray(x, dtype = float).reshape(-1) for x in (in_amount, in_price_usd, out_amount, out_price_usd, deposit_limit, fee)]
+    )
+    n_scenarios = len(deposit_limit)
+    deposits = np.arange(1, step + 1) * (deposit_limit / step)[:, None]
+    arrays = AMM_arrays(in_amount[:, None], in_price_usd[:, None], out_amount[:, None], out_price_usd[:, None], deposits, fee = fee[:, None])
+
+    df_batch = pd.DataFrame({
+        'scenario': np.repeat(np.arange(n_scenarios), step),
+        'step': np.tile(np.arange(1, step + 1), n_scenarios),
+        **{col: values.reshape(-1) for col, values in arrays.items()}
+    })
+    if pool is not None:
+        df_batch.insert(1, 'pool', np.repeat(np.broadcast_to(np.asarray(pool), (n_scenarios,)), step))
+    return df_batch
+
+# Closed form constant product price impact for any trade sizes (log spaced grid, a list of sizes or a single trade)
+# Buying with d tokens IN, of which d * (1 - fee) reach the curve, gives out_amount * d (1 - fee) / (in_amount + d (1 - fee))
+# tokens OUT. The slippage is the execution price d / amount_out against the spot price in_amount / out_amount
+def price_impact(in_amount, out_amount, trade_sizes, fee = 0.0):
+    trade_sizes = np.asarray(trade_sizes, dtype = float)
+    effective = trade_sizes * (1 - np.asarray(fee))
+    return {
+        'trade_size': trade_sizes,
+        'amount_out': out_amount * effective / (in_amount + effective),
+        'execution_price': (in_amount + effective) / (out_amount * (1 - np.asarray(fee))),
+        'spot_price': np.broadcast_to(np.divide(in_amount, out_amount), trade_sizes.shape),
+        'slippage_percent': ((in_amount + effective) / (in_amount * (1 - np.asarray(fee))) - 1) * 100
+    }
+
+# Inverse problem: largest trade (in tokens IN) whose slippage against the spot price stays under slippage_percent
+# It is 0 when the fee alone is larger than the allowed slippage
+def max_trade_for_slippage(in_amount, slippage_percent, fee = 0.0):
+    fee = np.asarray(fee)
+    max_trade = np.multiply(in_amount, (1 + np.asarray(slippage_percent) / 100) * (1 - fee) - 1) / (1 - fee)
+    return np.maximum(max_trade, 0)
+
+# AMM_contract table on a caller supplied grid of trade sizes. Slippage is measured against the spot price,
+# so the table is meaningful for a single trade size too
+def AMM_curve(in_amount, in_price_usd, out_amount, out_price_usd, trade_sizes, token_from, fee = 0.0):
+    trade_sizes = np.asarray(trade_sizes, dtype = float).reshape(-1)
+    arrays = AMM_arrays(in_amount, in_price_usd, out_amount, out_price_usd, trade_sizes, reference = 'spot', fee = fee)
+    return AMM_frame(arrays, token_from)
+
+# Sweep of trade sizes across fee tiers in one broadcasted (fees x sizes) computation. Defaults to every fee tier
+# of the GNS pools, and the slippage column is comparable with avg_slippage from the Flipside queries
+def AMM_fee_sweep(in_amount, in_price_usd, out_amount, out_price_usd, trade_sizes, fees = None):
+    fees = np.asarray(onchain_data.get_fee_tiers() if fees is None else fees, dtype = float).reshape(-1)
+    trade_sizes = np.asarray(trade_sizes, dtype = float).reshape(-1)
+    arrays = AMM_arrays(in_amount, in_price_usd, out_amount, out_price_usd,
+                        np.broadcast_to(trade_sizes, (len(fees), len(trade_sizes))), reference = 'spot', fee = fees[:, None])
+    return pd.DataFrame({
+        'fee': np.repeat(fees, len(trade_sizes)),
+        **{col: np.broadcast_to(values, (len(fees), len(trade_sizes))).reshape(-1) for col, values in arrays.items()}
+    })
+
+# Incremental AMM_contract for one pool state. Every deposit already computed is kept, so extending deposit_limit or adding
+# resolution only evaluates the new deposits. Each point only depends on the initial reserves, so a table built from the
+# kept points is identical to a fresh AMM_contract_vectorized.
+# Safe to share between threads: the deposits and their arrays are swapped in together under a lock, and readers work on
+# the (deposits, arrays) pair they got. Past max_points stored deposits, the store starts over from the requested ones
+class AMMSimulation:
+
+    def __init__(self, in_amount, in_price_usd, out_amount, out_price_usd, token_from, fee = 0.0, max_points = 100000):
+        self.key = (in_amount, in_price_usd, out_amount, out_price_usd, token_from, fee)
+        self.max_points = max_points
+        self.state = (np.empty(0), {})
+        self.lock = threading.Lock()
+
+    @property
+    def deposits(self):
+        return self.state[0]
+
+    @property
+    def arrays(self):
+        return self.state[1]
+
+    def matches(self, in_amount, in_price_usd, out_amount, out_price_usd, token_from, fee = 0.0):
+        return self.key == (in_amount, in_price_usd, out_amount, out_price_usd, token_from, fee)
+
+    def __len__(self):
+        return len(self.deposits)
+
+    # Compute the deposits that are not stored yet and merge them in deposit order. Returns the new (deposits, arrays)
+    def _merge(self, deposits):
+        deposits = np.unique(np.asarray(deposits, dtype = float))
+        with self.lock:
+            stored, arrays = self.state
+            new = deposits[~np.isin(deposits, stored)]
+            if len(new) == 0:
+                return self.state
+            if len(stored) + len(new) > self.max_points:
+                stored, arrays, new = np.empty(0), {}, deposits
+            in_amount, in_price_usd, out_amount, out_price_usd, token_from, fee = self.key
+            new_arrays = AMM_arrays(in_amount, in_price_usd, out_amount, out_price_usd, new, fee = fee)
+            order = np.argsort(np.concatenate([stored, new]), kind = 'stable')
+            self.state = (np.concatenate([stored, new])[order],
+                          {col: np.concatenate([arrays[col], values])[order] if arrays else values[order]
+                           for col, values in new_arrays.items()})
+            return self.state
+
+    def append(self, deposits):
+        self._merge(deposits)
+        return self
+
+    # AMM_arrays for the given deposits of a state. Slippage is measured against the first of them, as in AMM_contract
+    def _arrays(self, index, state = None):
+        arrays = {col: values[index] for col, values in (state or self.state)[1].items()}
+        first_price = arrays['out_price'][:1]
+        arrays['slippage_percent'] = (arrays['out_price'] - first_price) / first_price * 100
+        return arrays
+
+    def _frame(self, index, state = None):
+        return AMM_frame(self._arrays(index, state), self.key[4])
+
+    def table(self, deposit_limit, step = 20):
+        return AMM_frame(self.table_arrays(deposit_limit, step), self.key[4])
+
+    # Same as table, as the AMM_arrays dict (no DataFrame)
+    def table_arrays(self, deposit_limit, step = 20):
+        deposits = deposit_grid(deposit_limit, step)
+        state = self._merge(deposits)
+        return self._arrays(np.searchsorted(state[0], deposits), state)
+
+    # Stored points with lower <= deposit <= upper, without computing anything new
+    def slice(self, lower = 0, upper = np.inf):
+        state = self.state
+        return self._frame(np.flatnonzero((state[0] >= lower) & (state[0] <= upper)), state)
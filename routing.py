@@ -0,0 +1,108 @@
+import itertools
+import numpy as np
+import onchain_data
+
+#------------------------------------------------- TRADE ROUTER --------------------------------------------------------#
+# Routes a trade across the GNS pools of onchain_data.pools (plus any extra pool, e.g. a WETH-USDC pool for USDC->WETH->GNS)
+# Every pool is modelled as x*y=k with its fee tier, and a route is the chain of swaps through its pools.
+# Splits are searched on a grid over the simplex of route weights, all evaluated in one NumPy pass
+
+# Tokens out of a constant product swap, vectorized over amounts_in
+def swap_out(reserve_in, reserve_out, amounts_in, fee = 0.0):
+    effective = np.asarray(amounts_in, dtype = float) * (1 - fee)
+    return reserve_out * effective / (reserve_in + effective)
+
+# All the ways to split `resolution` units across n routes, as an (n_splits x n) array of weights summing to 1
+def split_grid(n, resolution = 20):
+    bars = list(itertools.combinations(range(resolution + n - 1), n - 1))
+    bars = np.array(bars, dtype = int).reshape(len(bars), n - 1)
+    edges = np.hstack([np.full((len(bars), 1), -1), bars, np.full((len(bars), 1), resolution + n - 1)])
+    return (np.diff(edges, axis = 1) - 1) / resolution
+
+
+class Router:
+    """Split and multi-hop routing across GNS pools
+
+    Parameters
+    reserves: {pool: (reserve0, reserve1)} in token units. Pools of onchain_data.pools are given by pool_name or address,
+              other pools by their name in extra_pools
+    extra_pools: {pool: {'token0': ..., 'token1': ..., 'fee': ...}} for pools not listed in onchain_data, or fields missing
+                 from it. The Polygon pools have no pool_name nor token1 in onchain_data (they come from
+                 polygon.core.ez_dex_swaps), so they are given by address with their token1 here, e.g. {address: {'token1': 'DAI'}}
+    max_hops: longest route considered
+    """
+    def __init__(self, reserves, extra_pools = None, max_hops = 2):
+        pool_info = {}
+        for address, info in onchain_data.pools.items():
+            pool_info[address] = info
+            if info['pool_name'] is not None:
+                pool_info[info['pool_name']] = info
+        for name, info in (extra_pools or {}).items():
+            pool_info[name] = {**pool_info.get(name, {}), **info}
+        for name in reserves:
+            if name not in pool_info or pool_info[name].get('token1') is None:
+                raise ValueError(f'Unknown tokens for pool {name}, pass them in extra_pools')
+        self.pools = {name: {**pool_info[name], 'reserve0': reserves[name][0], 'reserve1': reserves[name][1]}
+                      for name in reserves}
+        self.max_hops = max_hops
+
+    def routes(self, token_in, token_out):
+        """Every route from token_in to token_out as a list of (pool_name, token_in, token_out) hops"""
+        found = []
+        def walk(token, path, used):
+            if token == token_out and path:
+                found.append(path)
+                return
+            if len(path) == self.max_hops:
+                return
+            for name, pool in self.pools.items():
+                if name in used or token not in (pool['token0'], pool['token1']):
+                    continue
+                next_token = pool['token1'] if token == pool['token0'] else pool['token0']
+                walk(next_token, path + [(name, token, next_token)], used | {name})
+        walk(token_in, [], frozenset())
+        return found
+
+    def quote(self, route, amounts_in):
+        """Amount out of a route for every amount in `amounts_in`"""
+        amounts = np.asarray(amounts_in, dtype = float)
+        for name, hop_in, hop_out in route:
+            pool = self.pools[name]
+            reserve_in, reserve_out = (pool['reserve0'], pool['reserve1']) if hop_in == pool['token0'] else (pool['reserve1'], pool['reserve0'])
+            amounts = swap_out(reserve_in, reserve_out, amounts, pool['fee'])
+        return amounts
+
+    def best_split(self, routes, amount_in, resolution = 20):
+        """Best split of amount_in across routes that do not share pools
+        Returns the weights of each route and the total amount out"""
+        route_pools = [name for route in routes for name, _, _ in route]
+        if len(route_pools) != len(set(route_pools)):
+            raise ValueError('Routes in a split must not share pools')
+        weights = split_grid(len(routes), resolution)
+        outputs = np.column_stack([self.quote(route, weights[:, i] * amount_in) for i, route in enumerate(routes)])
+        total = outputs.sum(axis = 1)
+        best = np.argmax(total)
+        return {'routes': routes, 'weights': weights[best], 'amount_out': total[best]}
+
+    def optimal_route(self, token_in, token_out, amount_in, max_routes = 3, resolution = 20):
+        """Best way to trade amount_in of token_in for token_out, across single routes and splits.
+        Routes are ranked by their quote for the full amount, and the best ones without shared pools are split"""
+        routes = self.routes(token_in, token_out)
+        if not routes:
+            raise ValueError(f'No route from {token_in} to {token_out}')
+        quotes = np.array([self.quote(route, amount_in) for route in routes])
+        ranked = [routes[i] for i in np.argsort(-quotes)]
+
+        candidates, used = [], set()
+        for route in ranked:
+            names = {name for name, _, _ in route}
+            if not names & used:
+                candidates.append(route)
+                used |= names
+            if len(candidates) == max_routes:
+                break
+
+        split = self.best_split(candidates, amount_in, resolution)
+        split['best_single_route'] = ranked[0]
+        split['best_single_amount_out'] = quotes.max()
+        return split
@@ -0,0 +1,90 @@
+import threading
+import time
+from cachetools import LRUCache, TTLCache
+import query_data
+
+#---------------------------------------------- SIMULATION CACHE -------------------------------------------------------#
+# Bounded LRU + TTL cache for the simulator callback. Entries are keyed on normalized inputs: prices are rounded to a number
+# of significant digits, so tiny price moves and repeated submissions from different users share the same entry
+
+# Round a price to `digits` significant digits
+def round_price(price, digits = 4):
+    return float(f'{price:.{digits}g}')
+
+
+class SimulationCache:
+    """Thread safe LRU cache with a time to live and hit/miss counters
+
+    Parameters
+    maxsize: maximum number of scenarios kept, least recently used ones are evicted first
+    ttl: seconds an entry is served before being recomputed
+    price_digits: significant digits kept in the prices of the key
+    timer: clock the time to live is measured with
+    """
+    def __init__(self, maxsize = 256, ttl = 600, price_digits = 4, timer = time.monotonic):
+        self.cache = TTLCache(maxsize = maxsize, ttl = ttl, timer = timer)
+        self.price_digits = price_digits
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, token, GNS_amount, token1_amount, token_swapped, token1_price_usd, token0_price_usd):
+        return (token, float(GNS_amount), float(token1_amount), float(token_swapped),
+                round_price(token1_price_usd, self.price_digits), round_price(token0_price_usd, self.price_digits))
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+        value = compute()
+        with self.lock:
+            self.cache[key] = value
+        return value
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'size': len(self.cache),
+                'maxsize': self.cache.maxsize,
+                'ttl': self.cache.ttl
+            }
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class SimulationPool:
+    """Thread safe LRU of query_data.AMMSimulation objects, one per pool state (reserves, prices, token and fee)
+
+    Parameters
+    maxsize: maximum number of pool states kept, least recently used ones are dropped first
+    max_points: deposits stored per simulation, see query_data.AMMSimulation
+    """
+    def __init__(self, maxsize = 32, max_points = 100000):
+        self.simulations = LRUCache(maxsize = maxsize)
+        self.max_points = max_points
+        self.lock = threading.Lock()
+
+    def get(self, in_amount, in_price_usd, out_amount, out_price_usd, token_from, fee = 0.0):
+        key = (in_amount, in_price_usd, out_amount, out_price_usd, token_from, fee)
+        with self.lock:
+            if key not in self.simulations:
+                self.simulations[key] = query_data.AMMSimulation(*key, max_points = self.max_points)
+            return self.simulations[key]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.simulations)
+
+    def clear(self):
+        with self.lock:
+            self.simulations.clear()
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+import swap_store
+
+#--------------------------------------------- HISTORICAL SLIPPAGE METRICS ---------------------------------------------#
+# The Flipside templates only report AVG(slippage), which is driven by the many small trades. Here swap level rows are folded
+# chunk by chunk (SwapStore.swaps(), Query.stream_data pages, ...) into volume weighted averages and quantile sketches per
+# pool and time bucket, and per pool and trade size, so p50/p90/p99 and slippage vs size curves scale to millions of swaps
+# in a memory bounded by the number of groups
+
+QUANTILES = (0.5, 0.9, 0.99)
+# Trade size buckets of the slippage vs size curves, in USD
+SIZE_BINS = np.array([0, 10, 100, 1e3, 1e4, 1e5, 1e6, np.inf])
+
+
+class QuantileSketch:
+    """Mergeable log bucket quantile sketch (DDSketch)
+
+    Values are counted in buckets growing geometrically by gamma = (1 + a) / (1 - a), so any quantile is returned within a
+    relative error a, whatever the number of values. Negative values (swaps with a price improvement) have their own
+    buckets, and values smaller than min_value in absolute terms are counted as 0
+
+    Parameters
+    relative_accuracy: a, relative error of the quantiles
+    min_value, max_value: range of absolute values kept with the relative accuracy, values beyond max_value are clipped
+    """
+    def __init__(self, relative_accuracy = 0.01, min_value = 1e-6, max_value = 10.0):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.min_key = int(np.ceil(np.log(min_value) / np.log(self.gamma)))
+        self.n_keys = int(np.ceil(np.log(max_value) / np.log(self.gamma))) - self.min_key + 1
+        # Ascending values: negatives from the largest absolute value, zero, then positives
+        self.counts = np.zeros(2 * self.n_keys + 1, dtype = np.int64)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    # Bucket of each value, vectorized
+    def index(self, values):
+        values = np.asarray(values, dtype = float)
+        magnitude = np.clip(np.abs(values), self.min_value, self.max_value)
+        keys = np.ceil(np.log(magnitude) / np.log(self.gamma)).astype(np.int64) - self.min_key
+        keys = np.clip(keys, 0, self.n_keys - 1)
+        index = np.where(values > 0, self.n_keys + 1 + keys, self.n_keys - 1 - keys)
+        return np.where(np.abs(values) < self.min_value, self.n_keys, index)
+
+    def add(self, values):
+        values = np.asarray(values, dtype = float)
+        values = values[~np.isnan(values)]
+        self.counts += np.bincount(self.index(values), minlength = len(self.counts))
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    # Representative value of every bucket, within the relative accuracy of any value of the bucket
+    def values(self):
+        keys = np.arange(self.n_keys) + self.min_key
+        positive = 2 * self.gamma ** keys / (self.gamma + 1)
+        return np.concatenate([-positive[::-1], [0.0], positive])
+
+    def quantile(self, q):
+        """Quantile(s) q in [0, 1] of the values added, NaN when the sketch is empty"""
+        q = np.asarray(q, dtype = float)
+        total = self.counts.sum()
+        if total == 0:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        rank = np.searchsorted(np.cumsum(self.counts), q * (total - 1), side = 'right')
+        return self.values()[rank]
+
+
+class SlippageMetrics:
+    """Volume weighted slippage, slippage quantiles and slippage vs size curves built incrementally from swap level rows
+
+    Parameters
+    groupby: date bucket of the time series, one of hour, day, week or month
+    by: column the swaps are grouped on (pool_name, platform, blockchain, ...)
+    size_bins: edges of the trade size buckets (amount_in_usd) of the slippage vs size curves
+    relative_accuracy: relative error of the quantiles, see QuantileSketch
+    """
+    def __init__(self, groupby = 'day', by = 'pool_name', size_bins = SIZE_BINS, relative_accuracy = 0.01):
+        self.groupby = groupby
+        self.by = by
+        self.size_bins = np.asarray(size_bins, dtype = float)
+        self.relative_accuracy = relative_accuracy
+        # {group: [sketch, swaps, volume, volume weighted slippage sum]}
+        self.buckets = {}
+        self.sizes = {}
+
+    def _fold(self, groups, key_columns, slippage, amount_in):
+        # Factorize each key column, then the combination of their codes. Missing keys get a code of their own instead of -1
+        factorized = [pd.factorize(column, use_na_sentinel = False) for column in key_columns]
+        combined = np.ravel_multi_index([codes for codes, _ in factorized], [len(values) for _, values in factorized])
+        combined, codes = np.unique(combined, return_inverse = True)
+        uniques = list(zip(*[values[position] for (_, values), position in
+                             zip(factorized, np.unravel_index(combined, [len(values) for _, values in factorized]))]))
+        valid = ~np.isnan(slippage)
+        proto = QuantileSketch(self.relative_accuracy)
+        index = proto.index(np.where(valid, slippage, 0.0))
+        n_buckets = len(proto.counts)
+        # One bincount for the sketches of every group of the chunk
+        counts = np.bincount(codes[valid] * n_buckets + index[valid], minlength = len(uniques) * n_buckets)
+        counts = counts.reshape(len(uniques), n_buckets)
+        swaps = np.bincount(codes[valid], minlength = len(uniques))
+        volume = np.bincount(codes[valid], weights = amount_in[valid], minlength = len(uniques))
+        weighted = np.bincount(codes[valid], weights = (slippage * amount_in)[valid], minlength = len(uniques))
+        for i, key in enumerate(uniques):
+            if key not in groups:
+                groups[key] = [QuantileSketch(self.relative_accuracy), 0, 0.0, 0.0]
+            group = groups[key]
+            group[0].counts += counts[i]
+            group[1] += swaps[i]
+            group[2] += volume[i]
+            group[3] += weighted[i]
+
+    def update(self, swaps):
+        """Add a chunk of swap level rows (onchain_data.swap_raw schema). Swaps without any amount in are left out, swaps
+        without a group are counted in the swap_store.MISSING_GROUP group"""
+        slippage = swap_store.swap_slippage(swaps).to_numpy(dtype = float)
+        amount_in = swaps['amount_in_usd'].to_numpy(dtype = float)
+        by = swap_store.swap_groups(swaps[self.by]).to_numpy()
+        dates = swap_store.date_trunc(swaps['hour'], self.groupby).to_numpy()
+        size_bucket = np.clip(np.searchsorted(self.size_bins, amount_in, side = 'right') - 1, 0, len(self.size_bins) - 2)
+        self._fold(self.buckets, [by, dates], slippage, amount_in)
+        self._fold(self.sizes, [by, size_bucket], slippage, amount_in)
+        return self
+
+    # Sort key of the groups: the missing group comes last, so it is never compared with group values of another type
+    @staticmethod
+    def _order(item):
+        key = item[0]
+        return (key[0] == swap_store.MISSING_GROUP, key[1:] if key[0] == swap_store.MISSING_GROUP else key)
+
+    def _frame(self, groups, columns, quantiles):
+        rows = []
+        for key, (sketch, swaps, volume, weighted) in sorted(groups.items(), key = self._order):
+            rows.append([*key, swaps, volume, weighted / volume if volume else np.nan, *sketch.quantile(quantiles)])
+        names = [f'p{q * 100:g}' for q in quantiles]
+        return pd.DataFrame(rows, columns = columns + ['swaps', 'vol', 'vw_slippage'] + names)
+
+    def by_bucket(self, quantiles = QUANTILES):
+        """One row per group and date: swaps, vol, volume weighted slippage and slippage quantiles (p50, p90, p99, ...)"""
+        return self._frame(self.buckets, [self.by, 'date'], quantiles)
+
+    def by_size(self, quantiles = QUANTILES):
+        """Slippage vs trade size curve: one row per group and size bucket, with the bounds of the bucket in USD"""
+        df = self._frame(self.sizes, [self.by, 'size_bucket'], quantiles)
+        df.insert(2, 'size_from_usd', self.size_bins[df['size_bucket'].astype(int)])
+        df.insert(3, 'size_to_usd', self.size_bins[df['size_bucket'].astype(int) + 1])
+        return df
+
+    def overall(self, quantiles = QUANTILES):
+        """Same metrics per group over the whole history, merging the sketches of every date"""
+        merged = {}
+        for (group, _), (sketch, swaps, volume, weighted) in self.buckets.items():
+            if (group,) not in merged:
+                merged[(group,)] = [QuantileSketch(self.relative_accuracy), 0, 0.0, 0.0]
+            total = merged[(group,)]
+            total[0].merge(sketch)
+            total[1] += swaps
+            total[2] += volume
+            total[3] += weighted
+        return self._frame(merged, [self.by], quantiles)
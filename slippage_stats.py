@@ -0,0 +1,123 @@
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import swap_store
+
+#-------------------------------------------- RUNNING SLIPPAGE STATISTICS ----------------------------------------------#
+# The Flipside templates compute slippage_overall with a subquery over every swap, repeated on each row. Here the slippage
+# of the swaps is folded into exact running sums and counts per pool and per day, so overall, daily and rolling averages
+# (7d, 30d, ...) are read from one row per pool and day, and new swaps are added without going over the old ones again
+
+STATS_DIR = 'slippage_stats'
+
+# Daily sums and counts of the swap slippage per group, NULL slippages (nothing went in) being left out like AVG does.
+# Swaps without a group are summed in the swap_store.MISSING_GROUP group
+def daily_sums(swaps, by = 'pool_name'):
+    slippage = swap_store.swap_slippage(swaps)
+    df = pd.DataFrame({'date': swap_store.date_trunc(swaps['hour'], 'day'), by: swap_store.swap_groups(swaps[by]),
+                       'slippage_sum': slippage, 'slippage_count': slippage.notna().astype('int64'),
+                       'vol': swaps['amount_in_usd']})
+    return (df.groupby([by, 'date'], observed = True, sort = True)
+              .agg(slippage_sum = ('slippage_sum', 'sum'), slippage_count = ('slippage_count', 'sum'), vol = ('vol', 'sum'))
+              .reset_index())
+
+
+class SlippageStats:
+    """Running slippage sums and counts per pool and per day
+
+    Parameters
+    path: folder where the statistics are saved, None to keep them in memory only
+    by: column the swaps are grouped on (pool_name, platform, blockchain, ...)
+
+    Swaps are deduplicated with a watermark per group: the latest hour added for the group and the tx_hash already
+    counted in that hour. Rows older than the watermark of their group are skipped, so a pull overlapping the previous
+    one can be added as it is, and groups (pools, chains) can be pulled separately and at different times. Swaps without
+    a group are counted in the swap_store.MISSING_GROUP group, as in slippage_metrics
+    """
+    def __init__(self, path = None, by = 'pool_name'):
+        self.path = path
+        self.by = by
+        self.daily = pd.DataFrame({by: pd.Series(dtype = object), 'date': pd.Series(dtype = 'datetime64[ns]'),
+                                   'slippage_sum': pd.Series(dtype = float), 'slippage_count': pd.Series(dtype = 'int64'),
+                                   'vol': pd.Series(dtype = float)})
+        # {group: (latest hour added, tx_hash counted in that hour)}
+        self.watermarks = {}
+        if path is not None and os.path.exists(os.path.join(path, 'daily.parquet')):
+            self.load()
+
+    def update(self, swaps):
+        """Add the swap level rows (onchain_data.swap_raw schema) not counted yet. Returns the number of swaps added"""
+        new_swaps = []
+        swaps = swaps.assign(**{self.by: swap_store.swap_groups(swaps[self.by])})
+        for group, rows in swaps.groupby(self.by, sort = False):
+            hours = pd.to_datetime(rows['hour'])
+            watermark, watermark_tx = self.watermarks.get(group, (None, set()))
+            if watermark is not None:
+                new = (hours > watermark) | ((hours == watermark) & ~rows['tx_hash'].isin(watermark_tx))
+                rows, hours = rows[new], hours[new]
+            if len(rows) == 0:
+                continue
+            last = hours.max()
+            last_tx = set(rows.loc[hours == last, 'tx_hash'])
+            self.watermarks[group] = (last, watermark_tx | last_tx if last == watermark else last_tx)
+            new_swaps.append(rows)
+        if not new_swaps:
+            return 0
+
+        swaps = pd.concat(new_swaps)
+        sums = daily_sums(swaps, self.by)
+        sums[self.by] = sums[self.by].astype(object)
+        self.daily = (pd.concat([self.daily, sums], ignore_index = True)
+                        .groupby([self.by, 'date'], sort = True).sum().reset_index())
+        if self.path is not None:
+            self.save()
+        return len(swaps)
+
+    def overall(self, start_date = None, end_date = None):
+        """Average slippage per group between two dates (included), the equivalent of slippage_overall"""
+        daily = self.daily
+        if start_date is not None:
+            daily = daily[daily['date'] >= pd.Timestamp(start_date)]
+        if end_date is not None:
+            daily = daily[daily['date'] <= pd.Timestamp(end_date)]
+        totals = daily.groupby(self.by)[['slippage_sum', 'slippage_count', 'vol']].sum()
+        totals['avg_slippage'] = totals['slippage_sum'] / totals['slippage_count'].where(totals['slippage_count'] > 0)
+        return totals.reset_index()
+
+    def rolling(self, window = '7D'):
+        """Average slippage per group and day over the trailing `window` (7D, 30D, ...), days without swaps included"""
+        frames = []
+        for group, daily in self.daily.groupby(self.by, sort = True):
+            daily = daily.set_index('date')[['slippage_sum', 'slippage_count', 'vol']]
+            daily = daily.reindex(pd.date_range(daily.index.min(), daily.index.max(), freq = 'D'), fill_value = 0)
+            sums = daily.rolling(window).sum()
+            frames.append(pd.DataFrame({
+                self.by: group,
+                'date': sums.index,
+                'vol': sums['vol'].values,
+                'avg_slippage': (sums['slippage_sum'] / sums['slippage_count'].where(sums['slippage_count'] > 0)).values
+            }))
+        if not frames:
+            return pd.DataFrame(columns = [self.by, 'date', 'vol', 'avg_slippage'])
+        return pd.concat(frames, ignore_index = True)
+
+    # The watermark is stored in the metadata of daily.parquet, written to a temporary file and moved in place, so the
+    # sums and the watermark are always saved together: a crash can never leave new sums next to an old watermark
+    def save(self):
+        os.makedirs(self.path, exist_ok = True)
+        # Groups as plain Python values (numpy scalars when grouping on fee)
+        watermark = json.dumps({'by': self.by, 'watermarks': [[getattr(group, 'item', lambda: group)(), hour.isoformat(), sorted(tx_hash)]
+                                                              for group, (hour, tx_hash) in self.watermarks.items()]})
+        path = os.path.join(self.path, 'daily.parquet')
+        table = pa.Table.from_pandas(self.daily, preserve_index = False)
+        pq.write_table(table.replace_schema_metadata({**table.schema.metadata, b'watermark': watermark.encode()}), f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+    def load(self):
+        table = pq.read_table(os.path.join(self.path, 'daily.parquet'))
+        self.daily = table.to_pandas()
+        watermark = json.loads(table.schema.metadata[b'watermark'])
+        self.by = watermark['by']
+        self.watermarks = {group: (pd.Timestamp(hour), set(tx_hash)) for group, hour, tx_hash in watermark['watermarks']}
@@ -0,0 +1,103 @@
+import os
+import pandas as pd
+import onchain_data
+import query_data
+
+#------------------------------------------------ LOCAL SWAP STORE -----------------------------------------------------#
+# The Flipside templates aggregate in the warehouse (DATE_TRUNC('{1}') ... GROUP BY {0}), so every new granularity or grouping
+# costs another query. Here the swap level rows (onchain_data.swap_arb_raw / swap_matic_raw) are pulled once into local
+# Parquet files and any day/week/month x pool/platform/token aggregation is computed locally with a vectorized groupby
+
+STORE_DIR = 'swap_store'
+
+# Raw templates pulled by SwapStore.pull
+RAW_TEMPLATES = {'arbitrum': onchain_data.swap_arb_raw, 'polygon': onchain_data.swap_matic_raw}
+
+# Same buckets as Snowflake DATE_TRUNC (weeks start on Monday)
+def date_trunc(hours, groupby = 'day'):
+    hours = pd.to_datetime(hours)
+    if groupby == 'hour':
+        return hours.dt.floor('h')
+    if groupby == 'day':
+        return hours.dt.floor('D')
+    if groupby == 'week':
+        return hours.dt.floor('D') - pd.to_timedelta(hours.dt.weekday, unit = 'D')
+    if groupby == 'month':
+        return hours.dt.to_period('M').dt.to_timestamp()
+    raise ValueError(f'Unsupported groupby: {groupby}')
+
+# Group of the swaps without a value in the grouping column (e.g. ez_dex_swaps rows without pool_name)
+MISSING_GROUP = 'unknown'
+
+# Grouping column with the missing values replaced by MISSING_GROUP, used by slippage_stats and slippage_metrics
+def swap_groups(column):
+    column = column.astype(object)
+    return column.where(column.notna(), MISSING_GROUP)
+
+# Slippage of every swap, same definition as the Flipside templates (NULL when nothing went in)
+def swap_slippage(swaps):
+    amount_in = swaps['amount_in_usd'].where(swaps['amount_in_usd'] != 0)
+    return (amount_in * (1 - swaps['fee'].astype(float)) - swaps['amount_out_usd']) / amount_in
+
+def aggregate(swaps, groupby = 'day', by = 'pool_name', start_date = None):
+    """Aggregate swap level rows like the Flipside templates
+
+    Parameters
+    groupby: date bucket, one of hour, day, week or month
+    by: column or list of columns to group on (pool_name, platform, blockchain, token_in, ...), None for the total
+    start_date: first bucket kept
+
+    Returns one row per date and group with vol, sum_amount_out_usd, avg_slippage, slippage_overall (over the whole
+    window) and vol_cumulative (per group)
+    """
+    by = [] if by is None else [by] if isinstance(by, str) else list(by)
+    df = pd.DataFrame({'date': date_trunc(swaps['hour'], groupby), 'amount_in_usd': swaps['amount_in_usd'],
+                       'amount_out_usd': swaps['amount_out_usd'], 'slippage': swap_slippage(swaps)})
+    # Swaps without a value in a group column are kept in the MISSING_GROUP group, as SQL GROUP BY keeps a NULL group
+    for col in by:
+        df[col] = swap_groups(swaps[col])
+    if start_date is not None:
+        df = df[df['date'] >= pd.Timestamp(start_date)]
+
+    result = (df.groupby(['date'] + by, observed = True, sort = True)
+                .agg(vol = ('amount_in_usd', 'sum'), sum_amount_out_usd = ('amount_out_usd', 'sum'), avg_slippage = ('slippage', 'mean'))
+                .reset_index())
+    result['slippage_overall'] = df['slippage'].mean()
+    result['vol_cumulative'] = result.groupby(by, observed = True)['vol'].cumsum() if by else result['vol'].cumsum()
+    return result
+
+
+class SwapStore:
+    """Swap level rows kept in local Parquet files, one folder per chain
+
+    Parameters
+    path: folder of the store
+    api_key: Flipside API key used by pull
+    """
+    def __init__(self, path = STORE_DIR, api_key = query_data.sdk_api_key):
+        self.path = path
+        self.api_key = api_key
+        self._swaps = None
+
+    def pull(self, chain, start_date, page_size = 100000):
+        """Stream the raw swaps of `chain` (arbitrum or polygon) since start_date into the store"""
+        folder = os.path.join(self.path, chain, pd.Timestamp(start_date).strftime('%Y-%m-%d'))
+        rows = query_data.Query(RAW_TEMPLATES[chain], self.api_key).stream_to_parquet(folder, start_date = start_date, page_size = page_size)
+        self._swaps = None
+        return rows
+
+    def swaps(self):
+        """All the stored swaps, read once and kept in memory. Rows pulled twice are only kept once"""
+        if self._swaps is None:
+            files = [os.path.join(root, file) for root, _, names in os.walk(self.path) for file in sorted(names) if file.endswith('.parquet')]
+            if not files:
+                return pd.DataFrame(columns = list(onchain_data.schemas['swap_raw']))
+            swaps = pd.concat([pd.read_parquet(file) for file in files], ignore_index = True)
+            for col, dtype in onchain_data.schemas['swap_raw'].items():
+                if dtype == 'category':
+                    swaps[col] = swaps[col].astype('category')
+            self._swaps = swaps.drop_duplicates().sort_values('hour', kind = 'stable').reset_index(drop = True)
+        return self._swaps
+
+    def aggregate(self, groupby = 'day', by = 'pool_name', start_date = None):
+        return aggregate(self.swaps(), groupby, by, start_date)
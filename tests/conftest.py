@@ -0,0 +1,39 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Swap level rows as exported by the raw templates (polygon.core.ez_dex_swaps, swap_final): `hours` hours of swaps from
+# `start`, swaps_per_hour on average, spread over `pools`
+def make_swaps(start, hours, seed, swaps_per_hour = 3, pools = ('GNS-DAI 0.3%', 'GNS-WETH 0.3%'), blockchain = 'Polygon'):
+    rng = np.random.default_rng(seed)
+    n = hours * swaps_per_hour
+    amount_in = rng.lognormal(8, 1, n)
+    block_timestamp = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.uniform(0, hours * 3600, n)), unit = 's')
+    return pd.DataFrame({
+        'tx_hash': [f'{blockchain}-{seed}-{i}' for i in range(n)],
+        'block_timestamp': block_timestamp,
+        'hour': block_timestamp.floor('h'),
+        'blockchain': blockchain,
+        'pool_name': rng.choice(pools, n),
+        'fee': 0.003,
+        'amount_in_usd': amount_in,
+        'amount_out_usd': amount_in * rng.uniform(0.97, 1.0, n)
+    })
+
+@pytest.fixture(name = 'make_swaps')
+def make_swaps_fixture():
+    return make_swaps
+
+# MockFlipside (mock_server.py) answering every query_data query, with empty recordings to fill with synthesize/add_query
+@pytest.fixture
+def mock_flipside():
+    import mock_server
+    client = mock_server.MockFlipside(mock_server.Recordings())
+    mock_server.install(client)
+    yield client
+    mock_server.install(None)
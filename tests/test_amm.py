@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+import onchain_data
+import query_data
+
+# (in_amount, in_price_usd, out_amount, out_price_usd, deposit_limit, token_from, step)
+SCENARIOS = [
+    (4000, 1.0, 1000, 5.0, 200, 'USDC', 20),
+    (4000, 1.0, 1000, 5.0, 300, 'USDC', 7),
+    (4e6, 1.0, 1e6, 5.0, 2e5, 'DAI', 200),
+    (555, 1800.0, 200000, 5.0, 50, 'WETH', 3),
+    (1e3, 1.1, 250, 5.0, 999, 'MATIC', 2000),
+]
+
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_vectorized_matches_loop(scenario):
+    *_, step = scenario
+    loop = query_data.AMM_contract(*scenario)
+    vectorized = query_data.AMM_contract_vectorized(*scenario)
+    assert len(vectorized) == step
+    # The loop adds deposit_limit/step to a running total, so rounding can leave room for one more row past deposit_limit
+    assert len(loop) in (step, step + 1)
+    pd.testing.assert_frame_equal(vectorized, loop.iloc[:step], check_exact = False, rtol = 1e-9)
+
+def test_loop_extra_row():
+    # Limit 300 in 7 steps: the running total ends just under deposit_limit + deposit_limit/step
+    loop = query_data.AMM_contract(4000, 1.0, 1000, 5.0, 300, 'USDC', step = 7)
+    vectorized = query_data.AMM_contract_vectorized(4000, 1.0, 1000, 5.0, 300, 'USDC', step = 7)
+    assert len(loop) == 8 and len(vectorized) == 7
+    pd.testing.assert_frame_equal(vectorized, loop.iloc[:7], check_exact = False, rtol = 1e-9)
+
+def batch_scenario(batch, scenario, token_from):
+    rows = batch[batch['scenario'] == scenario]
+    return query_data.AMM_frame({col: rows[col].to_numpy() for col in rows}, token_from)
+
+def test_batch_matches_each_scenario():
+    in_amount, in_price_usd, out_amount, out_price_usd, deposit_limit = [4000, 4e6, 555], [1.0, 1.0, 1800.0], [1000, 1e6, 200000], 5.0, [200, 2e5, 50]
+    batch = query_data.AMM_batch(in_amount, in_price_usd, out_amount, out_price_usd, deposit_limit, step = 30)
+    assert len(batch) == 3 * 30
+    for scenario in range(3):
+        expected = query_data.AMM_contract_vectorized(in_amount[scenario], in_price_usd[scenario], out_amount[scenario], out_price_usd,
+                                                      deposit_limit[scenario], 'USDC', step = 30)
+        pd.testing.assert_frame_equal(batch_scenario(batch, scenario, 'USDC'), expected, check_dtype = False)
+
+def test_batch_fee_from_pool():
+    pools = ['GNS-ETH 0.3% ARB', 'GNS-DAI 1% ARB', '0x384d2094D0Df788192043a1CBd200308DD60b068']
+    batch = query_data.AMM_batch(4000, 1.0, 1000, 5.0, 200, step = 20, pool = pools)
+    assert list(batch.drop_duplicates('scenario')['pool']) == pools
+    for scenario, pool in enumerate(pools):
+        expected = query_data.AMM_contract_vectorized(4000, 1.0, 1000, 5.0, 200, 'USDC', fee = onchain_data.get_pool_fee(pool))
+        pd.testing.assert_frame_equal(batch_scenario(batch, scenario, 'USDC'), expected, check_dtype = False)
+    with pytest.raises(KeyError):
+        query_data.AMM_batch(4000, 1.0, 1000, 5.0, 200, pool = ['GNS-XYZ 5%'])
+
+def test_fee_sweep_slippage_matches_flipside_definition():
+    in_amount, in_price_usd, out_amount, out_price_usd = 4e6, 1.0, 1e6, 4.2
+    trade_sizes = np.geomspace(1, 1e6, 25)
+    sweep = query_data.AMM_fee_sweep(in_amount, in_price_usd, out_amount, out_price_usd, trade_sizes)
+    assert sorted(sweep['fee'].unique()) == onchain_data.get_fee_tiers()
+    for fee, rows in sweep.groupby('fee'):
+        # Swap through the pool, then avg_slippage of the Flipside queries on the resulting amounts
+        amount_out = out_amount - in_amount * out_amount / (in_amount + trade_sizes * (1 - fee))
+        amount_in_usd, amount_out_usd = trade_sizes * in_price_usd, amount_out * out_price_usd
+        np.testing.assert_allclose(rows['slippage'], (amount_in_usd * (1 - fee) - amount_out_usd) / amount_in_usd, rtol = 1e-9)
+
+def test_curve_single_trade_size():
+    curve = query_data.AMM_curve(4000, 1.0, 1000, 5.0, 50, 'USDC')
+    assert len(curve) == 1
+    pd.testing.assert_frame_equal(curve, query_data.AMM_curve(4000, 1.0, 1000, 5.0, [50], 'USDC'))
+
+@pytest.mark.parametrize('fee', [0.0, 0.003, 0.01])
+def test_price_impact_matches_simulation(fee):
+    trade_sizes = np.geomspace(1, 4000, 40)
+    impact = query_data.price_impact(4000, 1000, trade_sizes, fee = fee)
+    curve = query_data.AMM_curve(4000, 1.0, 1000, 5.0, trade_sizes, 'USDC', fee = fee)
+    np.testing.assert_allclose(impact['amount_out'], 1000 - curve['GNS'], rtol = 1e-9)
+    np.testing.assert_allclose(impact['execution_price'], curve['Price of GNS in USDC'], rtol = 1e-9)
+    # Same points on the AMM_contract_vectorized grid, where the slippage is measured against the first deposit instead
+    grid = query_data.AMM_contract_vectorized(4000, 1.0, 1000, 5.0, 400, 'USDC', step = 40, fee = fee)
+    impact = query_data.price_impact(4000, 1000, grid['token_deposit'], fee = fee)
+    np.testing.assert_allclose(impact['execution_price'], grid['Price of GNS in USDC'], rtol = 1e-9)
+    np.testing.assert_allclose(impact['amount_out'], 1000 - grid['GNS'], rtol = 1e-9)
+
+@pytest.mark.parametrize('fee', [0.0, 0.003, 0.01])
+def test_max_trade_round_trip(fee):
+    slippage_percent = np.array([0.5, 1, 2, 5, 20])
+    max_trade = query_data.max_trade_for_slippage(4000, slippage_percent, fee = fee)
+    impact = query_data.price_impact(4000, 1000, max_trade, fee = fee)
+    np.testing.assert_allclose(impact['slippage_percent'][max_trade > 0], slippage_percent[max_trade > 0], rtol = 1e-9)
+    # The fee alone goes past a slippage lower than itself: no trade fits
+    assert np.all((max_trade == 0) == (slippage_percent / 100 < fee / (1 - fee)))
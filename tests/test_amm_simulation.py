@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pytest
+import query_data
+
+@pytest.mark.parametrize('fee', [0.0, 0.003])
+def test_simulation_matches_fresh_computation(fee):
+    simulation = query_data.AMMSimulation(4000, 1.0, 1000, 5.0, 'USDC', fee = fee)
+    # Grow the limit, then refine the grid, then shrink it: every table comes partly from stored points
+    for deposit_limit, step in [(200, 20), (400, 20), (400, 100), (150, 30), (200, 20)]:
+        expected = query_data.AMM_contract_vectorized(4000, 1.0, 1000, 5.0, deposit_limit, 'USDC', step = step, fee = fee)
+        pd.testing.assert_frame_equal(simulation.table(deposit_limit, step = step), expected)
+
+def test_simulation_bounded_and_thread_safe():
+    simulation = query_data.AMMSimulation(4000, 1.0, 1000, 5.0, 'USDC', max_points = 500)
+    scenarios = [(limit, step) for limit in (100, 200, 300, 400) for step in (20, 50, 100)] * 10
+
+    def check(scenario):
+        limit, step = scenario
+        expected = query_data.AMM_contract_vectorized(4000, 1.0, 1000, 5.0, limit, 'USDC', step = step)
+        pd.testing.assert_frame_equal(simulation.table(limit, step = step), expected)
+        deposits, arrays = simulation.state
+        assert all(len(values) == len(deposits) for values in arrays.values())
+
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        list(executor.map(check, scenarios))
+    assert len(simulation) <= 500
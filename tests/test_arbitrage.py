@@ -0,0 +1,53 @@
+import itertools
+import numpy as np
+import pytest
+import arbitrage
+
+PRICES = {'WETH': 1800.0, 'DAI': 1.0, 'USDC': 1.0}
+RESERVES = {'GNS-ETH 0.3% ARB': (200000, 555.0), 'GNS-ETH 1% ARB': (100000, 277.0), 'GNS-DAI 1% ARB': (150000, 750000.0),
+            'GNS-USDC 1% ARB': (80000, 400000.0), 'GNS-DAI 0.3% POLY': (300000, 1.5e6), 'GNS-USDC 0.238% POLY': (250000, 1.25e6)}
+EXTRA_POOLS = {'GNS-DAI 0.3% POLY': {'token1': 'DAI', 'fee': 0.003}, 'GNS-USDC 0.238% POLY': {'token1': 'USDC', 'fee': 0.00238}}
+
+def test_prices_end_within_fee_bands():
+    sim = arbitrage.ArbitrageSimulator(RESERVES, PRICES, EXTRA_POOLS)
+    result = sim.simulate('GNS-ETH 0.3% ARB', [1e4, 1e5, 1e6])
+    assert result['passes'] >= 2
+    for buy_pool, sell_pool in itertools.permutations(range(len(RESERVES)), 2):
+        amount_in, _ = arbitrage.pair_arbitrage(result['gns'][:, buy_pool], result['usd'][:, buy_pool], sim.fees[buy_pool],
+                                                result['gns'][:, sell_pool], result['usd'][:, sell_pool], sim.fees[sell_pool])
+        assert np.all(amount_in <= 1e-6)
+
+def test_zero_fees_reach_equilibrium_price():
+    extra = {name: {'token1': 'USDC', 'fee': 0.0} for name in RESERVES}
+    sim = arbitrage.ArbitrageSimulator(RESERVES, PRICES, extra)
+    result = sim.simulate('GNS-ETH 0.3% ARB', [1e5, 1e6], tol = 1e-9)
+    # The zero fee equilibrium is reached from the reserves right after the trade, arbitrage only moves GNS around
+    gns, usd = sim.gns.copy(), np.tile(sim.usd, (2, 1))
+    shocked = sim.pool_names.index('GNS-ETH 0.3% ARB')
+    usd[:, shocked] += [1e5, 1e6]
+    expected = arbitrage.equilibrium_price(np.tile(gns, (2, 1)) - np.outer(result['gns_bought'], np.eye(len(gns))[shocked]), usd)
+    np.testing.assert_allclose(result['price'], np.tile(expected[:, None], (1, len(gns))), rtol = 1e-6)
+
+def test_zero_fees_closed_form_matches_passes():
+    trades = [1e4, 1e6]
+    closed = arbitrage.ArbitrageSimulator(RESERVES, PRICES, {name: {'token1': 'USDC', 'fee': 0.0} for name in RESERVES})
+    result = closed.simulate('GNS-DAI 1% ARB', trades)
+    assert result['passes'] == 0
+    np.testing.assert_allclose(result['gns'].sum(axis = 1), closed.gns.sum() - result['gns_bought'])
+    # Same end state as the passes with a negligible fee, which only get there geometrically
+    nearly = arbitrage.ArbitrageSimulator(RESERVES, PRICES, {name: {'token1': 'USDC', 'fee': 1e-12} for name in RESERVES})
+    reference = nearly.simulate('GNS-DAI 1% ARB', trades, tol = 1e-9)
+    assert reference['passes'] > 10
+    for key in ('gns', 'usd', 'price', 'arbitrage_flow_usd', 'arbitrage_profit_usd', 'impact_after_arbitrage'):
+        np.testing.assert_allclose(result[key], reference[key], rtol = 1e-6, atol = 1e-3)
+
+def test_fee_bands_reached_in_few_passes():
+    sim = arbitrage.ArbitrageSimulator(RESERVES, PRICES, EXTRA_POOLS)
+    trades = [1e2, 1e4, 1e6, 1e7]
+    result = sim.simulate('GNS-ETH 0.3% ARB', trades)
+    assert result['passes'] <= 4
+    # A bound of a few passes gives the same result, one pass less than needed raises
+    tight = sim.simulate('GNS-ETH 0.3% ARB', trades, max_passes = result['passes'] + 1)
+    np.testing.assert_array_equal(tight['price'], result['price'])
+    with pytest.raises(RuntimeError, match = 'not converged'):
+        sim.simulate('GNS-ETH 0.3% ARB', trades, max_passes = result['passes'])
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import onchain_data
+import query_data
+
+def test_schema_lookup():
+    for name in ('swap_arb_pools', 'swap_matic_pool', 'swap_matic', 'hourly_token_prices'):
+        assert onchain_data.get_schema(getattr(onchain_data, name)) is onchain_data.templates[name].schema
+    assert onchain_data.get_schema('SELECT 1') is None
+
+def test_decode_typed_columns():
+    records = [
+        {'date': '2023-03-01T00:00:00.000Z', 'pool_name': 'GNS-DAI 0.3%', 'vol': 1500.5, 'slippage': 0.004,
+         'slippage_sum': 0.04, 'swaps': 10, 'slippage_overall': 0.005, 'vol_cumulative': 1500.5},
+        {'date': '2023-03-02T00:00:00.000Z', 'pool_name': None, 'vol': None, 'slippage': None,
+         'slippage_sum': None, 'swaps': None, 'slippage_overall': 0.005, 'vol_cumulative': 1500.5}
+    ]
+    df = query_data.decode_records(records, onchain_data.get_schema(onchain_data.swap_matic_pool), 'pool_name')
+    assert dict(df.dtypes.astype(str)) == {'date': 'datetime64[ns]', 'pool_name': 'category', 'vol': 'float64',
+                                           'slippage': 'float32', 'slippage_sum': 'float64', 'swaps': 'Int64',
+                                           'slippage_overall': 'float32', 'vol_cumulative': 'float64'}
+    assert list(df['date']) == [pd.Timestamp('2023-03-01'), pd.Timestamp('2023-03-02')]
+    assert df['swaps'][0] == 10 and df['swaps'][1] is pd.NA
+    assert df['pool_name'].isna()[1] and np.isnan(df['vol'][1])
+
+def test_decode_integer_column_with_nulls():
+    df = query_data.decode_records([{'n': 3}, {'n': None}], {'n': 'int64'})
+    assert df['n'].dtype == float and np.isnan(df['n'][1])
+    assert query_data.decode_records([{'n': 3}, {'n': 4}], {'n': 'int64'})['n'].dtype == 'int64'
+    # Columns left out of the schema are inferred by pandas
+    assert query_data.decode_records([{'n': 3, 'other': 'a'}], {'n': 'int64'})['other'][0] == 'a'
@@ -0,0 +1,55 @@
+import json
+import plotly.express as px
+import plotly.io as pio
+import figures
+import query_data
+
+def simulation_table():
+    simulation = query_data.AMMSimulation(4000, 1.0, 1000, 5.0, 'USDC')
+    return simulation.table_arrays(200, step = 10), simulation.table(200, step = 10)
+
+# {frame value: {category: bar height}} of a figure dict (one trace, one bar per category) or of a px animated bar chart
+def frame_bars(figure):
+    figure = figure if isinstance(figure, dict) else figure.to_plotly_json()
+    categories = figure['data'][0]['x'] if len(figure['data']) == 1 else None
+    bars = {}
+    for frame in figure['frames']:
+        if categories is not None:
+            bars[float(frame['name'])] = dict(zip(categories, frame['data'][0]['y']))
+        else:
+            bars[float(frame['name'])] = {trace['x'][0]: trace['y'][0] for trace in frame['data']}
+    return bars
+
+def test_bars_match_plotly_express():
+    arrays, df = simulation_table()
+    fig_reserve = figures.simulator_figures(arrays, 'USDC')[0]
+    df_melt = df.melt(id_vars = ['token_deposit'], value_vars = ['USDC', 'GNS'], var_name = 'Token', value_name = 'Reserve')
+    px_reserve = px.bar(df_melt, x = 'Token', y = 'Reserve', color = 'Token', animation_frame = 'token_deposit',
+                        range_y = [0, df[['USDC', 'GNS']].max().max() + 5], height = 500)
+    assert frame_bars(fig_reserve) == frame_bars(px_reserve)
+    assert fig_reserve['data'][0]['marker']['color'] == [trace.marker.color for trace in px_reserve.data]
+    assert fig_reserve['layout']['yaxis']['range'] == list(px_reserve.layout.yaxis.range)
+    assert fig_reserve['layout']['xaxis']['title']['text'] == px_reserve.layout.xaxis.title.text
+    assert fig_reserve['layout']['yaxis']['title']['text'] == px_reserve.layout.yaxis.title.text
+    assert fig_reserve['layout']['height'] == px_reserve.layout.height
+
+def test_lines_match_plotly_express():
+    arrays, df = simulation_table()
+    fig_slippage = figures.simulator_figures(arrays, 'USDC')[2]
+    px_slippage = px.line(df.rename(columns = {'token_deposit': 'USDC Deposit'}), x = 'USDC Deposit', y = 'GNS Slippage percent', height = 450)
+    for key in ('x', 'y'):
+        assert fig_slippage['data'][0][key] == list(px_slippage.data[0][key])
+    assert fig_slippage['data'][0]['line']['color'] == px_slippage.data[0].line.color
+    assert fig_slippage['layout']['xaxis']['title']['text'] == px_slippage.layout.xaxis.title.text
+    assert fig_slippage['layout']['yaxis']['title']['text'] == px_slippage.layout.yaxis.title.text
+
+def test_template_styling_without_the_whole_template():
+    arrays, _ = simulation_table()
+    px_template = pio.templates[pio.templates.default].to_plotly_json()
+    for figure in figures.simulator_figures(arrays, 'USDC'):
+        template = figure['layout']['template']
+        for key, value in template['layout'].items():
+            assert px_template['layout'][key] == value
+        for trace in figure['data']:
+            assert template['data'][trace['type']] == px_template['data'][trace['type']]
+    assert len(json.dumps(figures.TEMPLATE)) < len(json.dumps(px_template)) / 5
@@ -0,0 +1,178 @@
+import time
+import flipside
+import pandas as pd
+import pytest
+import requests
+import mock_server
+import onchain_data
+import query_data
+
+# Prices of token_prices.json, served by the mock when nothing is recorded
+SEED = {'DAI': 1.0, 'WETH': 1800.0, 'GNS': 5.0, 'MATIC': 1.1, 'USDC': 1.0}
+
+@pytest.fixture
+def recordings():
+    recordings = mock_server.Recordings()
+    recordings.synthesize('swap_arb_pools', 'pool_name', 'day', '2023-01-01', periods = 10)
+    return recordings
+
+# MockServer the real Flipside SDK and the CoinGecko functions of onchain_data are pointed to
+@pytest.fixture
+def server(recordings, monkeypatch):
+    with mock_server.MockServer(recordings) as server:
+        monkeypatch.setattr(query_data, 'flipside_url', server.url)
+        monkeypatch.setattr(query_data, 'client_factory', None)
+        monkeypatch.setattr(query_data, '_clients', {})
+        monkeypatch.setattr(onchain_data, 'COINGECKO_URL', f'{server.url}/api/v3')
+        yield server
+
+def arb_sql(start_date = '2023-01-01'):
+    return query_data.Query(onchain_data.swap_arb_pools).format_script('pool_name', 'day', start_date)
+
+def rpc(server, method, **params):
+    response = requests.post(f'{server.url}/json-rpc', json = {'jsonrpc': '2.0', 'method': method, 'params': [params], 'id': 1})
+    response.raise_for_status()
+    return response.json()
+
+#----- RECORD / REPLAY -----#
+
+def test_replay_saved_recordings(recordings, tmp_path):
+    path = str(tmp_path / 'recordings.json')
+    recordings.save(path)
+    loaded = mock_server.Recordings(path)
+    assert loaded.queries == recordings.queries
+    # Found by fingerprint, whatever the comments and whitespace of the SQL
+    entry = loaded.find_query('-- same query\n' + arb_sql().replace('\n', '\n  '))
+    assert entry is not None and len(entry['rows']) == 40
+    assert loaded.find_query(arb_sql('2022-01-01')) is None
+
+def test_record_query(server, recordings, monkeypatch):
+    # Record from the server with the real SDK, page by page, then replay the recording in process
+    sdk = flipside.Flipside
+    monkeypatch.setattr(flipside, 'Flipside', lambda api_key: sdk(api_key, server.url))
+    recorded = mock_server.Recordings()
+    assert recorded.record_query(arb_sql(), page_size = 15) == 40
+    assert recorded.find_query(arb_sql())['rows'] == recordings.find_query(arb_sql())['rows']
+
+    mock_server.install(mock_server.MockFlipside(recorded))
+    try:
+        replayed = query_data.Query(onchain_data.swap_arb_pools).query_data('pool_name', 'day', '2023-01-01').data
+    finally:
+        mock_server.install(None)
+    assert len(replayed) == 40 and replayed['pool_name'].nunique() == 4
+
+def test_record_coingecko(server, monkeypatch):
+    get = requests.get
+    monkeypatch.setattr(onchain_data.re, 'get', lambda url, **kwargs: get(url.replace('https://api.coingecko.com', server.url), **kwargs))
+    recorded = mock_server.Recordings()
+    recorded.record_coingecko('simple/price', {'ids': 'gains-network', 'vs_currencies': 'usd'})
+    assert recorded.coingecko['simple/price'] == {'gains-network': {'usd': 5.0}}
+    # Recorded answers win over the seed prices
+    assert recorded.coingecko_response('simple/price', {'ids': 'dai'}) == {'gains-network': {'usd': 5.0}}
+
+#----- PAGING -----#
+
+def test_paging(recordings):
+    client = mock_server.MockFlipside(recordings)
+    first = client.query(arb_sql(), page_size = 15)
+    assert (first.page.totalPages, first.page.totalRows, first.page.currentPageSize) == (3, 40, 15)
+    pages = [first] + [client.get_query_results(first.query_id, page_number = n, page_size = 15) for n in (2, 3)]
+    assert [len(page.rows) for page in pages] == [15, 15, 10]
+    assert [page.page.currentPageNumber for page in pages] == [1, 2, 3]
+    assert sum((page.rows for page in pages), []) == recordings.find_query(arb_sql())['rows']
+    # Records have the lowercased column names of the Flipside API
+    assert set(first.records[0]) == {col.lower() for col in first.columns}
+    # Past the last page: no rows
+    assert client.get_query_results(first.query_id, page_number = 4, page_size = 15).records is None
+    assert client.stats() == {'calls': 1, 'failures': 0, 'runs': 1}
+
+def test_missing_recording(recordings):
+    with pytest.raises(KeyError, match = 'No recording'):
+        mock_server.MockFlipside(recordings).query(arb_sql('2022-01-01'))
+
+#----- FAULTS -----#
+
+def test_failure_rate(recordings):
+    client = mock_server.MockFlipside(recordings, mock_server.Faults(failure_rate = 0.3, seed = 1))
+    failed = 0
+    for _ in range(200):
+        try:
+            client.query(arb_sql())
+        except RuntimeError:
+            failed += 1
+    assert client.stats() == {'calls': 200, 'failures': failed, 'runs': 200 - failed}
+    assert 40 < failed < 80
+    # Same seed, same failures
+    faults = [mock_server.Faults(failure_rate = 0.3, seed = 1) for _ in range(2)]
+    assert [faults[0]() for _ in range(50)] == [faults[1]() for _ in range(50)]
+    assert not any(mock_server.Faults(seed = 1)() for _ in range(50))
+    assert all(mock_server.Faults(failure_rate = 1.0)() for _ in range(50))
+
+def test_latency():
+    for latency, jitter in ((0.05, 0.0), (0.02, 0.04)):
+        faults = mock_server.Faults(latency = latency, jitter = jitter, seed = 0)
+        for _ in range(3):
+            start = time.perf_counter()
+            faults()
+            assert latency <= time.perf_counter() - start < latency + jitter + 0.05
+
+def test_failed_query_is_none(recordings):
+    mock_server.install(mock_server.MockFlipside(recordings, mock_server.Faults(failure_rate = 1.0)))
+    try:
+        assert query_data.Query(onchain_data.swap_arb_pools).query_data('pool_name', 'day', '2023-01-01') is None
+    finally:
+        mock_server.install(None)
+
+#----- JSON-RPC -----#
+
+def test_rpc_endpoints(server):
+    run = rpc(server, 'createQueryRun', sql = arb_sql(), maxAgeMinutes = 0)['result']
+    run_id = run['queryRun']['id']
+    assert run['queryRun']['rowCount'] == 40 and run['sqlStatement']['sql'] == arb_sql()
+    assert rpc(server, 'getQueryRun', queryRunId = run_id)['result']['queryRun']['state'] == 'QUERY_STATE_SUCCESS'
+    result = rpc(server, 'getQueryRunResults', queryRunId = run_id, page = {'number': 2, 'size': 25})['result']
+    assert len(result['rows']) == 15 and result['page']['totalPages'] == 2
+    assert result['columnNames'] == server.recordings.find_query(arb_sql())['columns']
+
+    assert rpc(server, 'deleteQueryRun', queryRunId = run_id)['error']['code'] == -32601
+    assert rpc(server, 'createQueryRun', sql = arb_sql('2022-01-01'))['error']['code'] == -32000
+    assert requests.post(f'{server.url}/other', json = {}).status_code == 404
+    assert requests.get(f'{server.url}/stats').json() == {'calls': 2, 'failures': 0, 'runs': 1, 'coingecko_calls': 0}
+
+def test_rpc_failure(server):
+    server.faults = mock_server.Faults(failure_rate = 1.0)
+    error = rpc(server, 'createQueryRun', sql = arb_sql())['error']
+    assert error == {'code': -32000, 'message': 'Injected Flipside failure'}
+
+def test_sdk_through_server(server, recordings):
+    # query_data with the real SDK pointed to the server gives the same frame as the in process shim
+    over_http = query_data.Query(onchain_data.swap_arb_pools).query_data('pool_name', 'day', '2023-01-01').data
+    mock_server.install(mock_server.MockFlipside(recordings))
+    try:
+        in_process = query_data.Query(onchain_data.swap_arb_pools).query_data('pool_name', 'day', '2023-01-01').data
+    finally:
+        mock_server.install(None)
+    pd.testing.assert_frame_equal(over_http, in_process)
+
+#----- COINGECKO -----#
+
+def test_coingecko_prices(server):
+    assert onchain_data.get_token_prices() == SEED
+    prices = onchain_data.get_token_prices_multi(('usd', 'eth'))
+    assert prices['usd'] == prices['eth'] == SEED
+
+def test_coingecko_history(server):
+    timestamps = pd.date_range('2023-01-01', periods = 5, freq = 'h')
+    history = onchain_data.get_historical_prices(timestamps)
+    assert list(history.index) == list(timestamps)
+    assert history.iloc[0].to_dict() == SEED and history.notna().all().all()
+    assert requests.get(f'{server.url}/stats').json()['coingecko_calls'] == len(onchain_data.coingecko_ids)
+
+def test_coingecko_errors(server):
+    params = {'vs_currency': 'usd', 'from': 0, 'to': 3600}
+    assert requests.get(f'{server.url}/api/v3/coins/unknown/market_chart/range', params = params).status_code == 404
+    assert requests.get(f'{server.url}/api/v3/exchanges').status_code == 404
+    assert requests.get(f'{server.url}/other').status_code == 404
+    server.faults = mock_server.Faults(failure_rate = 1.0)
+    with pytest.raises(requests.HTTPError):
+        onchain_data.get_token_prices()
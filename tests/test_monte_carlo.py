@@ -0,0 +1,32 @@
+import warnings
+import numpy as np
+import monte_carlo
+
+def test_reserves_stay_on_the_curve():
+    # Default trade sizes (mu = 7) against a small pool: many trades are larger than the pool itself
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        paths = monte_carlo.simulate(4000, 1.0, 1000, n_paths = 1000, n_steps = 100, fee = 0.003, seed = 0)
+    for values in paths.values():
+        assert values.shape == (1000, 100)
+        assert np.isfinite(values).all()
+    assert (paths['reserve_in'] > 0).all() and (paths['reserve_out'] > 0).all()
+    # The fee is taken before the curve (query_data.AMM_arrays), so k = x*y only moves by rounding
+    np.testing.assert_allclose(paths['reserve_in'] * paths['reserve_out'], 4000 * 1000, rtol = 1e-9)
+    # The fee makes every trade worse than the spot price
+    assert (paths['slippage'] > 0).all()
+
+def test_same_seed_same_paths():
+    first = monte_carlo.simulate(4000, 1.0, 1000, n_paths = 50, n_steps = 20, seed = 1)
+    second = monte_carlo.simulate(4000, 1.0, 1000, n_paths = 50, n_steps = 20, seed = 1)
+    for name in first:
+        np.testing.assert_array_equal(first[name], second[name])
+
+def test_percentile_bands_shape():
+    paths = monte_carlo.simulate(4000, 1.0, 1000, n_paths = 200, n_steps = 30, seed = 2)
+    bands = monte_carlo.percentile_bands(paths)
+    assert len(bands) == 30 * len(paths)
+    assert list(bands.columns) == ['step', 'metric', 'p5', 'p25', 'p50', 'p75', 'p95']
+    assert not bands.isna().any().any()
+    values = bands[['p5', 'p25', 'p50', 'p75', 'p95']].to_numpy()
+    assert (np.diff(values, axis = 1) >= 0).all()
@@ -0,0 +1,49 @@
+import os
+import numpy as np
+import pandas as pd
+import price_history
+
+def test_to_hours_mixed_formats():
+    hours = price_history.to_hours(['2023-01-01', '2023-01-01 10:30', '2023-01-01T10:00:00.000Z', '2023-01-01T12:00:00+02:00'])
+    start = pd.Timestamp('2023-01-01').value // 3_600_000_000_000
+    np.testing.assert_array_equal(hours - start, [0, 10, 10, 10])
+    np.testing.assert_array_equal(price_history.to_hours(pd.date_range('2023-01-01', periods = 3, freq = 'h')) - start, [0, 1, 2])
+
+def test_asof(tmp_path):
+    history = price_history.PriceHistory(str(tmp_path))
+    hours = pd.date_range('2023-01-01', periods = 48, freq = 'h')
+    assert history.append('GNS', hours, np.arange(48.0)) == 48
+    # Overlapping append only writes the hours after the last one stored
+    assert history.append('GNS', pd.date_range('2023-01-02 12:00', periods = 24, freq = 'h'), np.arange(100.0, 124.0)) == 12
+    prices = history.asof('GNS', ['2022-12-31', '2023-01-01 05:59', '2023-01-02T13:30:00Z', '2023-01-03 05:00', '2023-01-10'])
+    np.testing.assert_array_equal(prices, [np.nan, 5.0, 37.0, 117.0, np.nan])
+    frame = history.asof_frame(['2023-01-01 05:59', '2023-01-02T13:30:00Z'])
+    assert list(frame.columns) == ['GNS'] and frame.index[1] == pd.Timestamp('2023-01-02 13:30')
+
+def test_interrupted_append(tmp_path):
+    history = price_history.PriceHistory(str(tmp_path))
+    history.append('GNS', pd.date_range('2023-01-01', periods = 10, freq = 'h'), np.arange(10.0))
+    # Append cut between the two files: two more hours, but only one and a half prices
+    hours_file, prices_file = history._files('GNS')
+    with open(hours_file, 'ab') as f:
+        f.write(price_history.to_hours(['2023-01-01 10:00', '2023-01-01 11:00']).tobytes())
+    with open(prices_file, 'ab') as f:
+        f.write(np.array([10.0, 11.0]).tobytes()[:12])
+
+    reopened = price_history.PriceHistory(str(tmp_path))
+    hours, prices = reopened.series('GNS')
+    # Only the hour whose price was written in full is kept
+    assert len(hours) == len(prices) == 11
+    assert reopened.append('GNS', pd.date_range('2023-01-01 09:00', periods = 4, freq = 'h'), [9.0, 10.5, 11.5, 12.5]) == 2
+    np.testing.assert_array_equal(reopened.asof('GNS', pd.date_range('2023-01-01 08:00', periods = 5, freq = 'h')),
+                                  [8.0, 9.0, 10.0, 11.5, 12.5])
+    assert os.path.getsize(hours_file) == os.path.getsize(prices_file) == 13 * 8
+
+def test_rows_appended_by_another_instance(tmp_path):
+    reader = price_history.PriceHistory(str(tmp_path))
+    writer = price_history.PriceHistory(str(tmp_path))
+    writer.append('GNS', pd.date_range('2023-01-01', periods = 5, freq = 'h'), np.arange(5.0))
+    assert reader.asof('GNS', '2023-01-01 06:00')[0] == 4.0
+    writer.append('GNS', pd.date_range('2023-01-01 05:00', periods = 5, freq = 'h'), np.arange(5.0, 10.0))
+    assert reader.asof('GNS', '2023-01-01 06:00')[0] == 6.0
+    assert len(reader.series('GNS')[0]) == 10
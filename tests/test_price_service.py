@@ -0,0 +1,68 @@
+import json
+import threading
+import pytest
+import price_service
+
+PRICES = {'DAI': 1.0, 'WETH': 1700.0, 'GNS': 4.0}
+
+def test_seed_prices_are_flagged(tmp_path):
+    service = price_service.PriceService(snapshot_path = str(tmp_path / 'snapshot.json'), fetch = lambda: dict(PRICES))
+    assert service.is_placeholder() and service.stats()['source'] == 'seed'
+    assert service.refresh()
+    assert not service.is_placeholder() and service.get() == PRICES
+
+    restarted = price_service.PriceService(snapshot_path = str(tmp_path / 'snapshot.json'))
+    assert restarted.stats()['source'] == 'snapshot' and restarted.get() == PRICES
+
+def test_no_snapshot_written_without_path():
+    service = price_service.PriceService(snapshot_path = None, fetch = lambda: dict(PRICES))
+    service._save_snapshot = lambda *args: pytest.fail('snapshot written')
+    assert service.refresh()
+    with open(price_service.SEED_PATH) as f:
+        assert json.load(f)['updated_at'] == 0
+
+def test_importing_the_app_starts_nothing():
+    import app
+    assert app.prices._thread is None
+
+def refreshers():
+    return [thread for thread in threading.enumerate() if thread.name == 'price-service']
+
+def run_together(target, count = 16):
+    barrier = threading.Barrier(count)
+
+    def call():
+        barrier.wait()
+        target()
+    threads = [threading.Thread(target = call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+@pytest.mark.parametrize('call', ['start', 'get'])
+def test_one_refresher_for_concurrent_calls(tmp_path, call):
+    release, calls = threading.Event(), []
+
+    def fetch():
+        calls.append(1)
+        release.wait()
+        return dict(PRICES)
+    service = price_service.PriceService(snapshot_path = str(tmp_path / 'snapshot.json'), fetch = fetch)
+    # Seed prices are stale: get() starts the refresher and serves them meanwhile
+    run_together(getattr(service, call))
+    try:
+        assert len(refreshers()) == 1 and service.stats()['refresher_running']
+        assert service.get()['WETH'] == 1800.0
+    finally:
+        release.set()
+        service.stop()
+    assert len(calls) == 1 and not refreshers()
+    assert service.get() == PRICES and not refreshers()
+
+def test_failed_refresh_counted(tmp_path):
+    def fetch():
+        raise RuntimeError('rate limited')
+    service = price_service.PriceService(snapshot_path = str(tmp_path / 'snapshot.json'), fetch = fetch)
+    assert not any(service.refresh() for _ in range(3))
+    assert service.stats()['errors'] == 3 and service.is_placeholder()
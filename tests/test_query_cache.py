@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+import onchain_data
+import query_cache
+import query_data
+
+# pandas version of onchain_data.swap_matic_pool (category pool_name, groupby day) run on `swaps`
+def swap_matic_pool(swaps, start_date):
+    swaps = swaps[swaps['block_timestamp'].dt.normalize() >= pd.Timestamp(start_date)]
+    slippage = (swaps['amount_in_usd'] * (1 - swaps['fee']) - swaps['amount_out_usd']) / swaps['amount_in_usd'].replace(0, np.nan)
+    swaps = swaps.assign(date = swaps['block_timestamp'].dt.floor('D'), slip = slippage, slip_fee = slippage * (1 - swaps['fee']))
+    df = swaps.groupby(['date', 'pool_name']).agg(vol = ('amount_in_usd', 'sum'), slippage = ('slip_fee', 'mean'),
+                                                   slippage_sum = ('slip', 'sum'), swaps = ('slip', 'count')).reset_index()
+    df = df.sort_values(['date', 'vol'], ascending = [True, False], kind = 'stable').reset_index(drop = True)
+    df['slippage_overall'] = slippage.mean()
+    df['vol_cumulative'] = df.groupby('pool_name')['vol'].cumsum()
+    records = df.assign(date = df['date'].dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')).to_dict('records')
+    return query_data.decode_records(records, onchain_data.get_schema(onchain_data.swap_matic_pool), 'pool_name')
+
+@pytest.fixture
+def flipside(monkeypatch):
+    """Fake Flipside answering swap_matic_pool from the swaps in `state`"""
+    state = {'swaps': None, 'calls': []}
+
+    class FakeQuery(query_data.Query):
+        def query_data(self, category = None, groupby = 'day', start_date = None):
+            state['calls'].append(start_date)
+            self.data = swap_matic_pool(state['swaps'], start_date)
+            return self
+
+    monkeypatch.setattr(query_data, 'Query', FakeQuery)
+    return state
+
+def uncached(state, start_date):
+    return query_cache.parse_dates(swap_matic_pool(state['swaps'], start_date))
+
+def assert_same(cached, expected):
+    pd.testing.assert_frame_equal(cached.astype({'pool_name': str}), expected.astype({'pool_name': str}), check_exact = False)
+
+# Polygon swaps of three pools over `days` days, some with amount_in_usd = 0 that NULLIF leaves out of the slippage averages
+def polygon_swaps(make_swaps, start, days, seed):
+    swaps = make_swaps(start, days * 24, seed, pools = ('GNS-DAI 0.3%', 'GNS-WETH 0.3%', 'GNS-USDC 1%'))
+    swaps.loc[::17, ['amount_in_usd', 'amount_out_usd']] = 0
+    return swaps
+
+def test_incremental_refresh_matches_uncached(flipside, tmp_path, make_swaps):
+    cache = query_cache.QueryCache(str(tmp_path))
+    swaps = polygon_swaps(make_swaps, '2023-01-01', 20, seed = 0)
+
+    # First pull in the middle of day 10, then the rest of the swaps arrive
+    flipside['swaps'] = swaps[swaps['block_timestamp'] < '2023-01-10 12:00']
+    assert_same(cache.query_data(onchain_data.swap_matic_pool, 'pool_name', 'day', '2023-01-01'), uncached(flipside, '2023-01-01'))
+
+    flipside['swaps'] = swaps
+    result = cache.query_data(onchain_data.swap_matic_pool, 'pool_name', 'day', '2023-01-01')
+    assert flipside['calls'] == ['2023-01-01', '2023-01-10']
+    expected = uncached(flipside, '2023-01-01')
+    assert_same(result, expected)
+    # The overall slippage covers the whole window, not only the refetched days
+    fresh_only = uncached(flipside, '2023-01-10')['slippage_overall'].iloc[0]
+    assert result['slippage_overall'].iloc[0] != pytest.approx(fresh_only)
+
+def test_later_start_date_served_from_cache(flipside, tmp_path, make_swaps):
+    cache = query_cache.QueryCache(str(tmp_path))
+    flipside['swaps'] = polygon_swaps(make_swaps, '2023-01-01', 20, seed = 1)
+    cache.query_data(onchain_data.swap_matic_pool, 'pool_name', 'day', '2023-01-01')
+    result = cache.query_data(onchain_data.swap_matic_pool, 'pool_name', 'day', '2023-01-08')
+    assert_same(result, uncached(flipside, '2023-01-08'))
+
+def test_start_date_required(flipside, tmp_path):
+    cache = query_cache.QueryCache(str(tmp_path))
+    with pytest.raises(ValueError):
+        cache.query_data(onchain_data.swap_matic_pool, 'pool_name', 'day')
+    assert flipside['calls'] == []
+
+def test_interrupted_save_keeps_the_cache(flipside, tmp_path, monkeypatch, make_swaps):
+    cache = query_cache.QueryCache(str(tmp_path))
+    flipside['swaps'] = polygon_swaps(make_swaps, '2023-01-01', 20, seed = 2)
+    expected = cache.query_data(onchain_data.swap_matic_pool, 'pool_name', 'day', '2023-01-01')
+
+    def crash(df, path, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b'PAR1 truncated')
+        raise KeyboardInterrupt
+    with monkeypatch.context() as patch, pytest.raises(KeyboardInterrupt):
+        patch.setattr(pd.DataFrame, 'to_parquet', crash)
+        cache.query_data(onchain_data.swap_matic_pool, 'pool_name', 'day', '2023-01-01')
+    pd.testing.assert_frame_equal(cache.load(onchain_data.swap_matic_pool, 'pool_name', 'day'), expected)
@@ -0,0 +1,144 @@
+import threading
+import time
+import pandas as pd
+import mock_server
+import onchain_data
+import query_data
+
+class CountingFaults(mock_server.Faults):
+    """No failure, but every call waits a bit and the largest number of calls in flight is kept"""
+    def __init__(self, latency):
+        super().__init__(latency)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __call__(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        return False
+
+def arb_queries(recordings, categories, start_date = '2023-01-01'):
+    queries = {}
+    for category in categories:
+        recordings.synthesize('swap_arb_pools', category, 'day', start_date, periods = 10)
+        queries[category] = (onchain_data.swap_arb_pools, category, 'day', start_date)
+    return queries
+
+def test_query_many_runs_concurrently(mock_flipside):
+    queries = arb_queries(mock_flipside.recordings, onchain_data.ARB_CATEGORIES[:6])
+    mock_flipside.faults = CountingFaults(0.05)
+    frames = query_data.query_many(queries, max_concurrency = 3)
+    assert mock_flipside.faults.max_in_flight == 3
+    for category, (script, *params) in queries.items():
+        expected = query_data.Query(script).query_data(*params).data
+        pd.testing.assert_frame_equal(frames[category], expected)
+
+def test_query_many_dedupes_identical_sql(mock_flipside):
+    queries = arb_queries(mock_flipside.recordings, ['pool_name', 'platform'])
+    # Same SQL as pool_name, only the comments and whitespace differ
+    queries['same'] = ('-- same query\n' + onchain_data.swap_arb_pools.replace('\n', '\n  '), 'pool_name', 'day', '2023-01-01')
+    frames = query_data.query_many(queries)
+    assert mock_flipside.stats()['calls'] == 2
+    assert frames['same'] is frames['pool_name'] and len(frames['same']) > 0
+    assert 'platform' in frames['platform']
+
+def test_query_many_failed_query(mock_flipside):
+    queries = arb_queries(mock_flipside.recordings, ['pool_name'])
+    # Nothing recorded for this start date, so the mock fails the query
+    queries['missing'] = (onchain_data.swap_arb_pools, 'pool_name', 'day', '2022-01-01')
+    frames = query_data.query_many(queries)
+    assert frames['missing'] is None
+    assert len(frames['pool_name']) == 10 * 4
+
+def test_get_client_shared_across_threads(monkeypatch):
+    created = []
+    monkeypatch.setattr(query_data, '_clients', {})
+    monkeypatch.setattr(query_data, 'client_factory', lambda api_key: created.append(api_key) or object())
+    barrier = threading.Barrier(16)
+    clients = []
+
+    def get():
+        barrier.wait()
+        clients.append(query_data.get_client('key'))
+    threads = [threading.Thread(target = get) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert created == ['key'] and len(clients) == 16 and all(client is clients[0] for client in clients)
+    assert query_data.get_client('other') is not clients[0] and created == ['key', 'other']
+
+def count_pages(monkeypatch, client):
+    pages = []
+    get_query_results = client.get_query_results
+
+    def counted(query_run_id, page_number = 1, page_size = 100000, **kwargs):
+        pages.append(page_number)
+        return get_query_results(query_run_id, page_number = page_number, page_size = page_size, **kwargs)
+    monkeypatch.setattr(client, 'get_query_results', counted)
+    return pages
+
+def test_stream_data_pages(mock_flipside, monkeypatch):
+    arb_queries(mock_flipside.recordings, ['pool_name'])
+    query = query_data.Query(onchain_data.swap_arb_pools)
+    expected = query.query_data('pool_name', 'day', '2023-01-01').data
+    pages = count_pages(monkeypatch, mock_flipside)
+    chunks = list(query.stream_data('pool_name', 'day', '2023-01-01', page_size = 7))
+    # 40 rows in pages of 7: the first page comes with query(), the prefetch stops at the last one
+    assert [len(chunk) for chunk in chunks] == [7] * 5 + [5]
+    assert pages == [1, 2, 3, 4, 5, 6]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index = True), expected)
+
+def test_stream_data_single_page(mock_flipside, monkeypatch):
+    arb_queries(mock_flipside.recordings, ['pool_name'])
+    pages = count_pages(monkeypatch, mock_flipside)
+    chunks = list(query_data.Query(onchain_data.swap_arb_pools).stream_data('pool_name', 'day', '2023-01-01'))
+    assert len(chunks) == 1 and len(chunks[0]) == 40 and pages == [1]
+
+def test_stream_to_parquet(mock_flipside, tmp_path):
+    arb_queries(mock_flipside.recordings, ['pool_name'], '2023-01-01')
+    arb_queries(mock_flipside.recordings, ['pool_name'], '2023-03-01')
+    query = query_data.Query(onchain_data.swap_arb_pools)
+    path = tmp_path / 'arb'
+    assert query.stream_to_parquet(path, 'pool_name', 'day', '2023-01-01', page_size = 7) == 40
+    assert len(list(path.iterdir())) == 6
+    expected = query.query_data('pool_name', 'day', '2023-01-01').data
+    pd.testing.assert_frame_equal(pd.read_parquet(path), expected)
+
+    # A shorter pull into the same folder leaves none of the earlier parts behind
+    assert query.stream_to_parquet(path, 'pool_name', 'day', '2023-03-01', page_size = 20) == 40
+    assert sorted(part.name for part in path.iterdir()) == ['part-00001.parquet', 'part-00002.parquet']
+    expected = query.query_data('pool_name', 'day', '2023-03-01').data
+    pd.testing.assert_frame_equal(pd.read_parquet(path), expected)
+    assert [item.name for item in tmp_path.iterdir()] == ['arb']
+
+def test_query_granularities(mock_flipside):
+    periods = ['day', 'week', 'month']
+    rows = mock_flipside.recordings.synthesize('swap_arb_pools_multi', 'pool_name', periods, '2023-01-01', periods = 6)
+    frames = query_data.query_granularities('swap_arb_pools_multi', 'pool_name', periods, '2023-01-01')
+    assert mock_flipside.stats()['calls'] == 1
+    assert list(frames) == periods
+    # Same columns as the single period query, 6 dates for each of the 4 pools
+    columns = [col.format(category = 'pool_name') for col in onchain_data.templates['swap_arb_pools'].schema]
+    pools = sorted(info['pool_name'] for info in onchain_data.pools.values() if info['pool_name'])
+    assert sum(len(frame) for frame in frames.values()) == rows
+    for period, frame in frames.items():
+        assert list(frame.columns) == columns
+        assert len(frame) == 6 * len(pools) and frame['date'].nunique() == 6
+        assert sorted(frame['pool_name'].unique()) == pools
+    assert frames['week']['date'].diff().max() == pd.Timedelta(days = 7)
+
+def test_split_granularities():
+    df = pd.DataFrame({'granularity': pd.Categorical(['week', 'day', 'week', 'day', 'day'], categories = ['day', 'week', 'month']),
+                       'date': pd.to_datetime(['2023-01-02', '2023-01-01', '2023-01-09', '2023-01-02', '2023-01-03']),
+                       'vol': [1.0, 2.0, 3.0, 4.0, 5.0]})
+    frames = query_data.split_granularities(df)
+    # Periods without rows are left out, the order of the result is kept
+    assert list(frames) == ['week', 'day']
+    pd.testing.assert_frame_equal(frames['day'], pd.DataFrame({'date': pd.to_datetime(['2023-01-01', '2023-01-02', '2023-01-03']),
+                                                               'vol': [2.0, 4.0, 5.0]}))
+    assert frames['week']['vol'].tolist() == [1.0, 3.0]
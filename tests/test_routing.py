@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import routing
+
+# GNS at 5 USD, WETH at 1800 USD
+RESERVES = {'GNS-ETH 0.3% ARB': (200000, 555.0), 'GNS-ETH 1% ARB': (100000, 277.0), 'GNS-USDC 1% ARB': (80000, 400000.0),
+            'WETH-USDC': (2000.0, 3.6e6)}
+EXTRA_POOLS = {'WETH-USDC': {'token0': 'WETH', 'token1': 'USDC', 'fee': 0.0005}}
+
+def test_split_across_fee_tiers_beats_single_route():
+    router = routing.Router({name: RESERVES[name] for name in ('GNS-ETH 0.3% ARB', 'GNS-ETH 1% ARB')})
+    result = router.optimal_route('WETH', 'GNS', 50.0)
+    assert [route[0][0] for route in result['routes']] == ['GNS-ETH 0.3% ARB', 'GNS-ETH 1% ARB']
+    assert result['best_single_route'] == [('GNS-ETH 0.3% ARB', 'WETH', 'GNS')]
+    assert np.all(result['weights'] > 0)
+    assert result['amount_out'] > result['best_single_amount_out']
+    # The split is the best point of the grid, every single route is one of its points
+    for route in result['routes']:
+        assert result['amount_out'] >= router.quote(route, 50.0)
+
+def test_multi_hop_route():
+    router = routing.Router(RESERVES, EXTRA_POOLS)
+    routes = router.routes('USDC', 'GNS')
+    hop = [('WETH-USDC', 'USDC', 'WETH'), ('GNS-ETH 0.3% ARB', 'WETH', 'GNS')]
+    assert [('GNS-USDC 1% ARB', 'USDC', 'GNS')] in routes and hop in routes
+    assert all(len(route) <= 2 for route in routes)
+    weth = routing.swap_out(3.6e6, 2000.0, 1e5, 0.0005)
+    np.testing.assert_allclose(router.quote(hop, 1e5), routing.swap_out(555.0, 200000, weth, 0.003))
+    # Through WETH the deeper 0.3% pool gives more GNS than the direct 1% USDC pool
+    result = router.optimal_route('USDC', 'GNS', 1e5)
+    assert result['best_single_route'][-1][0] == 'GNS-ETH 0.3% ARB'
+    assert len(routing.Router(RESERVES, EXTRA_POOLS, max_hops = 1).routes('USDC', 'GNS')) == 1
+
+def test_polygon_pools_by_address():
+    address = '0x6E53cB6942e518376E9e763554dB1A45DDCd25c4'
+    with pytest.raises(ValueError):
+        routing.Router({address: (300000, 1.5e6)})
+    router = routing.Router({address: (300000, 1.5e6)}, {address: {'token1': 'DAI'}})
+    assert router.pools[address]['fee'] == 0.003
+    np.testing.assert_allclose(router.quote(router.routes('DAI', 'GNS')[0], 1e4), routing.swap_out(1.5e6, 300000, 1e4, 0.003))
@@ -0,0 +1,62 @@
+import simulation_cache
+
+def test_pool_keys_simulations_by_pool_state():
+    pool = simulation_cache.SimulationPool(maxsize = 2)
+    usdc = pool.get(4000, 1.0, 1000, 5.0, 'USDC')
+    assert pool.get(4000, 1.0, 1000, 5.0, 'USDC') is usdc
+    dai = pool.get(4000, 1.0, 1000, 5.0, 'DAI')
+    assert dai is not usdc and dai.matches(4000, 1.0, 1000, 5.0, 'DAI')
+    pool.get(8000, 1.0, 1000, 5.0, 'USDC')
+    assert len(pool) == 2
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_cache_counts_hits_and_misses():
+    cache = simulation_cache.SimulationCache()
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+    assert cache.get_or_compute('a', compute) == 1
+    assert cache.get_or_compute('a', compute) == 1
+    assert cache.get_or_compute('b', compute) == 2
+    assert cache.get_or_compute('a', compute) == 1
+    assert len(calls) == 2
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'hit_rate': 0.5, 'size': 2, 'maxsize': 256, 'ttl': 600}
+    cache.clear()
+    assert cache.stats()['hits'] == cache.stats()['size'] == 0
+
+def test_cache_ttl():
+    clock = Clock()
+    cache = simulation_cache.SimulationCache(ttl = 10, timer = clock)
+    cache.get_or_compute('a', lambda: 1)
+    clock.now = 9.9
+    assert cache.get_or_compute('a', lambda: 2) == 1
+    clock.now = 10.0
+    assert cache.get_or_compute('a', lambda: 2) == 2
+    assert cache.stats()['misses'] == 2
+
+def test_cache_maxsize():
+    cache = simulation_cache.SimulationCache(maxsize = 2)
+    cache.get_or_compute('a', lambda: 1)
+    cache.get_or_compute('b', lambda: 2)
+    cache.get_or_compute('a', lambda: 1)
+    # 'b' is the least recently used entry and is evicted by 'c'
+    cache.get_or_compute('c', lambda: 3)
+    assert cache.stats()['size'] == 2
+    assert cache.get_or_compute('a', lambda: 0) == 1
+    assert cache.get_or_compute('b', lambda: 0) == 0
+
+def test_cache_key_rounds_prices():
+    cache = simulation_cache.SimulationCache()
+    key = cache.key('USDC', 1000, 4000, 100, 1.000049, 5.123449)
+    # Prices agreeing to 4 significant digits share an entry, the other inputs are not rounded
+    assert cache.key('USDC', 1000.0, 4000.0, 100.0, 0.99996, 5.12251) == key
+    assert cache.key('USDC', 1000, 4000, 100, 1.00051, 5.123449) != key
+    assert cache.key('USDC', 1000, 4000, 100, 1.000049, 5.1236) != key
+    assert cache.key('USDC', 1000, 4000, 100.0001, 1.000049, 5.123449) != key
+    assert cache.key('DAI', 1000, 4000, 100, 1.000049, 5.123449) != key
+    assert simulation_cache.round_price(1234567.0) == 1235000.0 and simulation_cache.round_price(0.000123456) == 0.0001235
@@ -0,0 +1,35 @@
+import numpy as np
+import slippage_metrics
+import swap_store
+
+def test_overall_matches_swaps(make_swaps):
+    swaps = make_swaps('2023-03-01', 72, seed = 0, swaps_per_hour = 70)
+    metrics = slippage_metrics.SlippageMetrics()
+    for chunk in np.array_split(np.arange(len(swaps)), 4):
+        metrics.update(swaps.iloc[chunk])
+    overall = metrics.overall().set_index('pool_name')
+    slippage = swap_store.swap_slippage(swaps)
+    for pool, rows in swaps.groupby('pool_name'):
+        weights = rows['amount_in_usd']
+        assert overall.loc[pool, 'swaps'] == len(rows)
+        np.testing.assert_allclose(overall.loc[pool, 'vw_slippage'], (slippage[rows.index] * weights).sum() / weights.sum())
+        np.testing.assert_allclose(overall.loc[pool, 'p50'], slippage[rows.index].median(), rtol = 0.03)
+
+def test_swaps_without_group(make_swaps):
+    swaps = make_swaps('2023-03-01', 25, seed = 1, swaps_per_hour = 4).astype({'pool_name': object})
+    swaps.loc[:9, 'pool_name'] = None
+    swaps.loc[10:19, 'pool_name'] = np.nan
+    metrics = slippage_metrics.SlippageMetrics()
+    metrics.update(swaps).update(swaps.iloc[:5])
+    overall = metrics.overall().set_index('pool_name')
+    assert overall.loc[swap_store.MISSING_GROUP, 'swaps'] == 25
+    assert overall['swaps'].sum() == 105
+    assert swap_store.MISSING_GROUP in set(metrics.by_size()['pool_name'])
+
+def test_missing_group_with_float_groups(make_swaps):
+    swaps = make_swaps('2023-03-01', 24, seed = 2)
+    swaps['fee'] = np.where(np.arange(len(swaps)) % 2, 0.003, 0.01)
+    swaps.loc[:4, 'fee'] = np.nan
+    metrics = slippage_metrics.SlippageMetrics(by = 'fee').update(swaps)
+    for df in (metrics.overall(), metrics.by_bucket(), metrics.by_size()):
+        assert list(df['fee'].drop_duplicates()) == [0.003, 0.01, swap_store.MISSING_GROUP]
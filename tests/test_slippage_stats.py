@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+import slippage_stats
+import swap_store
+
+def expected_overall(swaps, by):
+    slippage = swap_store.swap_slippage(swaps)
+    return slippage.groupby(swaps[by]).mean()
+
+def test_chains_pulled_separately(tmp_path, make_swaps):
+    arbitrum = make_swaps('2023-03-01 00:00', 13, seed = 0, pools = ['GNS-ETH 0.3% ARB'], blockchain = 'Arbitrum')
+    polygon = make_swaps('2023-03-01 10:00', 6, seed = 1, pools = ['GNS-DAI 0.3%'])
+    for by in ('pool_name', 'blockchain'):
+        stats = slippage_stats.SlippageStats(str(tmp_path / by), by = by)
+        assert stats.update(arbitrum) == len(arbitrum)
+        # Polygon swaps older than the last Arbitrum hour are still new for their own group
+        assert stats.update(polygon) == len(polygon)
+        swaps = pd.concat([arbitrum, polygon])
+        # Overlapping pulls add nothing, also after a reload
+        assert slippage_stats.SlippageStats(str(tmp_path / by)).update(swaps) == 0
+        overall = stats.overall().set_index(by)
+        np.testing.assert_allclose(overall['avg_slippage'], expected_overall(swaps, by).loc[overall.index])
+        assert overall['slippage_count'].sum() == len(swaps)
+
+def test_overlapping_pull_of_the_same_hour(make_swaps):
+    stats = slippage_stats.SlippageStats()
+    swaps = make_swaps('2023-03-01 00:00', 5, seed = 2, pools = ['GNS-ETH 0.3% ARB'], blockchain = 'Arbitrum')
+    assert stats.update(swaps.iloc[:-1]) == len(swaps) - 1
+    assert stats.update(swaps) == 1
+    assert stats.overall()['slippage_count'].sum() == len(swaps)
+
+def test_swaps_without_group(make_swaps):
+    swaps = make_swaps('2023-03-01 00:00', 10, seed = 3).astype({'pool_name': object})
+    swaps.loc[:5, 'pool_name'] = None
+    stats = slippage_stats.SlippageStats()
+    assert stats.update(swaps) == len(swaps)
+    assert stats.update(swaps) == 0
+    overall = stats.overall().set_index('pool_name')
+    assert overall.loc[swap_store.MISSING_GROUP, 'slippage_count'] == 6
+    assert overall['slippage_count'].sum() == len(swaps)
+
+def test_interrupted_save(tmp_path, make_swaps, monkeypatch):
+    swaps = make_swaps('2023-03-01 00:00', 12, seed = 4)
+    first, second = swaps.iloc[:20], swaps.iloc[15:]
+    stats = slippage_stats.SlippageStats(str(tmp_path))
+    stats.update(first)
+
+    def crash(table, where, **kwargs):
+        with open(where, 'wb') as f:
+            f.write(b'PAR1 truncated')
+        raise KeyboardInterrupt
+    with monkeypatch.context() as patch, pytest.raises(KeyboardInterrupt):
+        patch.setattr(slippage_stats.pq, 'write_table', crash)
+        stats.update(second)
+
+    # The saved sums and watermark are still those of the first pull, so the second one is counted once
+    reloaded = slippage_stats.SlippageStats(str(tmp_path))
+    assert reloaded.overall()['slippage_count'].sum() == len(first)
+    assert reloaded.update(second) == len(swaps) - len(first)
+    assert slippage_stats.SlippageStats(str(tmp_path)).overall()['slippage_count'].sum() == len(swaps)
@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import onchain_data
+import swap_store
+
+RAW_COLUMNS = list(onchain_data.schemas['swap_raw'])
+
+def raw_swaps(make_swaps, start, hours, seed):
+    swaps = make_swaps(start, hours, seed, pools = ('GNS-DAI 0.3%', 'GNS-WETH 0.3%', 'GNS-USDC 1%'))
+    return swaps.assign(platform = 'uniswap-v3', token_in = 'DAI', token_out = 'GNS')[RAW_COLUMNS]
+
+# What swap_arb_pools computes in Snowflake: GROUP BY keeps the NULL group, AVG skips NULL slippages
+def sql_aggregate(swaps, groupby, by):
+    amount_in = swaps['amount_in_usd'].where(swaps['amount_in_usd'] != 0)
+    df = swaps.assign(date = swap_store.date_trunc(swaps['hour'], groupby),
+                      slippage = (amount_in * (1 - swaps['fee']) - swaps['amount_out_usd']) / amount_in)
+    result = (df.astype({by: object}).groupby(['date', by], dropna = False)
+                .agg(vol = ('amount_in_usd', 'sum'), sum_amount_out_usd = ('amount_out_usd', 'sum'), avg_slippage = ('slippage', 'mean'))
+                .reset_index())
+    result[by] = result[by].where(result[by].notna(), swap_store.MISSING_GROUP)
+    return result
+
+def test_aggregate_keeps_swaps_without_group(make_swaps):
+    swaps = raw_swaps(make_swaps, '2023-03-01', 24 * 10, seed = 0).astype({'pool_name': object})
+    swaps.loc[::30, 'pool_name'] = None
+    swaps.loc[::41, ['amount_in_usd', 'amount_out_usd']] = 0
+    result = swap_store.aggregate(swaps, 'day', 'pool_name')
+    np.testing.assert_allclose(result['vol'].sum(), swaps['amount_in_usd'].sum())
+    assert swap_store.MISSING_GROUP in set(result['pool_name'])
+
+    keys = ['date', 'pool_name']
+    expected = sql_aggregate(swaps, 'day', 'pool_name').sort_values(keys).reset_index(drop = True)
+    got = result.sort_values(keys).reset_index(drop = True)
+    pd.testing.assert_frame_equal(got[expected.columns], expected, check_dtype = False)
+    np.testing.assert_allclose(result['slippage_overall'], swap_store.swap_slippage(swaps).mean())
+    # vol_cumulative runs per pool, up to the total volume of each pool
+    last = result.groupby('pool_name')['vol_cumulative'].last()
+    np.testing.assert_allclose(last, result.groupby('pool_name')['vol'].sum().loc[last.index])
+
+def test_aggregate_total_and_start_date(make_swaps):
+    swaps = raw_swaps(make_swaps, '2023-03-01', 24 * 10, seed = 1)
+    result = swap_store.aggregate(swaps, 'week', None, start_date = '2023-03-06')
+    assert list(result['date']) == [pd.Timestamp('2023-03-06')]
+    np.testing.assert_allclose(result['vol'], swaps.loc[swaps['hour'] >= '2023-03-06', 'amount_in_usd'].sum())
+
+def test_date_trunc():
+    hours = pd.Series(pd.to_datetime(['2023-03-01 13:00', '2023-03-05 23:00', '2023-03-06 00:00', '2023-02-28 05:00', '2023-12-31 23:00']))
+    np.testing.assert_array_equal(swap_store.date_trunc(hours, 'week'),
+                                  pd.to_datetime(['2023-02-27', '2023-02-27', '2023-03-06', '2023-02-27', '2023-12-25']))
+    np.testing.assert_array_equal(swap_store.date_trunc(hours, 'month'),
+                                  pd.to_datetime(['2023-03-01', '2023-03-01', '2023-03-01', '2023-02-01', '2023-12-01']))
+    np.testing.assert_array_equal(swap_store.date_trunc(hours, 'day'), hours.dt.normalize())
+    with pytest.raises(ValueError):
+        swap_store.date_trunc(hours, 'year')
+
+def test_swaps_read_once_without_duplicates(make_swaps, tmp_path):
+    swaps = raw_swaps(make_swaps, '2023-03-01', 48, seed = 2)
+    # Two overlapping pulls of Polygon, and Arbitrum pulled once
+    for folder, rows in (('polygon/2023-03-01', swaps.iloc[:100]), ('polygon/2023-03-02', swaps.iloc[60:]),
+                         ('arbitrum/2023-03-01', swaps.iloc[:30].assign(blockchain = 'Arbitrum'))):
+        os.makedirs(tmp_path / folder)
+        rows.to_parquet(tmp_path / folder / 'part-00001.parquet', index = False)
+    store = swap_store.SwapStore(str(tmp_path))
+    stored = store.swaps()
+    assert len(stored) == len(swaps) + 30
+    assert stored['hour'].is_monotonic_increasing
+    assert (stored['blockchain'] == 'Arbitrum').sum() == 30
+    assert store.swaps() is stored
@@ -0,0 +1,43 @@
+import pytest
+import onchain_data
+
+def test_validate():
+    template = onchain_data.templates['swap_arb_pools']
+    template.validate('pool_name', 'day', '2023-01-01')
+    for category, groupby, start_date in [('price', 'day', '2023-01-01'), ('pool_name', 'year', '2023-01-01'),
+                                          ('pool_name', 'day', '2023-13-01'), ('pool_name', 'day', "2023-01-01') OR (1=1"),
+                                          ('pool_name', 'day', None)]:
+        with pytest.raises(ValueError):
+            template.validate(category, groupby, start_date)
+    multi = onchain_data.templates['swap_arb_pools_multi']
+    multi.validate('pool_name', ['day', 'month'], '2023-01-01')
+    for groupby in ('day', [], ['day', 'day'], ['day', 'year']):
+        with pytest.raises(ValueError):
+            multi.validate('pool_name', groupby, '2023-01-01')
+
+def test_render():
+    sql = onchain_data.render('swap_matic_pool', 'platform', 'week', '2023-02-01')
+    assert "DATE_TRUNC('week', block_timestamp)" in sql and "DATE('2023-02-01')" in sql and 'PARTITION BY platform' in sql
+    assert '{' not in sql
+    # The positional form used by query_data.Query gives the same query once filled
+    assert onchain_data.swap_matic_pool.format('platform', 'week', '2023-02-01') == sql
+    # Every pool of the pools table is in the filters
+    for address in onchain_data.pools:
+        assert f"LOWER('{address}')" in onchain_data.render('swap_arb_pools', 'pool_name', 'day', '2023-01-01') + sql
+    multi = onchain_data.render('swap_arb_pools_multi', 'pool_name', ['day', 'week'], '2023-01-01')
+    assert multi.count('UNION ALL') == 1 and "'week' AS granularity" in multi
+    with pytest.raises(ValueError):
+        onchain_data.templates['swap_arb_pools_multi'].positional()
+
+def test_fingerprint():
+    fingerprint = onchain_data.fingerprint
+    assert fingerprint("SELECT a,\n  b -- comment\nFROM t WHERE x = 'GNS'") == fingerprint("select a, b FROM   t where x = 'GNS' -- other")
+    # Quoted parts are kept as they are: case, whitespace and -- inside them count
+    assert fingerprint("SELECT 1 WHERE x = 'GNS'") != fingerprint("SELECT 1 WHERE x = 'gns'")
+    assert fingerprint("SELECT 1 WHERE x = 'a  b'") != fingerprint("SELECT 1 WHERE x = 'a b'")
+    assert fingerprint("SELECT 1 WHERE x = 'a -- b'") != fingerprint("SELECT 1 WHERE x = 'a -- c'")
+    assert fingerprint("SELECT 1 WHERE x = 'it''s -- b'") != fingerprint("SELECT 1 WHERE x = 'it''s -- c'")
+    assert fingerprint('SELECT "Pool" FROM t') != fingerprint('SELECT "pool" FROM t')
+    template = onchain_data.templates['swap_arb_pools']
+    assert template.fingerprint('pool_name', 'day', '2023-01-01') == fingerprint(template.render('pool_name', 'day', '2023-01-01'))
+    assert template.fingerprint('pool_name', 'day', '2023-01-01') != template.fingerprint('pool_name', 'day', '2023-01-02')
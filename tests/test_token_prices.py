@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+import onchain_data
+import price_history
+
+TIMESTAMPS = ['2023-01-01 05:30', '2023-01-01 20:00']
+
+def test_historical_prices_from_history_make_no_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(onchain_data, '_coingecko_get', lambda *args: pytest.fail('CoinGecko called'))
+    history = price_history.PriceHistory(str(tmp_path))
+    hours = pd.date_range('2023-01-01', periods = 24, freq = 'h')
+    history.append('GNS', hours, np.arange(24.0))
+    history.append('WETH', hours, np.full(24, 1800.0))
+    prices = onchain_data.get_historical_prices(TIMESTAMPS, history = history)
+    assert list(prices.columns) == list(onchain_data.coingecko_ids.values())
+    np.testing.assert_array_equal(prices['GNS'], [5.0, 20.0])
+    np.testing.assert_array_equal(prices['WETH'], [1800.0, 1800.0])
+    assert prices['DAI'].isna().all()
+
+def test_historical_prices_from_coingecko(monkeypatch):
+    calls = []
+    def coingecko_get(path, params, timeout):
+        calls.append(path)
+        start = params['from'] // 3600 * 3600
+        return {'prices': [[hour * 1000, len(calls) + hour % 86400 / 3600] for hour in range(start, params['to'], 3600)]}
+    monkeypatch.setattr(onchain_data, '_coingecko_get', coingecko_get)
+    prices = onchain_data.get_historical_prices(TIMESTAMPS)
+    # market_chart/range takes one coin per request
+    assert len(calls) == len(onchain_data.coingecko_ids)
+    np.testing.assert_array_equal(prices['DAI'], [1 + 5, 1 + 20])
+
+# simple/price answer for every coin of coingecko_ids, in a different key order than coingecko_ids
+SIMPLE_PRICE = {
+    'usd-coin': {'eth': 0.00055, 'usd': 1.001},
+    'gains-network': {'usd': 5.2, 'eth': 0.0029},
+    'matic-network': {'eth': 0.0006, 'usd': 1.09},
+    'ethereum': {'usd': 1810.5, 'eth': 1},
+    'dai': {'usd': 0.999, 'eth': 0.00055},
+}
+
+def canned(monkeypatch, payload):
+    calls = []
+    def coingecko_get(path, params, timeout):
+        calls.append((path, params))
+        return payload
+    monkeypatch.setattr(onchain_data, '_coingecko_get', coingecko_get)
+    return calls
+
+def test_token_prices(monkeypatch):
+    calls = canned(monkeypatch, SIMPLE_PRICE)
+    prices = onchain_data.get_token_prices()
+    assert prices == {'DAI': 0.999, 'WETH': 1810.5, 'GNS': 5.2, 'MATIC': 1.09, 'USDC': 1.001}
+    assert calls == [('simple/price', {'ids': ','.join(onchain_data.coingecko_ids), 'vs_currencies': 'usd'})]
+
+def test_token_prices_multi(monkeypatch):
+    calls = canned(monkeypatch, SIMPLE_PRICE)
+    prices = onchain_data.get_token_prices_multi(('usd', 'eth'))
+    # One request for every currency
+    assert len(calls) == 1 and calls[0][1]['vs_currencies'] == 'usd,eth'
+    assert list(prices) == ['usd', 'eth']
+    for currency, by_symbol in prices.items():
+        assert by_symbol == {symbol: SIMPLE_PRICE[coin][currency] for coin, symbol in onchain_data.coingecko_ids.items()}
+        assert all(isinstance(price, float) for price in by_symbol.values())
+
+def test_token_prices_missing_coin(monkeypatch):
+    canned(monkeypatch, {coin: prices for coin, prices in SIMPLE_PRICE.items() if coin != 'gains-network'})
+    with pytest.raises(ValueError, match = 'gains-network'):
+        onchain_data.get_token_prices()
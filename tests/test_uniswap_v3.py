@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import query_data
+import uniswap_v3
+
+def test_full_range_without_fee_matches_constant_product():
+    # 1000 GNS against 4000 USDC: the full range position holds the x*y=k curve of AMM_contract
+    pool = uniswap_v3.V3Pool.full_range(1000, 4000, fee = 0.0)
+    table = pool.slippage_table(1.0, 5.0, 200, 'USDC', step = 50)
+    expected = query_data.AMM_contract_vectorized(4000, 1.0, 1000, 5.0, 200, 'USDC', step = 50)
+    pd.testing.assert_frame_equal(table, expected, check_exact = False, check_dtype = False, rtol = 1e-9)
+
+def test_swap_crossing_ticks():
+    price = 4.0
+    tick = uniswap_v3.price_to_tick(price)
+    sqrt_price = np.sqrt(price)
+    # Wide position holding both tokens, plus a narrow one just around the current price
+    wide = (tick - 6000, tick + 6000)
+    narrow = (tick - 600, tick + 600)
+    sqrt_wide, sqrt_narrow = uniswap_v3.tick_to_sqrt_price(wide), uniswap_v3.tick_to_sqrt_price(narrow)
+    liquidity_wide = uniswap_v3.position_liquidity(1e5, 4e5, sqrt_price, *sqrt_wide)
+    liquidity_narrow = uniswap_v3.position_liquidity(5e4, 2e5, sqrt_price, *sqrt_narrow)
+    pool = uniswap_v3.V3Pool.from_positions(price, [(*wide, liquidity_wide * 1e18), (*narrow, liquidity_narrow * 1e18)], fee = 0.003)
+
+    # Token 1 needed to push the price up to the upper tick of the narrow position, fee included
+    to_narrow_upper = (liquidity_wide + liquidity_narrow) * (sqrt_narrow[1] - sqrt_price) / (1 - 0.003)
+    to_wide_upper = to_narrow_upper + liquidity_wide * (sqrt_wide[1] - sqrt_narrow[1]) / (1 - 0.003)
+    result = pool.swap([to_narrow_upper * 0.5, to_narrow_upper * 1.5, to_wide_upper * 2])
+    np.testing.assert_allclose(result['liquidity'][:2], [liquidity_wide + liquidity_narrow, liquidity_wide])
+    assert result['sqrt_price'][0] < sqrt_narrow[1] < result['sqrt_price'][1] < sqrt_wide[1]
+    # Past the last initialized tick there is no liquidity left to fill the trade
+    assert np.isnan(result['amount_out'][2])
+
+    # Output of the swap crossing the narrow upper tick: the in range formula on each of the two segments
+    out_first = (liquidity_wide + liquidity_narrow) * (1 / sqrt_price - 1 / sqrt_narrow[1])
+    sqrt_after = sqrt_narrow[1] + to_narrow_upper * 0.5 * (1 - 0.003) / liquidity_wide
+    out_second = liquidity_wide * (1 / sqrt_narrow[1] - 1 / sqrt_after)
+    np.testing.assert_allclose(result['amount_out'][1], out_first + out_second, rtol = 1e-9)
+    np.testing.assert_allclose(result['sqrt_price'][1], sqrt_after, rtol = 1e-12)
@@ -0,0 +1,160 @@
+import numpy as np
+import query_data
+
+#------------------------------------------ UNISWAP V3 SWAP SIMULATOR ------------------------------------------------#
+# Concentrated liquidity version of query_data.AMM_contract. The GNS pools in onchain_data are Uniswap v3 pools, so the
+# liquidity only sits between initialized ticks instead of over the whole x*y=k curve.
+# The pool is walked tick by tick in closed form: the amount needed to cross every initialized tick is precomputed once
+# as a cumulative array, and each trade size is resolved with a binary search plus the in-range swap formula.
+# Token 0 is GNS, as in the pool_created CTE of the Flipside queries. Buying GNS means swapping token 1 in (price goes up)
+
+MIN_TICK = -887272
+MAX_TICK = 887272
+
+# Fee tiers used by the GNS pools and their tick spacing on Uniswap v3
+FEE_TICK_SPACING = {0.003: 60, 0.01: 200}
+
+def tick_to_sqrt_price(tick):
+    return 1.0001 ** (np.asarray(tick, dtype = float) / 2)
+
+def price_to_tick(price):
+    return np.floor(np.log(price) / np.log(1.0001)).astype(int)
+
+# Liquidity provided by amount0 and amount1 in the [sqrt_lower, sqrt_upper] range (LiquidityAmounts.sol)
+def position_liquidity(amount0, amount1, sqrt_price, sqrt_lower, sqrt_upper):
+    if sqrt_price <= sqrt_lower:
+        return amount0 * sqrt_lower * sqrt_upper / (sqrt_upper - sqrt_lower)
+    if sqrt_price >= sqrt_upper:
+        return amount1 / (sqrt_upper - sqrt_lower)
+    return min(amount0 * sqrt_price * sqrt_upper / (sqrt_upper - sqrt_price), amount1 / (sqrt_price - sqrt_lower))
+
+
+class V3Pool:
+    """Uniswap v3 pool state for swap simulation
+
+    Parameters
+    price: current price of token 0 (GNS) in token 1, in token units
+    ticks: initialized ticks, as read from the pool contract
+    liquidity_net: liquidityNet of each initialized tick, as read from the pool contract
+    fee: pool fee tier, 0.003 or 0.01 for the GNS pools
+    decimals0, decimals1: token decimals, used to move the on-chain ticks and liquidity to token units
+    """
+    def __init__(self, price, ticks, liquidity_net, fee = 0.003, decimals0 = 18, decimals1 = 18):
+        self.price = price
+        self.fee = fee
+        self.sqrt_price = np.sqrt(price)
+
+        ticks = np.asarray(ticks, dtype = int)
+        order = np.argsort(ticks)
+        ticks = ticks[order]
+        liquidity_net = np.asarray(liquidity_net, dtype = float)[order] / 10 ** ((decimals0 + decimals1) / 2)
+        price_scale = 10 ** ((decimals0 - decimals1) / 2)
+
+        # Segment j spans bounds[j] -> bounds[j + 1] and holds liquidity[j]
+        self.bounds = tick_to_sqrt_price(np.concatenate([[MIN_TICK], ticks, [MAX_TICK]])) * price_scale
+        self.liquidity = np.concatenate([[0.0], np.cumsum(liquidity_net)])
+        # Rounding of the running sum leaves a tiny liquidity where every position is closed. Up to MAX_TICK it would
+        # still fill huge trades, so it is set back to 0
+        self.liquidity[np.abs(self.liquidity) <= np.abs(self.liquidity).max() * 1e-9] = 0.0
+        self.current = int(np.clip(np.searchsorted(self.bounds, self.sqrt_price, side = 'right') - 1, 0, len(self.liquidity) - 1))
+
+        self._up = self._walk(zero_for_one = False)
+        self._down = self._walk(zero_for_one = True)
+
+    @classmethod
+    def from_positions(cls, price, positions, fee = 0.003, decimals0 = 18, decimals1 = 18):
+        """Build the pool from (tick_lower, tick_upper, liquidity) positions"""
+        positions = np.asarray(positions, dtype = float).reshape(-1, 3)
+        ticks, inverse = np.unique(positions[:, :2].astype(int), return_inverse = True)
+        liquidity_net = np.zeros(len(ticks))
+        inverse = inverse.reshape(-1, 2)
+        np.add.at(liquidity_net, inverse[:, 0], positions[:, 2])
+        np.add.at(liquidity_net, inverse[:, 1], -positions[:, 2])
+        return cls(price, ticks, liquidity_net, fee, decimals0, decimals1)
+
+    @classmethod
+    def full_range(cls, amount0, amount1, fee = 0.003):
+        """Full range position, equivalent to the x*y=k pool used by AMM_contract"""
+        spacing = FEE_TICK_SPACING.get(fee, 1)
+        liquidity = np.sqrt(amount0 * amount1) * 10 ** 18
+        ticks = [-(MAX_TICK // spacing) * spacing, (MAX_TICK // spacing) * spacing]
+        return cls(amount1 / amount0, ticks, [liquidity, -liquidity], fee)
+
+    def _walk(self, zero_for_one):
+        # Precompute the segments crossed from the current price and the cumulative amounts to cross each of them
+        c = self.current
+        if zero_for_one:
+            starts = np.concatenate([[self.sqrt_price], self.bounds[c:0:-1]])
+            ends = self.bounds[c::-1]
+            liquidity = self.liquidity[c::-1]
+            amount_in = liquidity * (1 / ends - 1 / starts)
+            amount_out = liquidity * (starts - ends)
+        else:
+            starts = np.concatenate([[self.sqrt_price], self.bounds[c + 1:-1]])
+            ends = self.bounds[c + 1:]
+            liquidity = self.liquidity[c:]
+            amount_in = liquidity * (ends - starts)
+            amount_out = liquidity * (1 / starts - 1 / ends)
+        return {
+            'starts': starts,
+            'liquidity': liquidity,
+            'cum_in': np.concatenate([[0.0], np.cumsum(amount_in)]),
+            'cum_out': np.concatenate([[0.0], np.cumsum(amount_out)])
+        }
+
+    def swap(self, amounts_in, zero_for_one = False):
+        """Swap every amount in `amounts_in` against the current pool state
+
+        zero_for_one: True swaps token 0 (GNS) in, False swaps token 1 in to buy GNS
+        Returns a dict of arrays: amount_out, sqrt price after the swap and the active liquidity.
+        Trades larger than the liquidity available in the pool give NaN
+        """
+        walk = self._down if zero_for_one else self._up
+        amounts_in = np.asarray(amounts_in, dtype = float)
+        amounts_net = amounts_in * (1 - self.fee)
+
+        segment = np.searchsorted(walk['cum_in'], amounts_net, side = 'right') - 1
+        filled = segment < len(walk['liquidity'])
+        segment = np.minimum(segment, len(walk['liquidity']) - 1)
+
+        liquidity = walk['liquidity'][segment]
+        start = walk['starts'][segment]
+        remaining = amounts_net - walk['cum_in'][segment]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            step = np.where(liquidity > 0, remaining / liquidity, 0.0)
+            if zero_for_one:
+                sqrt_price_new = 1 / (1 / start + step)
+                amount_out = walk['cum_out'][segment] + liquidity * (start - sqrt_price_new)
+            else:
+                sqrt_price_new = start + step
+                amount_out = walk['cum_out'][segment] + liquidity * (1 / start - 1 / sqrt_price_new)
+
+        return {
+            'amount_in': amounts_in,
+            'amount_out': np.where(filled, amount_out, np.nan),
+            'sqrt_price': np.where(filled, sqrt_price_new, np.nan),
+            'liquidity': liquidity
+        }
+
+    def slippage_table(self, in_price_usd, out_price_usd, deposit_limit, token_from, step = 20):
+        """Buy GNS with token 1 over the AMM_contract deposit grid. Same columns as query_data.AMM_contract.
+        Reserves are the virtual reserves of the active range after each deposit"""
+        deposits = query_data.deposit_grid(deposit_limit, step)
+        result = self.swap(deposits, zero_for_one = False)
+        out_price = deposits / result['amount_out']
+        amount_in_usd = deposits * in_price_usd
+        amount_out_usd = result['amount_out'] * out_price_usd
+        arrays = {
+            'token_deposit': deposits,
+            'in_amount': result['liquidity'] * result['sqrt_price'],
+            'out_amount': result['liquidity'] / result['sqrt_price'],
+            'K': result['liquidity'] ** 2,
+            'out_price': out_price,
+            'in_price': out_price**-1,
+            'out_price_usd': out_price * in_price_usd,
+            'slippage_percent': (out_price - out_price[0]) / out_price[0] * 100,
+            'amount_in_usd': amount_in_usd,
+            'amount_out_usd': amount_out_usd,
+            'slippage_usd': amount_in_usd - amount_out_usd
+        }
+        return query_data.AMM_frame(arrays, token_from)